@@ -0,0 +1,131 @@
+"""
+读取键盘鼠标空闲时间、是否锁屏、当前前台程序和登录的用户，用于使用心跳、自适应截图间隔和按用户切换配置。
+Windows 上通过 user32/kernel32/wtsapi32 查询；其他系统（以及模拟器）返回 0、空字符串和运行程序的用户。
+"""
+import ctypes
+import getpass
+import logging
+import os
+import sys
+
+
+class ActivityProbe:
+    """默认实现：无法探测时认为一直在使用，前台程序未知"""
+
+    def idle_seconds(self) -> float:
+        return 0.0
+
+    def active_app(self) -> str:
+        return ''
+
+    def locked(self) -> bool:
+        return False
+
+    def user(self) -> str:
+        """当前登录的用户名；没有用户登录时返回空字符串"""
+        try:
+            return getpass.getuser()
+        except (KeyError, OSError):
+            return ''
+
+
+class WindowsActivityProbe(ActivityProbe):
+    PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+    DESKTOP_SWITCHDESKTOP = 0x0100
+    WTS_CURRENT_SERVER_HANDLE = None
+    WTS_USER_NAME = 5
+    NO_CONSOLE_SESSION = 0xFFFFFFFF
+
+    class _LastInputInfo(ctypes.Structure):
+        _fields_ = [('cbSize', ctypes.c_uint), ('dwTime', ctypes.c_uint)]
+
+    def __init__(self) -> None:
+        from ctypes import wintypes
+        self.logger = logging.getLogger("ActivityProbe")
+        self._wintypes = wintypes
+        self._user32 = ctypes.windll.user32
+        self._kernel32 = ctypes.windll.kernel32
+        self._kernel32.GetTickCount.restype = ctypes.c_uint
+        self._kernel32.WTSGetActiveConsoleSessionId.restype = ctypes.c_uint
+        self._wtsapi32 = ctypes.windll.wtsapi32
+        self._wtsapi32.WTSQuerySessionInformationW.argtypes = [
+            ctypes.c_void_p, ctypes.c_uint, ctypes.c_int,
+            ctypes.POINTER(ctypes.c_wchar_p), ctypes.POINTER(ctypes.c_uint)]
+        self._wtsapi32.WTSFreeMemory.argtypes = [ctypes.c_void_p]
+        # 桌面句柄是指针，默认的 int 返回值在 64 位系统上会被截断
+        self._user32.OpenInputDesktop.restype = ctypes.c_void_p
+        self._user32.SwitchDesktop.argtypes = [ctypes.c_void_p]
+        self._user32.CloseDesktop.argtypes = [ctypes.c_void_p]
+        self._info = self._LastInputInfo()
+        self._info.cbSize = ctypes.sizeof(self._info)
+        # 同一个窗口句柄不重复查询进程名
+        self._last_hwnd = None
+        self._last_app = ''
+
+    def idle_seconds(self) -> float:
+        if not self._user32.GetLastInputInfo(ctypes.byref(self._info)):
+            return 0.0
+        # GetTickCount 约 49.7 天回绕一次，按无符号 32 位相减
+        return ((self._kernel32.GetTickCount() - self._info.dwTime) & 0xFFFFFFFF) / 1000.0
+
+    def active_app(self) -> str:
+        hwnd = self._user32.GetForegroundWindow()
+        if not hwnd:
+            return ''
+        if hwnd == self._last_hwnd:
+            return self._last_app
+        pid = self._wintypes.DWORD()
+        self._user32.GetWindowThreadProcessId(hwnd, ctypes.byref(pid))
+        app = ''
+        handle = self._kernel32.OpenProcess(self.PROCESS_QUERY_LIMITED_INFORMATION, False, pid.value)
+        if handle:
+            try:
+                size = self._wintypes.DWORD(260)
+                buffer = ctypes.create_unicode_buffer(size.value)
+                if self._kernel32.QueryFullProcessImageNameW(handle, 0, buffer, ctypes.byref(size)):
+                    app = os.path.basename(buffer.value)
+            finally:
+                self._kernel32.CloseHandle(handle)
+        if not app:
+            # 无权限查询的进程（例如管理员程序）退回到窗口标题
+            length = self._user32.GetWindowTextLengthW(hwnd)
+            buffer = ctypes.create_unicode_buffer(length + 1)
+            self._user32.GetWindowTextW(hwnd, buffer, length + 1)
+            app = buffer.value
+        self._last_hwnd, self._last_app = hwnd, app
+        return app
+
+    def locked(self) -> bool:
+        # 锁屏时输入桌面切换到 Winlogon，普通进程无法打开或切换到它
+        desktop = self._user32.OpenInputDesktop(0, False, self.DESKTOP_SWITCHDESKTOP)
+        if not desktop:
+            return True
+        try:
+            return not self._user32.SwitchDesktop(desktop)
+        finally:
+            self._user32.CloseDesktop(desktop)
+
+    def user(self) -> str:
+        # 快速切换用户时程序可能运行在另一个会话里，以控制台会话（正在使用屏幕的用户）为准
+        session = self._kernel32.WTSGetActiveConsoleSessionId()
+        if session == self.NO_CONSOLE_SESSION:
+            return ''
+        buffer = ctypes.c_wchar_p()
+        size = ctypes.c_uint()
+        if not self._wtsapi32.WTSQuerySessionInformationW(self.WTS_CURRENT_SERVER_HANDLE, session,
+                                                          self.WTS_USER_NAME, ctypes.byref(buffer),
+                                                          ctypes.byref(size)):
+            return super().user()
+        try:
+            return buffer.value or ''
+        finally:
+            self._wtsapi32.WTSFreeMemory(buffer)
+
+
+def default_probe() -> ActivityProbe:
+    if sys.platform == 'win32':
+        try:
+            return WindowsActivityProbe()
+        except (AttributeError, OSError) as e:
+            logging.getLogger("ActivityProbe").warning(f"Activity probe unavailable: {e}")
+    return ActivityProbe()
@@ -0,0 +1,169 @@
+"""
+发送器离线基准测试。
+
+在本地启动 Telegram / 钉钉 / ImgBB 替身服务，用合成截图驱动 ScreenshotSender 和 DingTalkSender，
+报告每种配置的吞吐量、p50/p99 延迟和发送字节数。结果可保存为 JSON，下次运行时用 --compare 对比。
+
+示例:
+    python benchmark.py
+    python benchmark.py --iterations 50 --profile slow:latency=0.2,bandwidth_kbps=8000 --json bench.json
+    python benchmark.py --compare bench.json
+    python benchmark.py --capture --resolutions 1280x720,1920x1080,3840x2160
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from capture_backends import SyntheticCapture, benchmark_capture, format_capture_results
+from config_manager import ConfigManager
+from dingtalk_sender import DingTalkSender
+from screenshot_sender import ScreenshotSender
+from stand_in_servers import NetworkProfile, StandInServer, parse_profile
+
+DEFAULT_PROFILES: Dict[str, NetworkProfile] = {
+    'lan': NetworkProfile(),
+    'home': NetworkProfile(latency=0.05, bandwidth_kbps=20000, seed=1),
+    'flaky': NetworkProfile(latency=0.05, bandwidth_kbps=20000, failure_rate=0.1, throttle_rate=0.1, seed=2),
+}
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def _make_config(workdir: str, server: StandInServer) -> ConfigManager:
+    config = ConfigManager(os.path.join(workdir, 'config.ini'))
+    for key, value in {
+        'dataFolder': os.path.join(workdir, 'frames'),
+        'usageStatsFile': os.path.join(workdir, 'usage_stats.json'),
+        'botToken': 'stand-in-token',
+        'chatId': '1',
+        'proxy': '',
+        'telegramApiUrl': server.telegram_api_url,
+        'dingtalkWebhook': server.dingtalk_webhook_url,
+        'imgbbApi': 'stand-in-key',
+        'imgbbUploadUrl': server.imgbb_upload_url,
+    }.items():
+        config.set_setting('Settings', key, value)
+    config.save_config()
+    return config
+
+
+def run_case(sender_name: str, profile_name: str, profile: NetworkProfile, iterations: int,
+             width: int, height: int) -> Dict[str, Any]:
+    """对一种发送器和网络条件运行若干个完整的截图-发送周期"""
+    workdir = tempfile.mkdtemp(prefix='kidpc-bench-')
+    try:
+        with StandInServer(profile) as server:
+            config = _make_config(workdir, server)
+            capture = SyntheticCapture(width, height, seed=42)
+            send: Callable[[], bool]
+            if sender_name == 'telegram':
+                telegram = ScreenshotSender(config, capture=capture)
+                send = lambda: telegram.send_screenshot(0)
+            else:
+                dingtalk = DingTalkSender(config, capture=capture)
+                dingtalk.screenshot_filename = os.path.join(workdir, 'dingtalk_screenshot_temp.png')
+                send = dingtalk.send_screenshot
+
+            latencies: List[float] = []
+            successes = 0
+            started = time.perf_counter()
+            for _ in range(iterations):
+                t0 = time.perf_counter()
+                if send():
+                    successes += 1
+                latencies.append(time.perf_counter() - t0)
+            elapsed = time.perf_counter() - started
+
+            statuses: Dict[str, int] = {}
+            for request in server.requests:
+                statuses[request.status] = statuses.get(request.status, 0) + 1
+            return {
+                'sender': sender_name,
+                'profile': profile_name,
+                'iterations': iterations,
+                'resolution': f"{width}x{height}",
+                'successes': successes,
+                'throughput_per_s': iterations / elapsed if elapsed else 0.0,
+                'p50_s': percentile(latencies, 0.5),
+                'p99_s': percentile(latencies, 0.99),
+                'mean_s': statistics.mean(latencies) if latencies else 0.0,
+                'bytes_sent': server.bytes_received(),
+                'requests': len(server.requests),
+                'statuses': statuses,
+            }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def format_results(results: List[Dict[str, Any]], previous: Optional[Dict[Tuple[str, str], Dict[str, Any]]] = None) -> str:
+    header = f"{'sender':<10}{'profile':<10}{'ok':>8}{'cycles/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'MB sent':>10}  requests"
+    lines = [header, '-' * len(header)]
+    for r in results:
+        line = (f"{r['sender']:<10}{r['profile']:<10}{r['successes']:>4}/{r['iterations']:<3}"
+                f"{r['throughput_per_s']:>10.2f}{r['p50_s'] * 1000:>10.1f}{r['p99_s'] * 1000:>10.1f}"
+                f"{r['bytes_sent'] / 1e6:>10.2f}  {r['statuses']}")
+        before = (previous or {}).get((r['sender'], r['profile']))
+        if before and before['p50_s']:
+            line += f"  (p50 {(r['p50_s'] / before['p50_s'] - 1) * 100:+.0f}%, " \
+                    f"bytes {(r['bytes_sent'] / max(before['bytes_sent'], 1) - 1) * 100:+.0f}%)"
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="KidPC 发送器离线基准测试")
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--sender', choices=['telegram', 'dingtalk', 'all'], default='all')
+    parser.add_argument('--profile', action='append', default=[],
+                        help="name[:key=value,...]，可重复；默认 lan/home/flaky")
+    parser.add_argument('--json', help="把结果写入 JSON 文件")
+    parser.add_argument('--compare', help="与之前保存的 JSON 结果对比")
+    parser.add_argument('--verbose', action='store_true')
+    parser.add_argument('--capture', action='store_true', help="测试截图后端的 fps 和每帧 CPU 时间")
+    parser.add_argument('--backends', default='pil,xshm,synthetic', help="--capture 测试的后端，逗号分隔")
+    parser.add_argument('--resolutions', default='1280x720,1920x1080,3840x2160',
+                        help="--capture 测试的截图区域，真实屏幕更小时按屏幕大小截取")
+    args = parser.parse_args()
+
+    if args.capture:
+        resolutions = [tuple(int(v) for v in r.split('x')) for r in args.resolutions.split(',')]
+        print(format_capture_results(benchmark_capture(args.backends.split(','), resolutions, args.iterations)))
+        return
+
+    # 失败和限流是测试的一部分，默认不输出发送器的错误日志
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    profiles = dict(parse_profile(p) for p in args.profile) if args.profile else DEFAULT_PROFILES
+    senders = ['telegram', 'dingtalk'] if args.sender == 'all' else [args.sender]
+
+    results = [run_case(sender, name, profile, args.iterations, args.width, args.height)
+               for sender in senders for name, profile in profiles.items()]
+
+    previous = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            previous = {(r['sender'], r['profile']): r for r in json.load(f)['results']}
+    print(format_results(results, previous))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+"""
+允许使用时段的日历规则：每周固定时段、节假日列表和按日期的例外，编译成按时间排序的区段表，
+用二分查找回答"现在处于哪个阶段 / 下一次变化在什么时候"，每次查询 O(log n)。
+
+规则写在 config.ini 的 [Schedule] 段（可选），例如:
+
+    [Schedule]
+    weekdays = 16:00-21:00
+    weekend = 09:00-12:00, 14:00-21:30
+    fri = 16:00-22:00
+    holidays = 2026-10-01..2026-10-07, 2027-01-01
+    holiday = 09:00-21:30
+    2026-10-24 = 09:00-11:00
+    reminderLead = 30
+    forcedGrace = 30
+
+同一天的时段按 日期例外 > 节假日(holiday) > 星期(mon..sun) > weekdays/weekend > daily 的顺序取第一个有定义的，
+都没有定义的日子按原来的设置（见下）；值留空表示全天不允许。结束时间可写 24:00，结束早于开始表示跨过午夜（22:00-01:00）。
+
+没有 [Schedule] 段时按原来的设置生成等价规则：每天 00:00 到 shutdownPlanHour:shutdownPlanMinute，
+提前量为 firstReminderHour 到计划关机时间，宽限为计划关机到 forcedShutdownHour
+（计划关机时间无效时用默认的 21:30，forcedShutdownHour 不晚于计划关机时间时在计划关机时间强制关机）。
+
+每个允许时段结束前 reminderLead 分钟进入提醒阶段，结束后进入计划关机阶段，
+再过 forcedGrace 分钟直到下一个时段开始都是强制关机阶段。
+"""
+import bisect
+import datetime
+import logging
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+from clock import Clock, SYSTEM_CLOCK
+from config_manager import SETTINGS_SCHEMA, ConfigManager
+
+SECTION = 'Schedule'
+
+# 阶段，数值越大限制越严
+ALLOWED = 0
+REMINDER = 1
+PLANNED_SHUTDOWN = 2
+FORCED = 3
+ZONE_NAMES = ('allowed', 'reminder', 'planned_shutdown', 'forced')
+
+DAY_KEYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+# 编译的范围：查询日期前后各这么多天，超出后重新编译
+HORIZON_BEFORE_DAYS = 2
+HORIZON_AFTER_DAYS = 14
+
+Window = Tuple[datetime.time, int]  # (开始时间, 时长分钟)
+
+
+def parse_windows(text: str) -> List[Window]:
+    """'09:00-12:00, 22:00-01:00' → [(09:00, 180), (22:00, 180)]；空字符串或 none 表示没有时段"""
+    windows = []
+    text = text.strip()
+    if not text or text.lower() == 'none':
+        return windows
+    for part in text.split(','):
+        start_text, sep, end_text = part.strip().partition('-')
+        if not sep:
+            raise ValueError(f"bad time window '{part.strip()}'")
+        start = datetime.datetime.strptime(start_text.strip(), '%H:%M').time()
+        end_hour, _, end_minute = end_text.strip().partition(':')
+        end = int(end_hour) * 60 + int(end_minute)
+        if not 0 <= end <= 24 * 60 or not 0 <= int(end_minute) < 60:
+            raise ValueError(f"bad end time '{end_text.strip()}'")
+        begin = start.hour * 60 + start.minute
+        length = end - begin if end > begin else end + 24 * 60 - begin
+        windows.append((start, length))
+    return windows
+
+
+def parse_dates(text: str) -> Set[datetime.date]:
+    """'2026-10-01..2026-10-07, 2027-01-01' → 日期集合"""
+    dates = set()
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition('..')
+        day = datetime.date.fromisoformat(first.strip())
+        end = datetime.date.fromisoformat(last.strip()) if last else day
+        while day <= end:
+            dates.add(day)
+            day += datetime.timedelta(days=1)
+    return dates
+
+
+class ScheduleCalendar:
+    """
+    共享的日历：RestReminder 判断提醒和关机，QuotaEngine 决定节假日的额度和下一个截止时间，
+    FloatWindow 显示剩余可用时间。配置变化后在下一次查询时重新编译。
+    """
+    logger: logging.Logger
+    config_manager: ConfigManager
+    reminder_lead: int
+    forced_grace: int
+
+    def __init__(self, config_manager: ConfigManager, clock: Clock = SYSTEM_CLOCK) -> None:
+        self.logger = logging.getLogger("Schedule")
+        self.config_manager = config_manager
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._weekly: List[List[Window]] = [[] for _ in DAY_KEYS]
+        self._holiday: Optional[List[Window]] = None
+        self._holidays: Set[datetime.date] = set()
+        self._exceptions: Dict[datetime.date, List[Window]] = {}
+        # 编译结果：区段开始时间（升序）和对应的阶段，区段 i 覆盖 [_starts[i], _starts[i + 1])
+        self._starts: List[datetime.datetime] = []
+        self._zones: List[int] = []
+        self._range: Tuple[datetime.date, datetime.date] = (datetime.date.max, datetime.date.min)
+
+        self.apply_config()
+        self.config_manager.add_listener(self._on_config_changed)
+
+    def _legacy_plan(self) -> Tuple[int, int, int]:
+        """按原来的设置得到 (计划关机的分钟数, 提醒提前量, 强制关机宽限)；无效的值按默认值或计划关机时间处理"""
+        get = self.config_manager.get
+        plan = int(get('shutdownPlanHour')) * 60 + int(get('shutdownPlanMinute'))
+        if not 0 < plan < 24 * 60 or not 0 <= int(get('shutdownPlanMinute')) < 60:
+            default = SETTINGS_SCHEMA['shutdownPlanHour'].default * 60 + SETTINGS_SCHEMA['shutdownPlanMinute'].default
+            self.logger.error(f"Invalid shutdown plan time {get('shutdownPlanHour')}:{get('shutdownPlanMinute')}, "
+                              f"using {default // 60:02d}:{default % 60:02d}")
+            plan = default
+        forced = int(get('forcedShutdownHour')) * 60
+        if forced <= plan:
+            self.logger.error(f"forcedShutdownHour {get('forcedShutdownHour')} is not after the shutdown plan time, "
+                              f"forcing shutdown at the plan time")
+            forced = plan
+        return plan, max(0, plan - int(get('firstReminderHour')) * 60), min(forced, 24 * 60) - plan
+
+    def apply_config(self) -> None:
+        plan, legacy_lead, legacy_grace = self._legacy_plan()
+        rules = self.config_manager.get_all_settings().get(SECTION, {})
+
+        legacy_day: List[Window] = [(datetime.time(0, 0), plan)]
+        weekly: List[List[Window]] = [legacy_day for _ in DAY_KEYS]
+        holiday: Optional[List[Window]] = None
+        holidays: Set[datetime.date] = set()
+        exceptions: Dict[datetime.date, List[Window]] = {}
+        lead, grace = legacy_lead, legacy_grace
+        if rules:
+            # configparser 的键名是小写；按优先级从低到高覆盖
+            defined: Dict[str, List[Window]] = {}
+            for key, value in rules.items():
+                try:
+                    if key == 'reminderlead':
+                        lead = int(value)
+                    elif key == 'forcedgrace':
+                        grace = int(value)
+                    elif key == 'holidays':
+                        holidays = parse_dates(value)
+                    elif key == 'holiday':
+                        holiday = parse_windows(value)
+                    elif key in DAY_KEYS or key in ('daily', 'weekdays', 'weekend'):
+                        defined[key] = parse_windows(value)
+                    else:
+                        exceptions[datetime.date.fromisoformat(key)] = parse_windows(value)
+                except ValueError as e:
+                    self.logger.error(f"Ignoring invalid schedule rule '{key} = {value}': {e}")
+            for day, name in enumerate(DAY_KEYS):
+                group = 'weekend' if day >= 5 else 'weekdays'
+                for key in (name, group, 'daily'):
+                    if key in defined:
+                        weekly[day] = defined[key]
+                        break
+
+        with self._lock:
+            self._weekly, self._holiday, self._holidays, self._exceptions = weekly, holiday, holidays, exceptions
+            self.reminder_lead, self.forced_grace = lead, grace
+            self._range = (datetime.date.max, datetime.date.min)  # 下一次查询时重新编译
+
+    def _on_config_changed(self, changed: Set[str]) -> None:
+        if changed & {'firstReminderHour', 'shutdownPlanHour', 'shutdownPlanMinute', 'forcedShutdownHour'} or \
+                any(key.startswith(SECTION + '.') for key in changed):
+            self.apply_config()
+            self.logger.info("Schedule rules reloaded.")
+
+    def is_holiday(self, day: datetime.date) -> bool:
+        return day in self._holidays
+
+    def quota_weekday(self, day: datetime.date) -> int:
+        """每日额度按哪一天计算：节假日按周日，其他按当天的星期"""
+        return 6 if day in self._holidays else day.weekday()
+
+    def windows_for(self, day: datetime.date) -> List[Window]:
+        if day in self._exceptions:
+            return self._exceptions[day]
+        if day in self._holidays:
+            return self._holiday if self._holiday is not None else self._weekly[6]
+        return self._weekly[day.weekday()]
+
+    def _compile(self, around: datetime.date) -> None:
+        """把 around 前后的允许时段展开、合并相连的时段，再切分成各阶段的区段；调用方持有锁"""
+        first = around - datetime.timedelta(days=HORIZON_BEFORE_DAYS)
+        last = around + datetime.timedelta(days=HORIZON_AFTER_DAYS)
+        spans: List[Tuple[datetime.datetime, datetime.datetime]] = []
+        day = first
+        while day <= last:
+            for start, length in self.windows_for(day):
+                begin = datetime.datetime.combine(day, start)
+                spans.append((begin, begin + datetime.timedelta(minutes=length)))
+            day += datetime.timedelta(days=1)
+        spans.sort()
+        merged: List[Tuple[datetime.datetime, datetime.datetime]] = []
+        for begin, end in spans:
+            if merged and begin <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            elif end > begin:
+                merged.append((begin, end))
+
+        lead = datetime.timedelta(minutes=self.reminder_lead)
+        grace = datetime.timedelta(minutes=self.forced_grace)
+        starts = [datetime.datetime.combine(first, datetime.time(0, 0))]
+        zones = [FORCED]
+
+        def add(at: datetime.datetime, zone: int) -> None:
+            if at == starts[-1]:
+                zones[-1] = zone
+            elif zone != zones[-1]:
+                starts.append(at)
+                zones.append(zone)
+
+        for i, (begin, end) in enumerate(merged):
+            add(begin, ALLOWED)
+            add(max(begin, end - lead), REMINDER)
+            add(end, PLANNED_SHUTDOWN)
+            following = merged[i + 1][0] if i + 1 < len(merged) else None
+            if following is None or end + grace < following:
+                add(end + grace, FORCED)
+        self._starts, self._zones = starts, zones
+        # 保留两端各一天的余量：最后一天的时段可能跨到后一天
+        self._range = (first + datetime.timedelta(days=1), last - datetime.timedelta(days=1))
+        self.logger.debug("Compiled %d schedule segments for %s..%s", len(starts), first, last)
+
+    def _index(self, at: datetime.datetime) -> int:
+        """at 所在区段的下标；调用方持有锁"""
+        if not self._range[0] <= at.date() <= self._range[1]:
+            self._compile(at.date())
+        return bisect.bisect_right(self._starts, at) - 1
+
+    def zone(self, at: Optional[datetime.datetime] = None) -> int:
+        with self._lock:
+            i = self._index(at or self.clock.now())  # 先查找：可能重新编译，替换区段表
+            return self._zones[i]
+
+    def is_allowed(self, at: Optional[datetime.datetime] = None) -> bool:
+        return self.zone(at) <= REMINDER
+
+    def next_boundary(self, at: Optional[datetime.datetime] = None) -> Optional[Tuple[datetime.datetime, int]]:
+        """下一次阶段变化的时间和变化后的阶段；规则中没有任何允许时段时返回 None"""
+        at = at or self.clock.now()
+        with self._lock:
+            i = self._index(at)
+            if i + 1 < len(self._starts):
+                return self._starts[i + 1], self._zones[i + 1]
+        return None
+
+    def next_zone_start(self, zone: int, at: Optional[datetime.datetime] = None) -> Optional[datetime.datetime]:
+        """at 之后（含正处于的）最近一次进入 zone 阶段的时间；编译范围内没有时返回 None"""
+        at = at or self.clock.now()
+        with self._lock:
+            i = self._index(at)
+            if self._zones[i] == zone:
+                return self._starts[i]
+            for j in range(i + 1, len(self._zones)):
+                if self._zones[j] == zone:
+                    return self._starts[j]
+        return None
+
+    def allowed_until(self, at: Optional[datetime.datetime] = None) -> Optional[datetime.datetime]:
+        """当前允许时段的结束时间；不在允许时段内时返回 None"""
+        at = at or self.clock.now()
+        if not self.is_allowed(at):
+            return None
+        return self.next_zone_start(PLANNED_SHUTDOWN, at)
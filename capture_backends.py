@@ -0,0 +1,337 @@
+"""
+截图后端。发送器通过 create_capture() 取得一个可调用对象，每次调用返回一张 PIL 图像。
+
+- pil:       PIL.ImageGrab（Windows / macOS 的默认方式，Linux 上每次都是一次完整的 X 往返）
+- xshm:      X11 MIT-SHM 共享内存，图像缓冲区只分配一次，之后每帧由 X 服务器直接写入（仅 Linux）
+- synthetic: 合成桌面图像，用于基准测试和模拟
+- auto:      Linux 上优先 xshm，不可用时退回 pil
+"""
+import ctypes
+import ctypes.util
+import logging
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from PIL import Image, ImageDraw, ImageGrab
+
+from memory_budget import fit_to_budget, reduce_factor
+
+BBox = Tuple[int, int, int, int]
+
+BACKENDS = ('auto', 'pil', 'xshm', 'synthetic')
+
+
+class CaptureBackend:
+    name = 'base'
+
+    def grab(self) -> Image.Image:
+        raise NotImplementedError
+
+    def __call__(self) -> Image.Image:
+        return self.grab()
+
+    def grab_scaled(self, max_pixels: int) -> Image.Image:
+        """截图并按整数倍缩小到不超过 max_pixels（0 表示不限）"""
+        return fit_to_budget(self.grab(), max_pixels)
+
+    def close(self) -> None:
+        pass
+
+
+class PilCapture(CaptureBackend):
+    name = 'pil'
+
+    def __init__(self, all_screens: bool = True, bbox: Optional[BBox] = None) -> None:
+        self.all_screens = all_screens
+        self.bbox = bbox
+
+    def grab(self) -> Image.Image:
+        return ImageGrab.grab(bbox=self.bbox, all_screens=self.all_screens)
+
+
+class _XImage(ctypes.Structure):
+    # 只声明用到的前几个字段，通过指针访问
+    _fields_ = [('width', ctypes.c_int), ('height', ctypes.c_int), ('xoffset', ctypes.c_int),
+                ('format', ctypes.c_int), ('data', ctypes.c_void_p), ('byte_order', ctypes.c_int),
+                ('bitmap_unit', ctypes.c_int), ('bitmap_bit_order', ctypes.c_int), ('bitmap_pad', ctypes.c_int),
+                ('depth', ctypes.c_int), ('bytes_per_line', ctypes.c_int), ('bits_per_pixel', ctypes.c_int)]
+
+
+class _XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [('shmseg', ctypes.c_ulong), ('shmid', ctypes.c_int), ('shmaddr', ctypes.c_void_p),
+                ('readOnly', ctypes.c_int)]
+
+
+class XShmCapture(CaptureBackend):
+    """
+    通过 MIT-SHM 扩展截取 X11 根窗口（包含所有显示器）。
+    共享内存段在构造时创建一次，每帧只有一次 X 请求和一次 BGRX→RGB 转换。
+    每个实例持有自己的 X 连接，只能在一个线程中使用。
+    """
+    name = 'xshm'
+    ZPIXMAP = 2
+    IPC_PRIVATE = 0
+    IPC_CREAT = 0o1000
+    IPC_RMID = 0
+
+    def __init__(self, bbox: Optional[BBox] = None) -> None:
+        x11_path, xext_path = ctypes.util.find_library('X11'), ctypes.util.find_library('Xext')
+        if not x11_path or not xext_path:
+            raise OSError("libX11 / libXext not found")
+        self._x11 = x11 = ctypes.CDLL(x11_path)
+        self._xext = xext = ctypes.CDLL(xext_path)
+        self._libc = libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        vp = ctypes.c_void_p
+        x11.XOpenDisplay.restype = vp
+        x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        for func in ('XDefaultScreen', 'XDisplayWidth', 'XDisplayHeight', 'XDefaultDepth'):
+            getattr(x11, func).argtypes = [vp] + ([ctypes.c_int] if func != 'XDefaultScreen' else [])
+        x11.XRootWindow.restype = ctypes.c_ulong
+        x11.XRootWindow.argtypes = [vp, ctypes.c_int]
+        x11.XDefaultVisual.restype = vp
+        x11.XDefaultVisual.argtypes = [vp, ctypes.c_int]
+        x11.XSync.argtypes = [vp, ctypes.c_int]
+        x11.XFree.argtypes = [vp]
+        x11.XCloseDisplay.argtypes = [vp]
+        xext.XShmQueryExtension.argtypes = [vp]
+        xext.XShmCreateImage.restype = ctypes.POINTER(_XImage)
+        xext.XShmCreateImage.argtypes = [vp, vp, ctypes.c_uint, ctypes.c_int, vp,
+                                         ctypes.POINTER(_XShmSegmentInfo), ctypes.c_uint, ctypes.c_uint]
+        xext.XShmAttach.argtypes = [vp, ctypes.POINTER(_XShmSegmentInfo)]
+        xext.XShmDetach.argtypes = [vp, ctypes.POINTER(_XShmSegmentInfo)]
+        xext.XShmGetImage.argtypes = [vp, ctypes.c_ulong, ctypes.POINTER(_XImage), ctypes.c_int, ctypes.c_int,
+                                      ctypes.c_ulong]
+        libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+        libc.shmat.restype = vp
+        libc.shmat.argtypes = [ctypes.c_int, vp, ctypes.c_int]
+        libc.shmdt.argtypes = [vp]
+        libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, vp]
+
+        self._display = x11.XOpenDisplay(None)
+        if not self._display:
+            raise OSError("cannot open X display")
+        self._image = None
+        self._shminfo = _XShmSegmentInfo()
+        self._shminfo.shmid = -1
+        self._attached = False
+        try:
+            if not xext.XShmQueryExtension(self._display):
+                raise OSError("X server does not support MIT-SHM")
+            screen = x11.XDefaultScreen(self._display)
+            self._root = x11.XRootWindow(self._display, screen)
+            screen_w, screen_h = x11.XDisplayWidth(self._display, screen), x11.XDisplayHeight(self._display, screen)
+            left, top, right, bottom = bbox or (0, 0, screen_w, screen_h)
+            self.left, self.top = max(0, left), max(0, top)
+            self.width, self.height = min(right, screen_w) - self.left, min(bottom, screen_h) - self.top
+
+            self._image = xext.XShmCreateImage(self._display, x11.XDefaultVisual(self._display, screen),
+                                               x11.XDefaultDepth(self._display, screen), self.ZPIXMAP, None,
+                                               ctypes.byref(self._shminfo), self.width, self.height)
+            if not self._image:
+                raise OSError("XShmCreateImage failed")
+            image = self._image.contents
+            if image.bits_per_pixel != 32:
+                raise OSError(f"unsupported X visual ({image.bits_per_pixel} bits per pixel)")
+            self.stride = image.bytes_per_line
+            self._size = self.stride * self.height
+            self._shminfo.shmid = libc.shmget(self.IPC_PRIVATE, self._size, self.IPC_CREAT | 0o600)
+            if self._shminfo.shmid < 0:
+                raise OSError(ctypes.get_errno(), "shmget failed")
+            self._shminfo.shmaddr = libc.shmat(self._shminfo.shmid, None, 0)
+            if self._shminfo.shmaddr in (None, ctypes.c_void_p(-1).value):
+                raise OSError(ctypes.get_errno(), "shmat failed")
+            image.data = self._shminfo.shmaddr
+            self._shminfo.readOnly = 0
+            if not xext.XShmAttach(self._display, ctypes.byref(self._shminfo)):
+                raise OSError("XShmAttach failed")
+            self._attached = True
+            x11.XSync(self._display, 0)
+            # 标记删除：所有进程分离后由内核回收，程序异常退出也不会泄漏共享内存
+            libc.shmctl(self._shminfo.shmid, self.IPC_RMID, None)
+            self._shminfo.shmid = -1
+            self._buffer = (ctypes.c_char * self._size).from_address(self._shminfo.shmaddr)
+        except Exception:
+            self.close()
+            raise
+
+    def grab(self) -> Image.Image:
+        if not self._xext.XShmGetImage(self._display, self._root, self._image, self.left, self.top, 0xFFFFFFFF):
+            raise OSError("XShmGetImage failed")
+        # BGRX → RGB 的解码在 C 中完成，结果是独立的图像，下一帧覆盖缓冲区不影响它
+        return Image.frombuffer('RGB', (self.width, self.height), self._buffer, 'raw', 'BGRX', self.stride, 1)
+
+    def grab_scaled(self, max_pixels: int) -> Image.Image:
+        """
+        需要缩小时不复制全尺寸图像：直接在共享内存上建立零复制的 RGBX 视图（通道顺序实际为 BGRX），
+        缩小后再交换通道，只有缩小后的图像会被分配。
+        """
+        factor = reduce_factor(self.width, self.height, max_pixels)
+        if factor == 1:
+            return self.grab()
+        if not self._xext.XShmGetImage(self._display, self._root, self._image, self.left, self.top, 0xFFFFFFFF):
+            raise OSError("XShmGetImage failed")
+        view = Image.frombuffer('RGBX', (self.width, self.height), self._buffer, 'raw', 'RGBX', self.stride, 1)
+        blue, green, red, _ = view.reduce(factor).split()
+        return Image.merge('RGB', (red, green, blue))
+
+    def close(self) -> None:
+        if self._display is None:
+            return
+        if self._attached:
+            self._xext.XShmDetach(self._display, ctypes.byref(self._shminfo))
+            self._x11.XSync(self._display, 0)
+            self._attached = False
+        if self._shminfo.shmaddr:
+            self._libc.shmdt(self._shminfo.shmaddr)
+            self._shminfo.shmaddr = None
+        if self._shminfo.shmid >= 0:
+            self._libc.shmctl(self._shminfo.shmid, self.IPC_RMID, None)
+        if self._image:
+            self._image.contents.data = None
+            self._x11.XFree(self._image)
+            self._image = None
+        self._x11.XCloseDisplay(self._display)
+        self._display = None
+
+
+class SyntheticCapture(CaptureBackend):
+    """
+    合成截图来源：生成带有窗口、文字块和噪点的桌面图像，每帧只改变一部分区域，
+    压缩后的大小接近真实桌面截图。
+    """
+    name = 'synthetic'
+
+    def __init__(self, width: int = 1920, height: int = 1080, change_ratio: float = 0.1, seed: int = 0) -> None:
+        self.width = width
+        self.height = height
+        self.change_ratio = change_ratio
+        self.random = random.Random(seed)
+        self.frame = self._background()
+        self.frames = 0
+
+    def _background(self) -> Image.Image:
+        image = Image.new('RGB', (self.width, self.height), (32, 64, 96))
+        for _ in range(12):
+            self._draw_window(image, self.random.randint(0, self.width), self.random.randint(0, self.height))
+        return image
+
+    def _draw_window(self, image: Image.Image, x: int, y: int) -> None:
+        draw = ImageDraw.Draw(image)
+        w = self.random.randint(self.width // 8, self.width // 3)
+        h = self.random.randint(self.height // 8, self.height // 3)
+        draw.rectangle((x, y, x + w, y + h), fill=(240, 240, 240), outline=(0, 0, 0))
+        draw.rectangle((x, y, x + w, y + 24), fill=(0, 90, 180))
+        for line in range(y + 34, y + h // 2, 14):
+            length = self.random.randint(w // 4, max(w // 4 + 1, w - 20))
+            draw.line((x + 10, line, x + 10 + length, line), fill=(60, 60, 60), width=6)
+        # 窗口下半部分放一块噪点“照片”，让 PNG 大小接近真实桌面
+        photo = Image.effect_noise((max(1, w - 20), max(1, h // 2 - 20)), self.random.randint(20, 80))
+        image.paste(photo.convert('RGB'), (x + 10, y + h // 2))
+
+    def grab(self) -> Image.Image:
+        """返回下一帧（副本），模拟一次屏幕截图"""
+        changed_area = 0
+        target = self.width * self.height * self.change_ratio
+        while changed_area < target:
+            x = self.random.randint(0, self.width)
+            y = self.random.randint(0, self.height)
+            self._draw_window(self.frame, x, y)
+            changed_area += (self.width // 5) * (self.height // 5)
+        self.frames += 1
+        return self.frame.copy()
+
+
+def create_capture(name: str = 'auto', all_screens: bool = True, bbox: Optional[BBox] = None) -> CaptureBackend:
+    """按名称创建截图后端；auto 或 xshm 不可用时退回 pil。all_screens 为 False 时只截主显示器"""
+    logger = logging.getLogger("Capture")
+    if name == 'synthetic':
+        width, height = (bbox[2] - bbox[0], bbox[3] - bbox[1]) if bbox else (1920, 1080)
+        return SyntheticCapture(width, height)
+    if name in ('auto', 'xshm') and sys.platform.startswith('linux'):
+        if not all_screens and bbox is None:
+            # xshm 默认截取整个根窗口：只要主显示器时按它的位置截取，找不到主显示器就交给 PIL
+            from monitor_capture import list_monitors
+            bbox = next((m.bbox for m in list_monitors() if m.primary), None)
+            if bbox is None:
+                logger.info("Primary monitor not found, using PIL for primary-screen capture")
+                return PilCapture(all_screens)
+        try:
+            return XShmCapture(bbox)
+        except (OSError, AttributeError) as e:
+            logger.warning(f"X11 shared-memory capture unavailable, using PIL: {e}")
+    elif name == 'xshm':
+        logger.warning("X11 shared-memory capture is only available on Linux, using PIL")
+    elif name not in BACKENDS:
+        logger.warning(f"Unknown capture backend '{name}', using PIL")
+    return PilCapture(all_screens, bbox)
+
+
+class ConfiguredCapture:
+    """
+    按配置项 captureBackend 选择后端的截图函数，发送器默认使用它。
+    后端在第一次截图时（即发送线程中）创建，配置变化后下一次截图时重建，
+    不会在其他线程正在截图时关闭后端。
+    """
+
+    def __init__(self, config_manager: Any, all_screens: bool = True) -> None:
+        self.config_manager = config_manager
+        self.all_screens = all_screens
+        self.backend: Optional[CaptureBackend] = None
+        self._name = ''
+
+    def _backend(self) -> CaptureBackend:
+        name = str(self.config_manager.get('captureBackend'))
+        if self.backend is None or name != self._name:
+            if self.backend is not None:
+                self.backend.close()
+            self.backend = create_capture(name, self.all_screens)
+            self._name = name
+            logging.getLogger("Capture").info(f"Using '{self.backend.name}' capture backend")
+        return self.backend
+
+    def __call__(self) -> Image.Image:
+        return self._backend().grab()
+
+    def grab_scaled(self, max_pixels: int) -> Image.Image:
+        return self._backend().grab_scaled(max_pixels)
+
+
+def benchmark_capture(backends: Sequence[str], resolutions: Sequence[Tuple[int, int]],
+                      frames: int = 20) -> List[Dict[str, Any]]:
+    """对每个后端和分辨率截取若干帧，返回 fps 和每帧的 CPU 时间"""
+    results = []
+    for name in backends:
+        for width, height in resolutions:
+            row: Dict[str, Any] = {'backend': name, 'requested': f"{width}x{height}"}
+            try:
+                if name == 'pil':
+                    backend: CaptureBackend = PilCapture(bbox=(0, 0, width, height))
+                elif name == 'xshm':
+                    backend = XShmCapture((0, 0, width, height))
+                else:
+                    backend = SyntheticCapture(width, height)
+                image = backend.grab()  # 预热，排除首次连接的开销
+                wall, cpu = time.perf_counter(), time.process_time()
+                for _ in range(frames):
+                    image = backend.grab()
+                wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+                backend.close()
+                row.update(size=f"{image.width}x{image.height}", fps=frames / wall,
+                           ms_per_frame=wall / frames * 1000, cpu_ms_per_frame=cpu / frames * 1000)
+            except Exception as e:
+                row['error'] = str(e)
+            results.append(row)
+    return results
+
+
+def format_capture_results(results: List[Dict[str, Any]]) -> str:
+    lines = [f"{'backend':<11}{'requested':<12}{'captured':<12}{'fps':>8}{'ms/frame':>10}{'cpu ms':>9}"]
+    for r in results:
+        if 'error' in r:
+            lines.append(f"{r['backend']:<11}{r['requested']:<12}unavailable: {r['error']}")
+        else:
+            lines.append(f"{r['backend']:<11}{r['requested']:<12}{r['size']:<12}{r['fps']:>8.1f}"
+                         f"{r['ms_per_frame']:>10.1f}{r['cpu_ms_per_frame']:>9.1f}")
+    return '\n'.join(lines)
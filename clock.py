@@ -0,0 +1,60 @@
+"""
+可注入的时钟。组件通过 Clock 读取时间和等待，模拟器用 VirtualClock 在几秒内跑完一整天或一周。
+"""
+import datetime
+import threading
+import time
+from typing import Optional
+
+
+class Clock:
+    """真实时钟，对 time / datetime 的薄封装"""
+
+    def time(self) -> float:
+        return time.time()
+
+    def now(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.time())
+
+    def today(self) -> datetime.date:
+        return self.now().date()
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+    def wait(self, event: threading.Event, timeout: float) -> bool:
+        """等待事件或超时；返回事件是否被设置"""
+        return event.wait(timeout)
+
+
+class VirtualClock(Clock):
+    """
+    虚拟时钟：时间只在模拟器调用 advance()/set() 或组件调用 sleep() 时前进，不会真正阻塞。
+    """
+
+    def __init__(self, start: Optional[datetime.datetime] = None) -> None:
+        self._now = (start or datetime.datetime.now()).timestamp()
+
+    def time(self) -> float:
+        return self._now
+
+    def set(self, timestamp: float) -> None:
+        if timestamp < self._now:
+            raise ValueError("VirtualClock cannot move backwards")
+        self._now = timestamp
+
+    def advance(self, seconds: float) -> None:
+        self.set(self._now + seconds)
+
+    def sleep(self, seconds: float) -> None:
+        self.advance(max(0.0, seconds))
+
+    def wait(self, event: threading.Event, timeout: float) -> bool:
+        if event.is_set():
+            return True
+        self.advance(max(0.0, timeout))
+        return False
+
+
+# 默认的真实时钟，各组件未注入时使用
+SYSTEM_CLOCK = Clock()
@@ -0,0 +1,388 @@
+"""
+多台电脑的汇聚服务(collector)。
+
+各台电脑上的 CollectorSink 把使用心跳和截图帧批量推送到这里，collector 去重、汇总，
+定期把一份摘要转发到 Telegram / 钉钉，代替每台电脑各自调用 Telegram API。
+
+运行:
+    python collector.py --config collector.ini
+
+collector.ini 示例:
+    [Collector]
+    host = 0.0.0.0
+    port = 8765
+    token = change-me
+    botToken = 123:abc
+    chatId = -100123
+    dingtalkWebhook =
+    digestMinutes = 10
+"""
+import argparse
+import hashlib
+import hmac
+import io
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+from config_manager import ConfigManager
+from fleet_protocol import (RECORD_DELTA, RECORD_FRAME, RECORD_HEARTBEAT, ProtocolError, decode_batch, decode_frame,
+                            decode_heartbeat)
+from tile_delta import KIND_KEY, DeltaError, decode, read_header
+
+SECTION = 'Collector'
+# 单个批次的大小上限，防止异常客户端占满内存
+MAX_BATCH_BYTES = 32 * 1024 * 1024
+
+
+def format_seconds(seconds: float) -> str:
+    hours, remainder = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+
+class AgentState:
+    """一台电脑的最新状态；只保留最新一帧，内存占用与电脑数量成正比"""
+
+    def __init__(self, agent_id: str) -> None:
+        self.agent_id = agent_id
+        self.last_seen = 0.0
+        self.heartbeat: Dict[str, Any] = {}
+        self.heartbeat_seq = -1
+        self.frames_received = 0
+        self.frames_duplicate = 0
+        self.last_frame_hash = ''
+        self.latest_frame: Optional[bytes] = None
+        self.latest_frame_meta: Dict[str, Any] = {}
+        self.frame_pending = False  # 上次摘要之后是否有新帧
+        # 最新一帧是 tile_delta 编码时，还原它所需的关键帧（关键帧指向它自己）
+        self.latest_frame_key: Optional[bytes] = None
+        self.keyframe: Optional[bytes] = None
+        self.keyframe_id: Optional[int] = None
+        self.frames_missing_key = 0
+
+
+class FleetState:
+    logger: logging.Logger
+
+    def __init__(self) -> None:
+        self.logger = logging.getLogger("Collector")
+        self._lock = threading.Lock()
+        self.agents: Dict[str, AgentState] = {}
+        self.batches = 0
+        self.bytes_received = 0
+
+    def ingest(self, agent_id: str, records: List[Tuple[int, bytes]], size: int) -> Dict[str, Any]:
+        """合并一个批次，返回接受/去重的计数；缺少增量帧的关键帧时 need_keyframe 为 True"""
+        accepted = duplicates = 0
+        need_keyframe = False
+        # 在锁外解析，锁内只做字典更新
+        parsed: List[Tuple[int, Any]] = []
+        for record_type, payload in records:
+            if record_type == RECORD_HEARTBEAT:
+                parsed.append((record_type, decode_heartbeat(payload)))
+            elif record_type == RECORD_FRAME:
+                meta, image = decode_frame(payload)
+                parsed.append((record_type, (meta, image, hashlib.sha256(image).hexdigest(), None)))
+            elif record_type == RECORD_DELTA:
+                meta, image = decode_frame(payload)
+                parsed.append((RECORD_FRAME, (meta, image, hashlib.sha256(image).hexdigest(), read_header(image))))
+        now = time.time()
+        with self._lock:
+            self.batches += 1
+            self.bytes_received += size
+            agent = self.agents.get(agent_id)
+            if agent is None:
+                agent = self.agents[agent_id] = AgentState(agent_id)
+            agent.last_seen = now
+            for record_type, value in parsed:
+                if record_type == RECORD_HEARTBEAT:
+                    # 客户端重发的旧心跳直接丢弃；序号变小但时间更新说明客户端重启过
+                    if value['seq'] <= agent.heartbeat_seq and value['ts'] <= agent.heartbeat.get('ts', 0):
+                        duplicates += 1
+                        continue
+                    agent.heartbeat_seq = value['seq']
+                    agent.heartbeat = value
+                    accepted += 1
+                else:
+                    meta, image, digest, header = value
+                    agent.frames_received += 1
+                    key = None
+                    if header is not None:
+                        if header.kind == KIND_KEY:
+                            agent.keyframe, agent.keyframe_id, key = image, header.key_id, image
+                        elif header.key_id == agent.keyframe_id:
+                            key = agent.keyframe
+                        else:
+                            # collector 重启或关键帧被客户端丢弃，通知客户端下一帧发关键帧
+                            agent.frames_missing_key += 1
+                            need_keyframe = True
+                            continue
+                    if digest == agent.last_frame_hash:
+                        agent.frames_duplicate += 1
+                        duplicates += 1
+                        continue
+                    agent.last_frame_hash = digest
+                    agent.latest_frame = image
+                    agent.latest_frame_key = key
+                    agent.latest_frame_meta = meta
+                    agent.frame_pending = True
+                    accepted += 1
+        return {'accepted': accepted, 'duplicates': duplicates, 'need_keyframe': need_keyframe}
+
+    def _render(self, agent_id: str, frame: bytes, key: Optional[bytes]) -> Optional[bytes]:
+        """增量编码的帧还原成 JPEG；普通帧原样返回"""
+        if key is None:
+            return frame
+        try:
+            image = decode(frame, key)
+        except (DeltaError, OSError) as e:
+            self.logger.warning(f"Cannot decode delta frame from {agent_id}: {e}")
+            return None
+        buffer = io.BytesIO()
+        image.convert('RGB').save(buffer, format='JPEG', quality=80)
+        return buffer.getvalue()
+
+    def take_digest(self, offline_after: float) -> Tuple[str, List[Tuple[str, bytes]]]:
+        """生成摘要文字，并取出上次摘要之后有更新的帧"""
+        now = time.time()
+        lines = []
+        pending = []
+        with self._lock:
+            for agent in sorted(self.agents.values(), key=lambda a: a.agent_id):
+                hb = agent.heartbeat
+                online = now - agent.last_seen <= offline_after
+                if not online:
+                    status = f"离线 (最后 {time.strftime('%H:%M', time.localtime(agent.last_seen))})"
+                elif hb.get('idle'):
+                    status = f"空闲 {int(hb.get('idle_seconds', 0)) // 60} 分钟"
+                else:
+                    status = "在线"
+                usage = format_seconds(hb.get('daily', 0))
+                continuous = int(hb.get('continuous', 0)) // 60
+                app = f", {hb['app']}" if hb.get('app') else ""
+                lines.append(f"{agent.agent_id}: 今日 {usage}, 连续 {continuous} 分钟, {status}{app}")
+                if agent.frame_pending and agent.latest_frame:
+                    pending.append((agent.agent_id, agent.latest_frame, agent.latest_frame_key))
+                    agent.frame_pending = False
+        # 增量帧只在需要转发时才还原，且在锁外进行
+        frames = []
+        for agent_id, frame, key in pending:
+            image = self._render(agent_id, frame, key)
+            if image:
+                frames.append((agent_id, image))
+        header = f"电脑使用汇总 {time.strftime('%Y-%m-%d %H:%M')} ({len(lines)} 台)"
+        return '\n'.join([header] + lines), frames
+
+    def restore_pending(self, agent_ids: List[str]) -> None:
+        """转发失败时把取出的帧放回，下一次摘要再发送"""
+        with self._lock:
+            for agent_id in agent_ids:
+                agent = self.agents.get(agent_id)
+                if agent and agent.latest_frame:
+                    agent.frame_pending = True
+
+    def to_json(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'batches': self.batches,
+                'bytes_received': self.bytes_received,
+                'agents': {
+                    a.agent_id: {'last_seen': a.last_seen, 'heartbeat': a.heartbeat,
+                                 'frames_received': a.frames_received, 'frames_duplicate': a.frames_duplicate,
+                                 'frames_missing_key': a.frames_missing_key}
+                    for a in self.agents.values()
+                },
+            }
+
+
+class Forwarder:
+    """把摘要转发到 Telegram（文字 + 相册）和钉钉（markdown 文字）"""
+    logger: logging.Logger
+
+    def __init__(self, config_manager: ConfigManager) -> None:
+        self.logger = logging.getLogger("Collector")
+        get = lambda key, fallback='': config_manager.get_setting(SECTION, key, fallback=fallback)
+        self.bot_token = get('botToken')
+        self.chat_id = get('chatId')
+        self.api_url = str(get('telegramApiUrl', 'https://api.telegram.org')).rstrip('/')
+        self.dingtalk_webhook = get('dingtalkWebhook')
+        proxy = get('proxy')
+        self.proxies = {'http': proxy, 'https': proxy} if proxy else None
+        self.session = requests.Session()
+
+    def forward(self, text: str, frames: List[Tuple[str, bytes]]) -> bool:
+        """返回帧是否已经送达（只有 Telegram 发送帧，未配置 Telegram 时视为送达）"""
+        delivered = True
+        if self.bot_token and self.chat_id:
+            delivered = self._telegram(text, frames)
+        if self.dingtalk_webhook:
+            self._dingtalk(text)
+        return delivered
+
+    def _telegram(self, text: str, frames: List[Tuple[str, bytes]]) -> bool:
+        base = f"{self.api_url}/bot{self.bot_token}"
+        try:
+            response = self.session.post(f"{base}/sendMessage", data={'chat_id': self.chat_id, 'text': text},
+                                         proxies=self.proxies, timeout=30)
+            response.raise_for_status()
+            # Telegram 相册每次最多 10 张
+            for start in range(0, len(frames), 10):
+                chunk = frames[start:start + 10]
+                if len(chunk) == 1:
+                    agent_id, image = chunk[0]
+                    response = self.session.post(f"{base}/sendPhoto",
+                                                 data={'chat_id': self.chat_id, 'caption': agent_id},
+                                                 files={'photo': (f"{agent_id}.jpg", image, 'image/jpeg')},
+                                                 proxies=self.proxies, timeout=60)
+                else:
+                    media = [{'type': 'photo', 'media': f'attach://f{i}', 'caption': agent_id}
+                             for i, (agent_id, _) in enumerate(chunk)]
+                    files = {f'f{i}': (f"{agent_id}.jpg", image, 'image/jpeg')
+                             for i, (agent_id, image) in enumerate(chunk)}
+                    response = self.session.post(f"{base}/sendMediaGroup",
+                                                 data={'chat_id': self.chat_id, 'media': json.dumps(media)},
+                                                 files=files, proxies=self.proxies, timeout=120)
+                response.raise_for_status()
+            self.logger.info(f"Digest forwarded to Telegram with {len(frames)} frames")
+        except requests.exceptions.RequestException as e:
+            self.logger.error(f"Error forwarding digest to Telegram: {e}")
+            return False
+        return True
+
+    def _dingtalk(self, text: str) -> None:
+        payload = {'msgtype': 'markdown',
+                   'markdown': {'title': '电脑使用汇总', 'text': text.replace('\n', '\n\n')}}
+        try:
+            response = self.session.post(self.dingtalk_webhook, json=payload, timeout=30)
+            response.raise_for_status()
+            data = response.json()
+            if data.get('errcode') != 0:
+                self.logger.error(f"钉钉摘要发送失败: {data.get('errmsg')}")
+        except requests.exceptions.RequestException as e:
+            self.logger.error(f"Error forwarding digest to DingTalk: {e}")
+
+
+class _CollectorHandler(BaseHTTPRequestHandler):
+    collector: "CollectorServer"
+    protocol_version = 'HTTP/1.1'  # 支持客户端的持久连接
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _reply(self, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self) -> bool:
+        token = self.collector.token
+        # 按字节比较：compare_digest 对含非 ASCII 字符的 str 会抛出 TypeError
+        return not token or hmac.compare_digest(self.headers.get('X-KidPC-Token', '').encode('utf-8'),
+                                                token.encode('utf-8'))
+
+    def do_POST(self) -> None:
+        if self.path != '/v1/batch':
+            self._reply(404, {'error': 'not found'})
+            return
+        if not self._authorized():
+            self._reply(401, {'error': 'unauthorized'})
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length <= 0 or length > MAX_BATCH_BYTES:
+            self._reply(413, {'error': 'bad batch size'})
+            return
+        data = self.rfile.read(length)
+        try:
+            agent_id, records = decode_batch(data)
+            result = self.collector.state.ingest(agent_id, records, len(data))
+        except (ProtocolError, ValueError) as e:
+            self._reply(400, {'error': str(e)})
+            return
+        self._reply(200, result)
+
+    def do_GET(self) -> None:
+        if self.path != '/v1/status':
+            self._reply(404, {'error': 'not found'})
+            return
+        if not self._authorized():
+            self._reply(401, {'error': 'unauthorized'})
+            return
+        self._reply(200, self.collector.state.to_json())
+
+
+class CollectorServer:
+    """HTTP 接收批次 + 定期转发摘要"""
+    logger: logging.Logger
+
+    def __init__(self, config_manager: ConfigManager, forwarder: Optional[Forwarder] = None) -> None:
+        self.logger = logging.getLogger("Collector")
+        get = lambda key, type=str, fallback=None: config_manager.get_setting(SECTION, key, type=type, fallback=fallback)
+        self.host = get('host', fallback='127.0.0.1')
+        self.port = get('port', int, 8765)
+        self.token = get('token', fallback='')
+        self.digest_interval = get('digestMinutes', int, 10) * 60
+        self.offline_after = get('offlineAfterMinutes', int, 5) * 60
+        self.state = FleetState()
+        self.forwarder = forwarder or Forwarder(config_manager)
+        self._stop = threading.Event()
+
+        handler = type('CollectorHandler', (_CollectorHandler,), {'collector': self})
+        self.httpd = ThreadingHTTPServer((self.host, self.port), handler)
+        self.httpd.daemon_threads = True
+
+    def start(self) -> None:
+        threading.Thread(target=self.httpd.serve_forever, name="collector-http", daemon=True).start()
+        threading.Thread(target=self._digest_loop, name="collector-digest", daemon=True).start()
+        host, port = self.httpd.server_address[:2]
+        self.logger.info(f"Collector listening on http://{host}:{port}/v1/batch")
+
+    def _digest_loop(self) -> None:
+        while not self._stop.wait(self.digest_interval):
+            self.send_digest()
+
+    def send_digest(self) -> None:
+        if not self.state.agents:
+            return
+        text, frames = self.state.take_digest(self.offline_after)
+        if not self.forwarder.forward(text, frames):
+            self.state.restore_pending([agent_id for agent_id, _ in frames])
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="KidPC 多电脑汇聚服务")
+    parser.add_argument('--config', default='collector.ini')
+    args = parser.parse_args()
+    # ConfigManager 会为不存在的文件生成本机客户端的 [Settings] 默认配置，这里不需要
+    if not os.path.exists(args.config):
+        parser.error(f"config file '{args.config}' not found; create it with a [Collector] section "
+                     f"(see the example at the top of collector.py)")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    server = CollectorServer(ConfigManager(args.config))
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.logger.info("Collector stopped by user.")
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
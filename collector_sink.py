@@ -0,0 +1,204 @@
+"""
+CollectorSink: 把使用心跳和截图帧批量推送到汇聚服务(collector.py)，
+与 ScreenshotSender 并列，可以替代每台电脑各自直连 Telegram。
+"""
+import io
+import logging
+import platform
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Set, Tuple
+
+import requests
+from PIL import Image
+
+from capture_backends import ConfiguredCapture
+from clock import Clock, SYSTEM_CLOCK
+from config_manager import ConfigManager
+from connectivity import ConnectivityMonitor, network_down, network_up, pause_while_offline
+from fleet_protocol import (RECORD_DELTA, RECORD_FRAME, RECORD_HEARTBEAT, Record, encode_batch, encode_frame,
+                            encode_heartbeat)
+from metrics import REGISTRY
+from system_actions import SystemActions
+from send_scheduler import BANDWIDTH, SendSchedule
+from tile_delta import TileDeltaEncoder
+from usage_tracker import UsageTracker
+
+# 检查空闲状态和前台程序是否变化的间隔（秒）
+STATE_POLL_SECONDS = 5
+# 发送失败后，没有新状态时等待多久再重试（秒）
+RETRY_SECONDS = 30
+# 连接失败时最多缓存的记录数，超出后丢弃最旧的（心跳会被新的替代，帧只保留最新的）
+MAX_PENDING_RECORDS = 64
+
+
+class CollectorSink:
+    logger: logging.Logger
+    usage_tracker: Optional[UsageTracker]
+    running: bool
+    config_manager: ConfigManager
+    collector_url: str
+    token: str
+    agent_id: str
+    frame_interval: int
+    heartbeat_seconds: int
+    frame_schedule: SendSchedule
+    delta: bool
+
+    def __init__(self, config_manager: ConfigManager, usage_tracker: Optional[UsageTracker] = None,
+                 capture: Optional[Callable[[], Image.Image]] = None, clock: Clock = SYSTEM_CLOCK,
+                 actions: Optional[SystemActions] = None,
+                 connectivity: Optional[ConnectivityMonitor] = None) -> None:
+        self.logger = logging.getLogger("CollectorSink")
+        self.usage_tracker = usage_tracker
+        self.capture = capture or ConfiguredCapture(config_manager, all_screens=True)
+        self.clock = clock
+        self.actions = actions or SystemActions()
+        # 可选的连通性监视：离线时不截图也不发送，恢复联网后立即发送心跳
+        self.connectivity = connectivity
+        self.running = False
+        self.config_manager = config_manager
+
+        # 持久连接，批次之间复用 TCP/TLS
+        self.session = requests.Session()
+        self._pending: Deque[Record] = deque(maxlen=MAX_PENDING_RECORDS)
+        self._seq = 0
+        self._last_frame = 0.0
+        self._last_heartbeat = 0.0
+        self._last_key: Optional[Tuple[bool, str]] = None
+        self._retry_at = 0.0
+        self._wake = threading.Event()
+        # 截图帧按图块增量编码：大部分画面不变时每帧只传变化的图块
+        self.encoder = TileDeltaEncoder(codec='JPEG', quality=70)
+
+        self.apply_config()
+        self.config_manager.add_listener(self._on_config_changed)
+
+    def apply_config(self) -> None:
+        self.collector_url = str(self.config_manager.get('collectorUrl')).rstrip('/')
+        self.token = str(self.config_manager.get('collectorToken'))
+        self.agent_id = str(self.config_manager.get('agentId')) or platform.node() or 'kidpc'
+        self.frame_interval = int(self.config_manager.get('collectorInterval')) * 60
+        self.frame_schedule = SendSchedule(self.frame_interval, self.config_manager.get('sendJitterSeconds'),
+                                           align=self.config_manager.get('sendPhaseAlign'))
+        BANDWIDTH.configure(self.config_manager.get('uploadBudgetKBps') * 1024)
+        self.heartbeat_seconds = max(STATE_POLL_SECONDS, int(self.config_manager.get('collectorHeartbeatSeconds')))
+        self.delta = bool(self.config_manager.get('collectorDelta'))
+
+    def _on_config_changed(self, changed: Set[str]) -> None:
+        if changed & {'collectorUrl', 'collectorToken', 'agentId', 'collectorInterval',
+                       'collectorHeartbeatSeconds', 'collectorDelta', 'sendPhaseAlign', 'sendJitterSeconds', 'uploadBudgetKBps'}:
+            self.apply_config()
+            self._wake.set()
+
+    def heartbeat(self, state: Dict[str, Any]) -> Record:
+        self._seq += 1
+        return Record(RECORD_HEARTBEAT, encode_heartbeat(dict(state, seq=self._seq, ts=int(self.clock.time()))))
+
+    def _state(self) -> Dict[str, Any]:
+        if self.usage_tracker:
+            return self.usage_tracker.heartbeat_state()
+        return {'daily': 0, 'continuous': 0, 'idle': False, 'idle_seconds': 0, 'app': ''}
+
+    def frame(self) -> Optional[Record]:
+        try:
+            with REGISTRY.stage('collector', 'grab'):
+                image = self.capture()
+            with REGISTRY.stage('collector', 'encode') as stage:
+                if self.delta:
+                    data = self.encoder.encode(image).data
+                    record_type = RECORD_DELTA
+                else:
+                    buffer = io.BytesIO()
+                    image.convert('RGB').save(buffer, format='JPEG', quality=70)
+                    data = buffer.getvalue()
+                    record_type = RECORD_FRAME
+                stage.bytes = len(data)
+        except Exception as e:
+            self.logger.error(f"Error capturing frame for collector: {e}")
+            return None
+        return Record(record_type, encode_frame({'ts': int(self.clock.time())}, data))
+
+    def poll(self) -> bool:
+        """
+        心跳在空闲状态或前台程序变化时立即发送，否则按 heartbeat_seconds 的低频发送；
+        截图帧按自己的间隔附带在同一批次里。返回是否有记录需要发送。
+        """
+        now = self.clock.time()
+        state = self._state()
+        key = (state['idle'], state['app'])
+        added = False
+        if key != self._last_key or now - self._last_heartbeat >= self.heartbeat_seconds:
+            self._pending.append(self.heartbeat(state))
+            added = True
+            self._last_key = key
+            self._last_heartbeat = now
+        # 空闲时画面通常不变，不截图
+        if not state['idle'] and now >= self.frame_schedule.next_send(self._last_frame):
+            record = self.frame()
+            if record:
+                self._pending.append(record)
+                self._last_frame = now
+                added = True
+        return bool(self._pending) and (added or now >= self._retry_at)
+
+    @REGISTRY.timed('collector', 'batch')
+    def flush(self) -> bool:
+        """把缓存的记录作为一个批次发送；失败时保留记录等下一次"""
+        if not self._pending:
+            return True
+        records = list(self._pending)
+        body = encode_batch(self.agent_id, records)
+        headers = {'Content-Type': 'application/octet-stream', 'X-KidPC-Token': self.token}
+        try:
+            with REGISTRY.stage('collector', 'post') as stage:
+                stage.bytes = len(body)
+                BANDWIDTH.acquire(len(body), 'collector')
+                response = self.session.post(f"{self.collector_url}/v1/batch", data=body, headers=headers,
+                                             timeout=30)
+                response.raise_for_status()
+            network_up(self.connectivity)
+        except requests.exceptions.RequestException as e:
+            if network_down(self.connectivity, e):
+                self.logger.info(f"Collector unreachable while offline, keeping {len(records)} records")
+            else:
+                self.logger.warning(f"Collector batch failed, keeping {len(records)} records: {e}")
+            self._retry_at = self.clock.time() + RETRY_SECONDS
+            return False
+        for _ in records:
+            self._pending.popleft()
+        try:
+            need_keyframe = bool(response.json().get('need_keyframe'))
+        except ValueError:
+            need_keyframe = False
+        if need_keyframe:
+            self.logger.info("Collector is missing the keyframe, next frame will be a keyframe")
+            self.encoder.reset()
+        self.logger.debug("Collector batch sent: %d records, %d bytes", len(records), len(body))
+        return True
+
+    def run(self) -> None:
+        self.running = True
+        self.logger.info(f"CollectorSink thread started (agent '{self.agent_id}').")
+        # 第一帧等到本机的时间槽再截取，心跳立即发送
+        self._last_frame = self.clock.time()
+        try:
+            while self.running:
+                if pause_while_offline(self.connectivity, lambda: self.running):
+                    self._retry_at = 0.0  # 恢复联网后立即发送缓存的记录
+                    continue
+                if self.poll():
+                    self.actions.record('send', sender='collector', ok=self.flush())
+                self.clock.wait(self._wake, STATE_POLL_SECONDS)
+                self._wake.clear()
+        except Exception as e:
+            self.logger.critical(f"CollectorSink thread encountered a critical error: {e}", exc_info=True)
+        finally:
+            self.running = False
+            self.session.close()
+            self.logger.info("CollectorSink thread fully exited.")
+
+    def stop(self) -> None:
+        self.running = False
+        self._wake.set()
+        self.logger.info("CollectorSink stopping.")
@@ -1,98 +1,387 @@
 import configparser
 import os
 import logging
-from typing import Optional, Union, Dict, List, Any, Type
+import threading
+from typing import Optional, Dict, List, Any, Type, Callable, NamedTuple, Set, Tuple
+
+
+class SettingSpec(NamedTuple):
+    """[Settings] 中单个配置项的声明：类型、默认值、兼容的旧键名"""
+    type: Type
+    default: Any
+    aliases: Tuple[str, ...] = ()
+
+
+# 声明式配置表：键名 -> (类型, 默认值, 别名)
+# configparser 会把键名转成小写，所以别名只需要列出拼写不同的写法
+SETTINGS_SCHEMA: Dict[str, SettingSpec] = {
+    'dataFolder': SettingSpec(str, '.\\screenshots'),
+    'botToken': SettingSpec(str, 'YOUR_BOT_TOKEN'),  # 请替换为您的 Telegram Bot Token
+    'chatId': SettingSpec(str, 'YOUR_CHAT_ID'),  # 请替换为您的 Telegram Chat ID
+    'telegramApiUrl': SettingSpec(str, 'https://api.telegram.org'),  # Telegram Bot API 地址（基准测试时指向本地替身服务）
+    'proxy': SettingSpec(str, ''),  # 例如: '192.168.100.101:1081'，如果不需要代理，留空即可
+    'screenshotInterval': SettingSpec(int, 1),  # 截图间隔（分钟）
+    'usageStatsFile': SettingSpec(str, '.\\usage_stats.json'),
+    'showFloatWindow': SettingSpec(bool, True),  # 是否显示浮动窗口 (true/false)
+    'enableRestReminder': SettingSpec(bool, True),  # 是否启用休息提醒 (true/false)
+    'firstReminderHour': SettingSpec(int, 21),  # 首次提醒时间（小时，24小时制）
+    'shutdownPlanHour': SettingSpec(int, 21),  # 计划关机时间（小时）
+    'shutdownPlanMinute': SettingSpec(int, 30),  # 计划关机时间（分钟）
+    'shutdownDelayMinutes': SettingSpec(int, 5),  # 关机倒计时（分钟）
+    'reminderIntervalSeconds': SettingSpec(int, 300),  # 提醒间隔（秒）
+    'continuousUsageThreshold': SettingSpec(int, 10),  # 连续使用多久后强制休息（分钟）
+    'forcedRestDuration': SettingSpec(int, 1),  # 强制休息时长（分钟）
+    'forcedShutdownHour': SettingSpec(int, 22),  # 强制关机时间（小时）
+    # 每日额度（分钟）：7 个逗号分隔的数对应周一到周日，一个数表示每天相同；留空或 0 表示不限
+    'dailyQuotaMinutes': SettingSpec(str, ''),
+    'quotaWarnPercents': SettingSpec(str, '50,80,95'),  # 额度用到这些百分比时提醒
+    'quotaRolloverMinutes': SettingSpec(int, 0),  # 前一天未用完的额度最多结转多少分钟到今天
+    'adminPassword': SettingSpec(str, 'admin'),  # 管理员密码
+    # 钉钉相关配置
+    'enableDingTalk': SettingSpec(bool, False, aliases=('enable_dingtalk',)),  # 是否启用钉钉发送 (true/false)
+    'dingtalkWebhook': SettingSpec(str, ''),  # 钉钉机器人Webhook地址
+    'dingtalkSecret': SettingSpec(str, ''),  # 钉钉机器人加签密钥（可选）
+    'dingtalkInterval': SettingSpec(int, 5),  # 钉钉发送间隔（分钟）
+    'imgbbApi': SettingSpec(str, ''),  # ImgBB API Key (用于图片上传)
+    'imgbbUploadUrl': SettingSpec(str, 'https://api.imgbb.com/1/upload'),  # ImgBB 上传接口地址
+    'imgbbExpirationSeconds': SettingSpec(int, 0),  # 上传的图片在 ImgBB 保存多久后自动删除（秒），0 表示一直保存
+    'imgbbCacheEntries': SettingSpec(int, 256),  # 记住多少张已上传截图的 URL，相同的截图不再上传，0 表示不缓存
+    'imgbbReuseSimilar': SettingSpec(bool, False),  # 几乎相同的截图（缩略图量化后相同）也使用已上传的 URL，发出的可能是较早的画面 (true/false)
+    # 日志相关配置，各模块的级别写在 [LogLevels] 段，例如 UsageTracker = DEBUG
+    'logFile': SettingSpec(str, 'screenshot_bot.log'),  # 日志文件路径
+    'logLevel': SettingSpec(str, 'INFO'),  # 全局日志级别 (DEBUG/INFO/WARNING/ERROR)
+    'logMaxSizeMB': SettingSpec(int, 5),  # 单个日志文件最大大小（MB），超过后轮转
+    'logBackupCount': SettingSpec(int, 7),  # 保留的压缩旧日志数量
+    'logRotateDaily': SettingSpec(bool, True),  # 是否每天轮转一次日志
+    # 截图/发送流水线指标
+    'metricsPort': SettingSpec(int, 0),  # 本机指标接口端口（仅监听 127.0.0.1），0 表示关闭
+    'metricsSummaryMinutes': SettingSpec(int, 60),  # 定期在日志中输出指标摘要的间隔（分钟），0 表示关闭
+    'captureBackend': SettingSpec(str, 'auto'),  # 截图方式: auto / pil / xshm (Linux X11 共享内存) / synthetic
+    'captureMode': SettingSpec(str, 'stitched'),  # stitched: 所有显示器拼成一张；monitors: 按显示器分别截图，只发送有变化的
+    'monitorSelection': SettingSpec(str, ''),  # 要截取的显示器编号，例如 1,3；留空表示全部
+    'monitorChangeThreshold': SettingSpec(float, 1.0),  # 显示器画面平均变化达到多少（%）才发送
+    'monitorMaxWidth': SettingSpec(int, 1600),  # 按显示器发送时缩小到的最大宽度（像素），0 表示不缩小
+    # 截图内存控制
+    'captureMaxPixels': SettingSpec(int, 8294400),  # 截图超过该像素数（默认 3840x2160）时先按整数倍缩小，0 表示不限
+    'imageArenaMB': SettingSpec(int, 64),  # 缓存多少 MB 释放的图像内存块供下一次截图复用，0 表示不缓存
+    'traceMemory': SettingSpec(bool, False),  # 是否用 tracemalloc 记录每个周期的 Python 内存峰值（会变慢，仅排查时开启）
+    'diagnosticsSeconds': SettingSpec(int, 60),  # 托盘“诊断”菜单中性能分析的默认时长（秒）
+    'profileSampleMs': SettingSpec(int, 10),  # 性能分析时读取各线程调用栈的间隔（毫秒）
+    # 本地截图存档
+    'enableArchive': SettingSpec(bool, False),  # 是否在本地保存截图历史 (true/false)
+    'archiveFolder': SettingSpec(str, ''),  # 存档目录，留空使用 dataFolder/archive
+    'archiveMaxMB': SettingSpec(int, 2048),  # 存档最大总大小（MB），超过后淘汰最久未查看的截图
+    'archiveMaxDays': SettingSpec(int, 30),  # 存档保留天数，0 表示不按时间删除
+    'archiveDelta': SettingSpec(bool, True),  # 存档按图块增量保存，只存变化的部分 (true/false)
+    # 每日延时视频
+    'enableTimelapse': SettingSpec(bool, False),  # 是否把截图合成每日延时视频，次日发送到 Telegram (true/false)
+    'timelapseWidth': SettingSpec(int, 640),  # 延时视频宽度（像素），高度按比例
+    'timelapseFps': SettingSpec(int, 10),  # 延时视频帧率
+    'timelapseQuality': SettingSpec(int, 60),  # 延时视频每帧的 JPEG 质量 (1-95)
+    # 发送调度：错开多台电脑的发送时刻，并限制本机上传带宽
+    'sendPhaseAlign': SettingSpec(bool, True),  # 发送时刻按计算机名错开 (true/false)
+    'sendJitterSeconds': SettingSpec(int, 15),  # 每次发送额外的随机延迟上限（秒），不超过间隔的四分之一
+    'uploadBudgetKBps': SettingSpec(int, 0),  # 本机所有发送器共用的上传带宽（KB/s），0 表示不限
+    # 出站队列：告警优先于命令回复，命令回复优先于例行截图；超过期限仍未发出的消息丢弃（秒，0 表示不过期）
+    'sendAlerts': SettingSpec(bool, True),  # 强制关机、计划关机和额度用完时立即通知家长 (true/false)
+    'alertDeadlineSeconds': SettingSpec(int, 3600),
+    'statusDeadlineSeconds': SettingSpec(int, 300),
+    'frameDeadlineSeconds': SettingSpec(int, 120),
+    'outboundMaxQueued': SettingSpec(int, 32),  # 队列中最多排多少条消息，超出时先丢弃最不重要的
+    # 网络连通性：离线时所有发送器暂停截图和上传，恢复后立即继续
+    'connectivityCheckSeconds': SettingSpec(int, 60),  # 在线时多久探测一次（秒），0 表示不探测、总是视为在线
+    'connectivityProbeHosts': SettingSpec(str, ''),  # 探测的 host:port 列表（逗号分隔），留空按代理和各发送器地址推导
+    'dailyUploadMB': SettingSpec(int, 0),  # 本机所有发送器每天共用的上传额度（MB），接近用完时自动放慢发送，0 表示不限
+    # 自适应截图间隔：screenshotInterval / dingtalkInterval 作为基准
+    'adaptiveInterval': SettingSpec(bool, False),  # 是否按画面变化和键鼠活动自动调整截图间隔 (true/false)
+    'adaptiveMinSeconds': SettingSpec(int, 60),  # 画面变化频繁时的最短间隔（秒）
+    'adaptiveMaxSeconds': SettingSpec(int, 3600),  # 空闲或锁屏时退避到的最长间隔（秒）
+    'adaptiveChangePercent': SettingSpec(float, 2.0),  # 相邻两张截图平均变化达到多少（%）时缩短间隔
+    'dailyReportTime': SettingSpec(str, ''),  # 每天几点（HH:MM）把使用报告图发送到 Telegram，留空表示不发送
+    # 局域网只读接口：今天的使用情况、历史和最近截图的缩略图
+    'usageApiPort': SettingSpec(int, 0),  # 端口，0 表示不开启
+    'usageApiHost': SettingSpec(str, '127.0.0.1'),  # 监听的地址，局域网访问时填本机 IP 或 0.0.0.0
+    'usageApiToken': SettingSpec(str, ''),  # 访问令牌（X-KidPC-Token 请求头或 ?token=），留空表示不验证
+    # 多电脑汇聚服务（collector.py），collectorUrl 为空表示不使用
+    'enableTelegram': SettingSpec(bool, True),  # 是否由本机直接发送截图到 Telegram (true/false)
+    'enableCommands': SettingSpec(bool, False),  # 是否接收 Telegram 聊天中的 /shot /status /pause /extend 等命令 (true/false)
+    'collectorUrl': SettingSpec(str, ''),  # 汇聚服务地址，例如 http://192.168.1.10:8765
+    'collectorToken': SettingSpec(str, ''),  # 汇聚服务的访问令牌
+    'agentId': SettingSpec(str, ''),  # 本机在汇聚服务中的名称，留空使用计算机名
+    'collectorInterval': SettingSpec(int, 5),  # 推送截图帧的间隔（分钟）
+    'collectorHeartbeatSeconds': SettingSpec(int, 300, aliases=('collectorBatchSeconds',)),  # 状态不变时心跳的最长间隔（秒）
+    'collectorDelta': SettingSpec(bool, True),  # 截图帧按图块增量推送，只传变化的部分 (true/false)
+    'idleThresholdMinutes': SettingSpec(int, 5),  # 键盘鼠标无操作多久算空闲（分钟），0 表示不判断
+    # 按登录的系统用户区分：[Settings:用户名]、[Schedule:用户名] 覆盖公共设置，使用统计各存一份
+    'enableProfiles': SettingSpec(bool, False),  # 是否按当前登录的系统用户切换配置和使用统计 (true/false)
+    'profileCheckSeconds': SettingSpec(int, 5),  # 多久检查一次当前登录的用户（秒）
+}
+
+# 用户配置段的写法：[Settings:alice] 中的键覆盖 [Settings]，[Schedule:alice] 覆盖 [Schedule]
+PROFILE_SEPARATOR = ':'
+# 切换用户后通知监听者的变更集合中包含这个键
+PROFILE_KEY = 'profile'
+
 
 class ConfigManager:
     CONFIG_FILE: str = 'config.ini'
+    SECTION: str = 'Settings'
     logger: logging.Logger
     config: configparser.ConfigParser
+    config_file: str
+    profile: str
 
-    def __init__(self) -> None:
+    def __init__(self, config_file: Optional[str] = None) -> None:
         self.logger = logging.getLogger("ConfigManager")
+        self.config_file = config_file or self.CONFIG_FILE
         self.config = configparser.ConfigParser()
+        self._lock = threading.RLock()
+        # 类型转换结果缓存，配置重新加载或修改后清空
+        self._cache: Dict[Tuple[str, str, Type], Any] = {}
+        # 已经警告过的缺失或无法转换的键，避免每次读取都刷日志
+        self._warned: Set[Tuple[str, str]] = set()
+        self._listeners: List[Callable[[Set[str]], None]] = []
+        self._mtime: Optional[int] = None
+        self._snapshot: Dict[str, Dict[str, str]] = {}
+        self._watch_thread: Optional[threading.Thread] = None
+        self._watch_stop = threading.Event()
+        # 当前用户配置（小写的系统用户名），空字符串表示只用公共配置
+        self.profile = ''
+        # 当前用户的 [Settings:用户名] 段名，在加载配置和切换用户时确定，get() 不再逐段查找
+        self._profile_section_name: Optional[str] = None
         self._load_config()
 
     def _load_config(self) -> None:
-        if not os.path.exists(self.CONFIG_FILE):
-            self.logger.warning(f"Configuration file '{self.CONFIG_FILE}' not found. Creating with default settings.")
+        if not os.path.exists(self.config_file):
+            self.logger.warning(f"Configuration file '{self.config_file}' not found. Creating with default settings.")
             self._create_default_config()
-        # 确保以 utf-8 编码读取，防止中文乱码
-        self.config.read(self.CONFIG_FILE, encoding='utf-8')
-        self.logger.info(f"Configuration loaded from {self.CONFIG_FILE}")
+        with self._lock:
+            # 确保以 utf-8 编码读取，防止中文乱码
+            self.config.read(self.config_file, encoding='utf-8')
+            self._mtime = self._file_mtime()
+            self._snapshot = self._raw_snapshot()
+            self._profile_section_name = self._profile_section(self.SECTION)
+            self._cache.clear()
+        self.logger.info(f"Configuration loaded from {self.config_file}")
 
     def _create_default_config(self) -> None:
-        # 定义默认设置
-        self.config['Settings'] = {
-            'dataFolder': '.\\screenshots',
-            'botToken': 'YOUR_BOT_TOKEN', # 请替换为您的 Telegram Bot Token
-            'chatId': 'YOUR_CHAT_ID',     # 请替换为您的 Telegram Chat ID
-            'proxy': '', # 例如: '192.168.100.101:1081'，如果不需要代理，留空即可
-            'screenshotInterval': '1', # 截图间隔（分钟）
-            'usageStatsFile': '.\\usage_stats.json',
-            'showFloatWindow': 'true', # 是否显示浮动窗口 (true/false)
-            'enableRestReminder': 'true', # 是否启用休息提醒 (true/false)
-            'firstReminderHour': '21', # 首次提醒时间（小时，24小时制）
-            'shutdownPlanHour': '21', # 计划关机时间（小时）
-            'shutdownPlanMinute': '30', # 计划关机时间（分钟）
-            'shutdownDelayMinutes': '5', # 关机倒计时（分钟）
-            'reminderIntervalSeconds': '300', # 提醒间隔（秒）
-            'continuousUsageThreshold': '10', # 连续使用多久后强制休息（分钟）
-            'forcedRestDuration': '1', # 强制休息时长（分钟）
-            'forcedShutdownHour': '22', # 强制关机时间（小时）
-            'adminPassword': 'admin', # 管理员密码
-            # 钉钉相关配置
-            'enabledingtalk': 'false', # 是否启用钉钉发送 (true/false)
-            'dingtalkwebhook': '', # 钉钉机器人Webhook地址
-            'dingtalksecret': '', # 钉钉机器人加签密钥（可选）
-            'dingtalkinterval': '5', # 钉钉发送间隔（分钟）
-            'imgbbapi': '' # ImgBB API Key (用于图片上传)
+        # 默认设置由 SETTINGS_SCHEMA 生成，布尔值写成小写 true/false
+        self.config[self.SECTION] = {
+            key: (str(spec.default).lower() if spec.type is bool else str(spec.default))
+            for key, spec in SETTINGS_SCHEMA.items()
         }
+        # 默认配置不算“变更”，不需要通知监听者
+        self._snapshot = self._raw_snapshot()
         self.save_config()
-        self.logger.info(f"Default '{self.CONFIG_FILE}' created.")
+        self.logger.info(f"Default '{self.config_file}' created.")
 
-    def get_setting(self, section: str, key: str, type: Type = str, fallback: Optional[Any] = None) -> Optional[Any]:
+    def _file_mtime(self) -> Optional[int]:
         try:
-            if type == bool:
-                return self.config.getboolean(section, key)
-            elif type == int:
-                return self.config.getint(section, key)
-            elif type == float:
-                return self.config.getfloat(section, key)
-            else:
-                return self.config.get(section, key)
-        except (configparser.NoSectionError, configparser.NoOptionError):
-            self.logger.warning(f"Setting [{section}]{key} not found. Using fallback: {fallback}")
-            return fallback
-        except ValueError:
-            self.logger.error(f"Error converting setting [{section}]{key} to type {type.__name__}. Using fallback: {fallback}")
-            return fallback
+            return os.stat(self.config_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def _raw_snapshot(self) -> Dict[str, Dict[str, str]]:
+        """各段的生效值：当前用户的 [段:用户名] 覆盖同名的键，其他用户的段不出现"""
+        snapshot = {section: dict(self.config.items(section)) for section in self.config.sections()
+                    if PROFILE_SEPARATOR not in section}
+        for section in self.config.sections():
+            base, sep, name = section.partition(PROFILE_SEPARATOR)
+            if sep and self.profile and name.strip().lower() == self.profile:
+                snapshot.setdefault(base, {}).update(self.config.items(section))
+        return snapshot
+
+    def _profile_section(self, section: str) -> Optional[str]:
+        """当前用户覆盖 section 的段名；没有时返回 None"""
+        if self.profile:
+            for name in self.config.sections():
+                base, sep, user = name.partition(PROFILE_SEPARATOR)
+                if sep and base == section and user.strip().lower() == self.profile:
+                    return name
+        return None
+
+    def set_profile(self, name: str) -> None:
+        """
+        切换到用户 name 的配置，空字符串表示只用公共配置。
+        不重新读取文件：按生效值的差异通知监听者，变更集合中另外包含 PROFILE_KEY。
+        """
+        name = name.strip().lower()
+        with self._lock:
+            if name == self.profile:
+                return
+            self.profile = name
+            self._profile_section_name = self._profile_section(self.SECTION)
+            self._cache.clear()
+            self._warned.clear()
+        self.logger.info(f"Switched to profile '{name}'." if name else "Switched to shared settings.")
+        self._notify_changes({PROFILE_KEY})
+
+    def _canonical_key(self, key: str) -> str:
+        """把小写键名映射回 SETTINGS_SCHEMA 中的规范写法"""
+        lowered = key.lower()
+        for name, spec in SETTINGS_SCHEMA.items():
+            if name.lower() == lowered or lowered in (alias.lower() for alias in spec.aliases):
+                return name
+        return lowered
+
+    def _convert(self, section: str, key: str, type: Type) -> Any:
+        if type == bool:
+            return self.config.getboolean(section, key)
+        elif type == int:
+            return self.config.getint(section, key)
+        elif type == float:
+            return self.config.getfloat(section, key)
+        else:
+            return self.config.get(section, key)
+
+    def get_setting(self, section: str, key: str, type: Type = str, fallback: Optional[Any] = None) -> Optional[Any]:
+        cache_key = (section, key.lower(), type)
+        with self._lock:
+            if cache_key in self._cache:
+                return self._cache[cache_key]
+            try:
+                value = self._convert(section, key, type)
+            except (configparser.NoSectionError, configparser.NoOptionError):
+                if (section, key.lower()) not in self._warned:
+                    self._warned.add((section, key.lower()))
+                    self.logger.warning(f"Setting [{section}]{key} not found. Using fallback: {fallback}")
+                return fallback
+            except ValueError:
+                # 转换失败的值同样缓存默认值，只在第一次记录错误
+                if (section, key.lower()) not in self._warned:
+                    self._warned.add((section, key.lower()))
+                    self.logger.error(f"Error converting setting [{section}]{key} to type {type.__name__}. Using fallback: {fallback}")
+                self._cache[cache_key] = fallback
+                return fallback
+            self._cache[cache_key] = value
+            return value
+
+    def get(self, key: str) -> Any:
+        """
+        按 SETTINGS_SCHEMA 读取 [Settings] 中的配置项，当前用户的 [Settings:用户名] 优先。
+        类型和默认值来自声明，别名会依次尝试，结果会被缓存。
+        """
+        spec = SETTINGS_SCHEMA[key]
+        with self._lock:
+            for section in (self._profile_section_name, self.SECTION):
+                for name in (key,) + spec.aliases:
+                    if section and self.config.has_option(section, name):
+                        return self.get_setting(section, name, type=spec.type, fallback=spec.default)
+        return spec.default
 
     def set_setting(self, section: str, key: str, value: Any) -> None:
-        if not self.config.has_section(section):
-            self.config.add_section(section)
-        # 确保保存的值是字符串类型
-        self.config.set(section, key, str(value))
+        with self._lock:
+            if not self.config.has_section(section):
+                self.config.add_section(section)
+            # 确保保存的值是字符串类型
+            self.config.set(section, key, str(value))
+            self._profile_section_name = self._profile_section(self.SECTION)
+            self._cache.clear()
         self.logger.debug(f"Setting [{section}]{key} set to {value}")
 
     def save_config(self) -> None:
         try:
-            # 确保以 utf-8 编码写入
-            with open(self.CONFIG_FILE, 'w', encoding='utf-8') as configfile:
-                self.config.write(configfile)
-            self.logger.info(f"Configuration saved to {self.CONFIG_FILE}")
+            with self._lock:
+                # 确保以 utf-8 编码写入
+                with open(self.config_file, 'w', encoding='utf-8') as configfile:
+                    self.config.write(configfile)
+                self._mtime = self._file_mtime()
+            self.logger.info(f"Configuration saved to {self.config_file}")
         except Exception as e:
             self.logger.error(f"Error saving configuration: {e}")
+            return
+        self._notify_changes()
+
+    def reload_if_changed(self) -> bool:
+        """
+        检查 config.ini 的修改时间，文件被外部修改时重新加载并通知监听者。
+        返回是否发生了重新加载。
+        """
+        mtime = self._file_mtime()
+        if mtime is None or mtime == self._mtime:
+            return False
+        with self._lock:
+            fresh = configparser.ConfigParser()
+            try:
+                fresh.read(self.config_file, encoding='utf-8')
+            except configparser.Error as e:
+                # 文件可能正被编辑器写到一半，下次再试
+                self.logger.error(f"Error parsing {self.config_file}, keeping previous settings: {e}")
+                return False
+            if not fresh.has_section(self.SECTION):
+                # 编辑器先清空再写入时可能读到空文件，不当作“所有设置恢复默认”，下次再试
+                self.logger.error(f"No [{self.SECTION}] section in {self.config_file}, keeping previous settings")
+                return False
+            self.config = fresh
+            self._mtime = mtime
+            self._profile_section_name = self._profile_section(self.SECTION)
+            self._cache.clear()
+            self._warned.clear()
+        self.logger.info(f"Configuration reloaded from {self.config_file}")
+        self._notify_changes()
+        return True
+
+    def _notify_changes(self, extra: Set[str] = frozenset()) -> None:
+        with self._lock:
+            snapshot = self._raw_snapshot()
+            changed: Set[str] = set(extra)
+            for section in set(snapshot) | set(self._snapshot):
+                old = self._snapshot.get(section, {})
+                new = snapshot.get(section, {})
+                for key in set(old) | set(new):
+                    if old.get(key) != new.get(key):
+                        changed.add(self._canonical_key(key) if section == self.SECTION else f"{section}.{key}")
+            self._snapshot = snapshot
+            listeners = list(self._listeners)
+        if not changed:
+            return
+        self.logger.info(f"Settings changed: {', '.join(sorted(changed))}")
+        for callback in listeners:
+            try:
+                callback(changed)
+            except Exception as e:
+                self.logger.error(f"Error in config change listener {callback!r}: {e}", exc_info=True)
+
+    def add_listener(self, callback: Callable[[Set[str]], None]) -> None:
+        """注册配置变更回调，参数为发生变化的键名集合"""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[Set[str]], None]) -> None:
+        with self._lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def start_watching(self, interval: float = 2.0) -> None:
+        """启动后台线程，按修改时间热加载 config.ini"""
+        if self._watch_thread and self._watch_thread.is_alive():
+            return
+        self._watch_stop.clear()
+
+        def _watch() -> None:
+            while not self._watch_stop.wait(interval):
+                try:
+                    self.reload_if_changed()
+                except Exception as e:
+                    self.logger.error(f"Error while watching configuration file: {e}")
+
+        self._watch_thread = threading.Thread(target=_watch, name="config-watcher", daemon=True)
+        self._watch_thread.start()
+        self.logger.info(f"Watching {self.config_file} for changes every {interval}s")
+
+    def stop_watching(self) -> None:
+        self._watch_stop.set()
 
     def get_section_settings(self, section: str) -> Dict[str, str]:
         """
         获取指定 section 下的所有键值对。
         返回一个字典。
         """
-        if self.config.has_section(section):
-            # configparser.items() 方法返回的是 (key, value) 对的列表
-            # dict() 可以将其转换为字典
-            return dict(self.config.items(section))
+        with self._lock:
+            if self.config.has_section(section):
+                # configparser.items() 方法返回的是 (key, value) 对的列表
+                # dict() 可以将其转换为字典
+                return dict(self.config.items(section))
         self.logger.warning(f"Section '{section}' not found in config.")
         return {}
 
@@ -104,10 +393,8 @@ class ConfigManager:
 
     def get_all_settings(self) -> Dict[str, Dict[str, str]]:
         """
-        获取所有 section 的所有键值对，按 section 分组。
+        获取所有 section 的所有键值对（生效值，已合并当前用户的覆盖段），按 section 分组。
         返回一个嵌套字典，格式为 {section_name: {key: value, ...}, ...}。
         """
-        all_data = {}
-        for section in self.config.sections():
-            all_data[section] = dict(self.config.items(section))
-        return all_data
\ No newline at end of file
+        with self._lock:
+            return self._raw_snapshot()
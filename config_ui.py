@@ -5,6 +5,7 @@ import pystray
 from PIL import Image
 import threading
 import logging
+from diagnostics import Diagnostics
 
 # 导入 ConfigManager，确保 main.py 已经将它实例化并传递给 ConfigUI
 # from config_manager import ConfigManager # 不再需要直接导入，因为会作为参数传入
@@ -31,6 +32,13 @@ UI_STRINGS = {
         'new_password_prompt': "请输入新密码：",
         'password_changed_message': "密码已修改！",
         'new_password_empty_message': "新密码不能为空。",
+        'menu_diagnostics': "诊断",
+        'menu_start_profile': "开始性能分析…",
+        'menu_stop_profile': "结束性能分析",
+        'profile_seconds_prompt': "分析多少秒：",
+        'profile_running_message': "性能分析正在进行中。",
+        'profile_done_message': "性能分析报告已保存：\n{paths}",
+        'profile_failed_message': "性能分析失败，详见日志。",
     }
 }
 # --- 修改结束 ---
@@ -42,18 +50,27 @@ class ConfigUI:
 
     # 接收 main.py 的主 Tkinter 根窗口 (root) 和 ConfigManager 实例
     # 接收 main.py 的主 Tkinter 根窗口 (root) 和 ConfigManager 实例
-    def __init__(self, main_root, config_manager):
+    def __init__(self, main_root, config_manager, diagnostics=None):
         self.root = main_root  # 使用主 root 作为 Toplevel 的父窗口
         self.config_manager = config_manager  # 使用统一的 ConfigManager
+        # 托盘“诊断”菜单：按需对所有线程做采样分析和内存对比，关闭时没有开销
+        self.diagnostics = diagnostics or Diagnostics(config_manager)
 
         # 从 ConfigManager 读取密码
         # 注意：这里使用 'adminPassword'，请确保 config.ini 和 ConfigManager 中的键名一致
-        self.password = self.config_manager.get_setting('Settings', 'adminPassword', fallback='admin')
+        self.password = self.config_manager.get('adminPassword')
         logger.info(f"ConfigUI initialized. Password loaded: {self.password}")
+        # config.ini 被外部修改时同步内存中的密码
+        self.config_manager.add_listener(self._on_config_changed)
 
         self.tray = None  # 初始化为 None
         self.create_tray_icon()  # 创建托盘图标
 
+    def _on_config_changed(self, changed):
+        if 'adminPassword' in changed:
+            self.password = self.config_manager.get('adminPassword')
+            logger.info("Admin password reloaded from configuration.")
+
     def create_tray_icon(self):
         try:
             image = Image.open("icon.png")
@@ -71,13 +88,19 @@ class ConfigUI:
         menu = (
             pystray.MenuItem(self.get_string('menu_open_settings'), self._schedule_open_settings),  # 调度到主线程
             pystray.MenuItem(self.get_string('menu_change_password'), self._schedule_change_password),  # 调度到主线程
+            pystray.MenuItem(self.get_string('menu_diagnostics'), pystray.Menu(
+                pystray.MenuItem(self.get_string('menu_start_profile'), self._schedule_start_profile,
+                                 enabled=lambda item: not self.diagnostics.active),
+                pystray.MenuItem(self.get_string('menu_stop_profile'), self._schedule_stop_profile,
+                                 enabled=lambda item: self.diagnostics.active),
+            )),
             pystray.MenuItem(self.get_string('menu_exit'), self._schedule_quit_app)  # 调度到主线程
         )
         self.tray = pystray.Icon("config_ui", image, self.get_string('config_window_title'), menu)
 
         # 托盘图标本身运行在一个独立的守护线程中
         # 只有在 main.py 的根窗口启动后，托盘图标才能正常工作
-        threading.Thread(target=self.tray.run, daemon=True).start()
+        threading.Thread(target=self.tray.run, name="tray", daemon=True).start()
         logger.info("Tray icon thread started.")
 
     # 调度到主线程，避免Tkinter在非主线程操作UI
@@ -190,6 +213,40 @@ class ConfigUI:
             messagebox.showerror(self.get_string('error_title'), self.get_string('password_error_message'), parent=self.root)
             logger.warning("Incorrect password entered for password change.")
 
+    # 调度到主线程
+    def _schedule_start_profile(self):
+        self.root.after(0, self.start_profile)
+
+    def _schedule_stop_profile(self):
+        self.root.after(0, self.diagnostics.stop)
+
+    def start_profile(self):
+        """验证密码后开始性能分析，结束时提示报告位置"""
+        if self.diagnostics.active:
+            messagebox.showinfo(self.get_string('info_title'), self.get_string('profile_running_message'), parent=self.root)
+            return
+        self.root.deiconify()
+        password = simpledialog.askstring(self.get_string('password_prompt_title'), self.get_string('password_prompt_label'), show='*', parent=self.root)
+        if password != self.password:
+            self.root.withdraw()
+            if password is not None:
+                messagebox.showerror(self.get_string('error_title'), self.get_string('password_error_message'), parent=self.root)
+                logger.warning("Incorrect password entered for diagnostics.")
+            return
+        seconds = simpledialog.askinteger(self.get_string('menu_diagnostics'), self.get_string('profile_seconds_prompt'),
+                                          initialvalue=self.config_manager.get('diagnosticsSeconds'),
+                                          minvalue=1, maxvalue=3600, parent=self.root)
+        self.root.withdraw()
+        if seconds:
+            self.diagnostics.start(seconds, on_done=lambda paths: self.root.after(0, self._profile_done, paths))
+
+    def _profile_done(self, paths):
+        if paths:
+            messagebox.showinfo(self.get_string('info_title'),
+                                self.get_string('profile_done_message').format(paths='\n'.join(paths)), parent=self.root)
+        else:
+            messagebox.showerror(self.get_string('error_title'), self.get_string('profile_failed_message'), parent=self.root)
+
     # 调度到主线程
     def _schedule_quit_app(self):
         self.root.after(0, self.quit_app)
@@ -0,0 +1,217 @@
+"""
+网络连通性监视：所有发送器共用一个在线/离线状态，离线时暂停截图和上传，恢复后立即继续。
+
+探测只建立一次 TCP 连接（不做 TLS、不发 HTTP 请求），目标按配置推导：
+配置了代理时探测代理本身，否则探测 Telegram API；开启钉钉或汇聚服务时也探测它们的主机，
+任一目标连得上即视为在线。也可以用 connectivityProbeHosts 指定 host:port 列表。
+
+在线时每 connectivityCheckSeconds 探测一次；发送器遇到连接错误时立即重新探测，请求成功时直接视为在线。
+离线时按指数退避重新探测（5 秒起，最长 30 秒，恢复联网后很快继续），状态只在变化时写日志。
+"""
+import logging
+import socket
+import threading
+from typing import Callable, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+import requests
+
+from clock import Clock, SYSTEM_CLOCK
+from config_manager import ConfigManager
+from metrics import REGISTRY
+from system_actions import SystemActions
+
+PROBE_TIMEOUT = 3
+MIN_RECHECK_SECONDS = 5
+MAX_RECHECK_SECONDS = 30
+# 这么多秒内刚探测到离线时直接复用结果，多个发送器同时出错时只探测一次
+PROBE_REUSE_SECONDS = 2
+# 离线时各发送器多久检查一次是否需要退出
+OFFLINE_POLL_SECONDS = 5
+# URL 中没有写端口时按协议取默认端口，SOCKS 代理为 1080
+SCHEME_PORTS = {'https': 443, 'http': 80, 'socks5': 1080, 'socks5h': 1080, 'socks4': 1080, 'socks4a': 1080}
+
+Target = Tuple[str, int]
+
+
+def parse_target(text: str, default_port: int) -> Optional[Target]:
+    """'https://api.telegram.org' / 'http://10.0.0.1:1081' / '10.0.0.1:1081' → (host, port)"""
+    text = text.strip()
+    if not text:
+        return None
+    parts = urlsplit(text if '://' in text else f'//{text}')
+    if not parts.hostname:
+        return None
+    port = parts.port or SCHEME_PORTS.get(parts.scheme.lower(), default_port)
+    return parts.hostname, port
+
+
+def is_network_error(error: BaseException) -> bool:
+    """连接失败或超时（而不是服务端返回错误）"""
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+def pause_while_offline(monitor: Optional['ConnectivityMonitor'], is_running: Callable[[], bool]) -> bool:
+    """离线时阻塞到恢复在线或 is_running() 返回 False；返回是否暂停过。monitor 为 None 时总是在线"""
+    if monitor is None or monitor.is_online():
+        return False
+    while is_running() and not monitor.wait_online(OFFLINE_POLL_SECONDS):
+        pass
+    return True
+
+
+def network_down(monitor: Optional['ConnectivityMonitor'], error: BaseException) -> bool:
+    """发送出错后判断是否因为断网：是连接错误且重新探测确认离线时返回 True，调用方不必再重试"""
+    return monitor is not None and is_network_error(error) and not monitor.report_failure()
+
+
+def network_up(monitor: Optional['ConnectivityMonitor']) -> None:
+    """发送成功后调用：刚被误判为离线时立即恢复，在线时什么也不做"""
+    if monitor is not None:
+        monitor.report_success()
+
+
+def probe_targets(config_manager: ConfigManager) -> List[Target]:
+    configured = str(config_manager.get('connectivityProbeHosts'))
+    if configured.strip():
+        return [t for t in (parse_target(part, 443) for part in configured.split(',')) if t]
+    targets = []
+    proxy = parse_target(str(config_manager.get('proxy')), 80)
+    targets.append(proxy or parse_target(str(config_manager.get('telegramApiUrl')), 443))
+    if config_manager.get('enableDingTalk'):
+        targets.append(parse_target(str(config_manager.get('dingtalkWebhook')), 443))
+    targets.append(parse_target(str(config_manager.get('collectorUrl')), 80))
+    unique: List[Target] = []
+    for target in targets:
+        if target and target not in unique:
+            unique.append(target)
+    return unique
+
+
+class ConnectivityMonitor:
+    logger: logging.Logger
+    running: bool
+    config_manager: ConfigManager
+    targets: List[Target]
+    check_seconds: int
+
+    def __init__(self, config_manager: ConfigManager, clock: Clock = SYSTEM_CLOCK,
+                 actions: Optional[SystemActions] = None,
+                 probe: Optional[Callable[[Target], bool]] = None) -> None:
+        self.logger = logging.getLogger("Connectivity")
+        self.config_manager = config_manager
+        self.clock = clock
+        self.actions = actions or SystemActions()
+        # 探测函数可注入（测试中模拟断网）
+        self.probe_target = probe or self._connect
+        self.running = False
+        # 启动时假定在线，第一次探测之前不阻塞发送器
+        self.online = True
+        self._online_event = threading.Event()
+        self._online_event.set()
+        self._wake = threading.Event()
+        self._probe_lock = threading.Lock()
+        self._last_probe = float('-inf')
+        self._recheck = MIN_RECHECK_SECONDS
+
+        self.apply_config()
+        self.config_manager.add_listener(self._on_config_changed)
+
+    def apply_config(self) -> None:
+        self.targets = probe_targets(self.config_manager)
+        self.check_seconds = int(self.config_manager.get('connectivityCheckSeconds'))
+
+    def _on_config_changed(self, changed: Set[str]) -> None:
+        if changed & {'connectivityProbeHosts', 'connectivityCheckSeconds', 'proxy', 'telegramApiUrl',
+                      'enableDingTalk', 'dingtalkWebhook', 'collectorUrl'}:
+            self.apply_config()
+            self._wake.set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.check_seconds > 0 and bool(self.targets)
+
+    def _connect(self, target: Target) -> bool:
+        try:
+            socket.create_connection(target, timeout=PROBE_TIMEOUT).close()
+            return True
+        except OSError:
+            return False
+
+    def probe(self) -> bool:
+        """依次探测各目标，任一连通即在线；未开启监视时总是在线"""
+        if not self.enabled:
+            return True
+        with REGISTRY.stage('connectivity', 'probe') as stage:
+            for target in self.targets:
+                if self.probe_target(target):
+                    return True
+            stage.fail()
+        return False
+
+    def check(self) -> bool:
+        with self._probe_lock:
+            online = self.probe()
+            self._last_probe = self.clock.time()
+        self._set(online)
+        return online
+
+    def _set(self, online: bool) -> None:
+        if online == self.online:
+            return
+        self.online = online
+        if online:
+            self._recheck = MIN_RECHECK_SECONDS
+            self._online_event.set()
+            self.logger.info("Network is back online, resuming senders.")
+        else:
+            self._online_event.clear()
+            self.logger.warning(f"Network is offline ({', '.join(f'{h}:{p}' for h, p in self.targets)} "
+                                f"unreachable), pausing senders.")
+        REGISTRY.inc('connectivity_changes_total', state='online' if online else 'offline')
+        self.actions.record('connectivity', online=online)
+
+    def is_online(self) -> bool:
+        return self.online
+
+    def wait_online(self, timeout: float) -> bool:
+        """等待恢复在线，最多 timeout 秒；返回当前是否在线"""
+        return self.clock.wait(self._online_event, timeout)
+
+    def report_failure(self) -> bool:
+        """发送器遇到连接错误时调用：立即探测（刚探测到离线时复用结果），返回是否仍然在线"""
+        if not self.online and self.clock.time() - self._last_probe < PROBE_REUSE_SECONDS:
+            return False
+        online = self.check()
+        if not online:
+            self._wake.set()  # 让监视线程按离线节奏重新计时
+        return online
+
+    def report_success(self) -> None:
+        if not self.online:
+            self._set(True)
+            self._wake.set()  # 让监视线程按在线节奏重新计时
+
+    def run(self) -> None:
+        self.running = True
+        self.logger.info(f"Connectivity monitor started, probing {self.targets}.")
+        try:
+            while self.running:
+                if self.check():
+                    delay = self.check_seconds if self.enabled else MAX_RECHECK_SECONDS
+                else:
+                    delay = self._recheck
+                    self._recheck = min(self._recheck * 2, MAX_RECHECK_SECONDS)
+                    self.logger.debug("Still offline, next probe in %ds", delay)
+                self.clock.wait(self._wake, delay)
+                self._wake.clear()
+        except Exception as e:
+            self.logger.critical(f"Connectivity monitor encountered a critical error: {e}", exc_info=True)
+        finally:
+            self.running = False
+            self._set(True)  # 不再监视时不阻塞发送器
+            self.logger.info("Connectivity monitor stopped.")
+
+    def stop(self) -> None:
+        self.running = False
+        self._wake.set()
@@ -0,0 +1,338 @@
+"""
+每日使用报告图：按小时的使用时间柱状图、使用最多的程序和今天的提醒记录画在一张图上，
+每天 dailyReportTime 发送一次（发送失败时过几分钟重试），也可以用 Telegram 命令 /report 随时获取，代替大量截图说明。
+
+数据来自 UsageTracker 每秒的使用增量（在跟踪线程中累加，不加锁读取它的字段），
+今天的数据随使用统计一起保存，重启后继续累计。
+
+渲染是增量的：图分成标题、柱状图、程序列表和提醒记录四块，每块按显示的内容（精确到分钟）
+缓存，内容没变的块直接复用；整张图的 PNG 也按各块的内容缓存，重复请求不重新编码。
+每次渲染计量 CPU 时间，之后至少间隔 CPU 时间 / REPORT_CPU_SHARE 才会再次渲染，
+期间的请求返回上一次的图，旧电脑上报告占用的 CPU 不超过这个比例。
+"""
+import datetime
+import io
+import logging
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+from clock import Clock, SYSTEM_CLOCK
+from config_manager import ConfigManager
+from metrics import REGISTRY
+from system_actions import SystemActions
+from usage_tracker import UsageTracker
+
+WIDTH = 800
+HEADER_HEIGHT = 70
+CHART_HEIGHT = 260
+LIST_HEIGHT = 260
+TOP_APPS = 8
+SHOWN_EVENTS = 10
+MAX_EVENTS = 200
+# 前台程序的采样间隔和保存到使用统计的间隔（秒）
+APP_SAMPLE_SECONDS = 5
+SAVE_SECONDS = 60
+# 定时报告发送失败后的重试间隔（秒）
+REPORT_RETRY_SECONDS = 300
+# 报告渲染最多占用的 CPU 比例
+REPORT_CPU_SHARE = 0.05
+
+# 报告中显示的提醒事件（RestReminder 通过 SystemActions.record 记录的决策）
+EVENT_LABELS = {
+    'reminder': "提醒休息",
+    'shutdown_warning': "关机提醒",
+    'forced_rest': "强制休息",
+    'extend': "延长时间",
+}
+FONT_CANDIDATES = ('msyh.ttc', 'simhei.ttf', 'NotoSansCJK-Regular.ttc', 'wqy-microhei.ttc', 'DejaVuSans.ttf')
+
+BACKGROUND = (250, 250, 250)
+TEXT = (40, 40, 40)
+MUTED = (130, 130, 130)
+BAR = (0, 120, 212)
+
+# (PNG 数据, 说明文字) -> 是否发送成功
+Deliver = Callable[[bytes, str], bool]
+
+
+def load_font(size: int) -> ImageFont.ImageFont:
+    for name in FONT_CANDIDATES:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size)
+
+
+class ReportActions(SystemActions):
+    """真实的系统动作，同时把提醒决策记入每日报告"""
+
+    def __init__(self, report: 'DailyReport') -> None:
+        super().__init__()
+        self.report = report
+
+    def record(self, event: str, **details: Any) -> None:
+        self.report.add_event(event)
+
+
+class DailyReport:
+    logger: logging.Logger
+    config_manager: ConfigManager
+    usage_tracker: UsageTracker
+    report_time: Optional[datetime.time]
+
+    def __init__(self, config_manager: ConfigManager, usage_tracker: UsageTracker, clock: Clock = SYSTEM_CLOCK,
+                 deliver: Optional[Deliver] = None) -> None:
+        self.logger = logging.getLogger("DailyReport")
+        self.config_manager = config_manager
+        self.usage_tracker = usage_tracker
+        self.clock = clock
+        # 发送报告图的函数 (PNG 数据, 说明文字)，由 main.py 接到 Telegram 发送器
+        self.deliver = deliver
+        self._lock = threading.Lock()
+        self._render_lock = threading.Lock()
+        self.day = self.clock.today()
+        self.hours = [0.0] * 24
+        self.apps: Counter = Counter()
+        self.events: List[Tuple[float, str]] = []
+        self.total = 0.0
+        self.sent = False
+        # 定时报告正在后台发送，以及发送失败后下一次重试的时间
+        self._sending = False
+        self._retry_at = float('-inf')
+        self._app_pending = 0.0
+        self._app_sampled_at = float('-inf')
+        self._saved_at = self.clock.time()
+        # 各块的 (内容, 图像) 缓存，以及整张图的 (各块内容, PNG)
+        self._sections: Dict[str, Tuple[Any, Image.Image]] = {}
+        self._png: Optional[Tuple[Tuple[Any, ...], bytes]] = None
+        self._render_after = 0.0
+        self._fonts = {size: load_font(size) for size in (14, 18, 26)}
+
+        self.apply_config()
+        self.config_manager.add_listener(self._on_config_changed)
+        self._restore(self.usage_tracker.previous_stats.get('report'))
+        self.usage_tracker.add_usage_listener(self.add_usage)
+        self.usage_tracker.add_profile_listener(self._on_profile_switched, before_switch=self._before_switch)
+
+    def apply_config(self) -> None:
+        text = str(self.config_manager.get('dailyReportTime')).strip()
+        try:
+            self.report_time = datetime.datetime.strptime(text, '%H:%M').time() if text else None
+        except ValueError:
+            self.logger.error(f"Invalid dailyReportTime '{text}', expected HH:MM")
+            self.report_time = None
+
+    def _on_config_changed(self, changed: Set[str]) -> None:
+        if 'dailyReportTime' in changed:
+            self.apply_config()
+
+    def _restore(self, saved: Any) -> None:
+        """启动时恢复今天已经累计的数据；保存的是前几天的就从头开始"""
+        if not isinstance(saved, dict) or saved.get('date') != self.day.isoformat():
+            return
+        try:
+            hours = [float(h) for h in saved.get('hours', [])][:24]
+            self.hours = hours + [0.0] * (24 - len(hours))
+            self.apps = Counter({str(k): float(v) for k, v in saved.get('apps', {}).items()})
+            self.events = [(float(ts), str(name)) for ts, name in saved.get('events', [])][-MAX_EVENTS:]
+            self.sent = bool(saved.get('sent'))
+        except (TypeError, ValueError) as e:
+            self.logger.warning(f"Ignoring saved report data: {e}")
+            self.hours, self.apps, self.events, self.sent = [0.0] * 24, Counter(), [], False
+
+    def _save(self) -> None:
+        data = {'date': self.day.isoformat(), 'hours': [int(h) for h in self.hours],
+                'apps': {name: int(seconds) for name, seconds in self.apps.most_common(50)},
+                'events': [[int(ts), name] for ts, name in self.events], 'sent': self.sent}
+        with self.usage_tracker.lock:
+            self.usage_tracker.extra_stats['report'] = data
+
+    def _before_switch(self) -> None:
+        with self._lock:
+            self._save()
+
+    def _on_profile_switched(self) -> None:
+        """切换用户后换成新用户今天的报告数据"""
+        with self._lock:
+            self.day, self.hours, self.apps, self.events, self.sent = self.clock.today(), [0.0] * 24, Counter(), [], False
+            self.total = self.usage_tracker.daily_usage_time
+            self._app_pending = 0.0
+            self._restore(self.usage_tracker.previous_stats.get('report'))
+            self._save()
+
+    def add_usage(self, delta: float) -> None:
+        """UsageTracker 的增量回调（在跟踪线程中）：累加到当前小时和前台程序，到时间发送报告"""
+        now = self.clock.now()
+        with self._lock:
+            if now.date() != self.day:
+                self.day, self.hours, self.apps, self.events, self.sent = now.date(), [0.0] * 24, Counter(), [], False
+            self.hours[now.hour] += delta
+            self._app_pending += delta
+            self.total = self.usage_tracker.daily_usage_time  # 跟踪线程是唯一的写入者，不用加锁
+        if self.clock.time() - self._app_sampled_at >= APP_SAMPLE_SECONDS:
+            self._app_sampled_at = self.clock.time()
+            app = self.usage_tracker.probe.active_app() or "其他"
+            with self._lock:
+                self.apps[app] += self._app_pending
+                self._app_pending = 0.0
+        if self.clock.time() - self._saved_at >= SAVE_SECONDS:
+            self._saved_at = self.clock.time()
+            with self._lock:
+                self._save()
+        if (self.report_time and not self.sent and not self._sending and now.time() >= self.report_time
+                and self.clock.time() >= self._retry_at):
+            # 等待发送结果可能要很久，不占用跟踪线程
+            self._sending = True
+            threading.Thread(target=self._send_scheduled, args=(self.day,), name="DailyReport send",
+                             daemon=True).start()
+
+    def _send_scheduled(self, day: datetime.date) -> None:
+        ok = False
+        try:
+            ok = self.send("每日使用报告")
+        finally:
+            with self._lock:
+                self._sending = False
+                if day != self.day:
+                    return  # 发送期间日期或用户已切换
+                if ok:
+                    self.sent = True
+                    self._save()
+                else:
+                    self._retry_at = self.clock.time() + REPORT_RETRY_SECONDS
+        if ok:
+            # 立即写入统计文件，之后重新启动也不会重复发送
+            self.usage_tracker.save_usage_stats()
+        else:
+            self.logger.warning(f"Daily report not sent, retrying in {REPORT_RETRY_SECONDS}s")
+
+    def add_event(self, event: str) -> None:
+        if event not in EVENT_LABELS:
+            return
+        with self._lock:
+            self.events.append((self.clock.time(), event))
+            del self.events[:-MAX_EVENTS]
+
+    def send(self, caption: str) -> bool:
+        if not self.deliver:
+            return False
+        png = self.render()
+        if png is None:
+            return False
+        profile = self.config_manager.profile
+        return bool(self.deliver(png, f"{caption} {self.day.isoformat()}" + (f" {profile}" if profile else "")))
+
+    # --- 渲染 ---
+
+    def _keys(self) -> Dict[str, Any]:
+        """各块显示的内容（分钟精度）；内容相同的块不重新绘制"""
+        with self._lock:
+            return {
+                'header': (self.day, int(self.total // 60)),
+                'chart': tuple(int(h // 60) for h in self.hours),
+                'apps': tuple((name, int(seconds // 60)) for name, seconds in self.apps.most_common(TOP_APPS)),
+                'events': tuple(self.events[-SHOWN_EVENTS:]),
+            }
+
+    def render(self) -> Optional[bytes]:
+        """今天的报告图（PNG）；内容没变或还在 CPU 冷却期内时返回缓存"""
+        with self._render_lock:
+            return self._render()
+
+    def _render(self) -> Optional[bytes]:
+        keys = self._keys()
+        signature = tuple(keys.values())
+        if self._png and (self._png[0] == signature or time.monotonic() < self._render_after):
+            REGISTRY.inc('report_cache_total', result='hit')
+            return self._png[1]
+        REGISTRY.inc('report_cache_total', result='miss')
+        started = time.process_time()
+        try:
+            with REGISTRY.stage('report', 'render') as stage:
+                sections = [self._section(name, key) for name, key in keys.items()]
+                image = Image.new('RGB', (WIDTH, sum(s.height for s in sections)), BACKGROUND)
+                y = 0
+                for section in sections:
+                    image.paste(section, (0, y))
+                    y += section.height
+                buffer = io.BytesIO()
+                image.save(buffer, format='PNG')
+                stage.bytes = buffer.tell()
+        except Exception as e:
+            self.logger.error(f"Error rendering daily report: {e}", exc_info=True)
+            return self._png[1] if self._png else None
+        cpu = time.process_time() - started
+        self._render_after = time.monotonic() + cpu / REPORT_CPU_SHARE
+        self._png = (signature, buffer.getvalue())
+        self.logger.debug("Rendered daily report in %.3fs CPU", cpu)
+        return self._png[1]
+
+    def _section(self, name: str, key: Any) -> Image.Image:
+        cached = self._sections.get(name)
+        if cached and cached[0] == key:
+            return cached[1]
+        image = getattr(self, f'_draw_{name}')(key)
+        self._sections[name] = (key, image)
+        return image
+
+    def _canvas(self, height: int) -> Tuple[Image.Image, ImageDraw.ImageDraw]:
+        image = Image.new('RGB', (WIDTH, height), BACKGROUND)
+        return image, ImageDraw.Draw(image)
+
+    def _draw_header(self, key: Tuple[datetime.date, int]) -> Image.Image:
+        day, minutes = key
+        image, draw = self._canvas(HEADER_HEIGHT)
+        draw.text((20, 18), f"使用报告 {day.isoformat()}", font=self._fonts[26], fill=TEXT)
+        total = f"今日累计 {self.usage_tracker.format_time(minutes * 60)}"
+        draw.text((WIDTH - 20, 24), total, font=self._fonts[18], fill=TEXT, anchor='ra')
+        draw.line((20, HEADER_HEIGHT - 2, WIDTH - 20, HEADER_HEIGHT - 2), fill=MUTED)
+        return image
+
+    def _draw_chart(self, minutes: Tuple[int, ...]) -> Image.Image:
+        image, draw = self._canvas(CHART_HEIGHT)
+        left, top, bottom = 50, 30, CHART_HEIGHT - 30
+        draw.text((20, 6), "每小时使用（分钟）", font=self._fonts[14], fill=MUTED)
+        for value in (0, 30, 60):
+            y = bottom - (bottom - top) * value // 60
+            draw.line((left, y, WIDTH - 20, y), fill=(225, 225, 225))
+            draw.text((left - 8, y), str(value), font=self._fonts[14], fill=MUTED, anchor='rm')
+        slot = (WIDTH - 20 - left) / 24
+        for hour, value in enumerate(minutes):
+            x = left + hour * slot
+            if value:
+                height = (bottom - top) * min(value, 60) / 60
+                draw.rectangle((x + 3, bottom - height, x + slot - 3, bottom), fill=BAR)
+            if hour % 3 == 0:
+                draw.text((x + slot / 2, bottom + 6), str(hour), font=self._fonts[14], fill=MUTED, anchor='ma')
+        return image
+
+    def _draw_apps(self, apps: Tuple[Tuple[str, int], ...]) -> Image.Image:
+        image, draw = self._canvas(LIST_HEIGHT)
+        draw.text((20, 6), "使用最多的程序", font=self._fonts[14], fill=MUTED)
+        longest = max((minutes for _, minutes in apps), default=0)
+        for i, (app, minutes) in enumerate(apps):
+            y = 34 + i * 27
+            draw.text((20, y), app[:28], font=self._fonts[14], fill=TEXT)
+            if longest:
+                draw.rectangle((260, y + 2, 260 + 380 * minutes / longest, y + 16), fill=BAR)
+            draw.text((WIDTH - 20, y), self.usage_tracker.format_time(minutes * 60), font=self._fonts[14],
+                      fill=TEXT, anchor='ra')
+        if not apps:
+            draw.text((20, 34), "暂无数据", font=self._fonts[14], fill=MUTED)
+        return image
+
+    def _draw_events(self, events: Tuple[Tuple[float, str], ...]) -> Image.Image:
+        image, draw = self._canvas(LIST_HEIGHT + 20)
+        draw.line((20, 2, WIDTH - 20, 2), fill=MUTED)
+        draw.text((20, 10), "今天的提醒", font=self._fonts[14], fill=MUTED)
+        for i, (ts, event) in enumerate(events):
+            at = datetime.datetime.fromtimestamp(ts).strftime('%H:%M')
+            draw.text((20, 38 + i * 24), f"{at}  {EVENT_LABELS[event]}", font=self._fonts[14], fill=TEXT)
+        if not events:
+            draw.text((20, 38), "没有提醒", font=self._fonts[14], fill=MUTED)
+        return image
@@ -0,0 +1,175 @@
+"""
+按需诊断：托盘菜单中开启后，在 N 秒内对所有线程做采样分析，同时用 tracemalloc 比较开始和结束时的 Python 内存，
+报告写入 dataFolder。关闭时没有任何后台线程或钩子，不影响正常运行。
+
+采样每隔 profileSampleMs 读取一次各线程的调用栈（sys._current_frames），按线程名统计：
+- *_profile.txt：每个线程中占用采样最多的函数（自身 / 含调用）；
+- *_stacks.txt：折叠的调用栈（线程名;外层;...;内层 次数），可以直接用 flamegraph.pl 画火焰图；
+- *_memory.txt：分析期间 Python 内存增长最多的代码行。
+"""
+import datetime
+import logging
+import os
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from clock import Clock, SYSTEM_CLOCK
+from config_manager import ConfigManager
+
+# 报告中每个线程列出的函数数和内存增长列出的行数
+TOP_FUNCTIONS = 15
+TOP_ALLOCATIONS = 30
+# tracemalloc 每次分配记录的栈深度
+TRACE_FRAMES = 10
+
+Stack = Tuple[str, ...]
+
+
+def frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Diagnostics:
+    logger: logging.Logger
+    config_manager: ConfigManager
+    sample_seconds: float
+
+    def __init__(self, config_manager: ConfigManager, clock: Clock = SYSTEM_CLOCK) -> None:
+        self.logger = logging.getLogger("Diagnostics")
+        self.config_manager = config_manager
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        # 线程名 → 折叠的调用栈 → 采样次数
+        self._stacks: Dict[str, Counter] = {}
+        self._samples = 0
+        self._started_at = 0.0
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._started_tracing = False
+
+        self.apply_config()
+        self.config_manager.add_listener(self._on_config_changed)
+
+    def apply_config(self) -> None:
+        self.sample_seconds = max(1, int(self.config_manager.get('profileSampleMs'))) / 1000
+
+    def _on_config_changed(self, changed: Set[str]) -> None:
+        if 'profileSampleMs' in changed:
+            self.apply_config()
+
+    @property
+    def active(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: int, on_done: Optional[Callable[[List[str]], None]] = None) -> bool:
+        """开始 seconds 秒的分析，结束后写报告并用报告路径调用 on_done；已在分析时返回 False"""
+        with self._lock:
+            if self.active:
+                return False
+            self._stop.clear()
+            self._stacks = {}
+            self._samples = 0
+            self._started_at = self.clock.time()
+            self._started_tracing = not tracemalloc.is_tracing()
+            if self._started_tracing:
+                tracemalloc.start(TRACE_FRAMES)
+            self._snapshot = tracemalloc.take_snapshot()
+            self._thread = threading.Thread(target=self._run, args=(seconds, on_done), name="diagnostics",
+                                            daemon=True)
+            self._thread.start()
+        self.logger.info(f"Profiling all threads for {seconds}s (sample every {self.sample_seconds * 1000:.0f}ms).")
+        return True
+
+    def stop(self) -> None:
+        """提前结束分析，报告照常写出"""
+        self._stop.set()
+
+    def _run(self, seconds: int, on_done: Optional[Callable[[List[str]], None]]) -> None:
+        paths: List[str] = []
+        try:
+            deadline = self.clock.time() + seconds
+            while not self._stop.is_set() and self.clock.time() < deadline:
+                self.sample()
+                self.clock.wait(self._stop, self.sample_seconds)
+            paths = self.write_reports()
+        except Exception as e:
+            self.logger.error(f"Diagnostics failed: {e}", exc_info=True)
+        finally:
+            if self._started_tracing and tracemalloc.is_tracing():
+                tracemalloc.stop()
+            self._snapshot = None
+        if on_done:
+            on_done(paths)
+
+    def sample(self) -> None:
+        """记录一次所有线程（分析线程本身除外）的调用栈"""
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack: List[str] = []
+            while frame is not None:
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            name = names.get(ident, f"thread-{ident}")
+            self._stacks.setdefault(name, Counter())[tuple(reversed(stack))] += 1
+        self._samples += 1
+
+    def profile_report(self) -> str:
+        elapsed = self.clock.time() - self._started_at
+        started = datetime.datetime.fromtimestamp(self._started_at).strftime('%Y-%m-%d %H:%M:%S')
+        lines = [f"Sampling profile from {started}, {elapsed:.1f}s, {self._samples} samples "
+                 f"every {self.sample_seconds * 1000:.0f}ms", ""]
+        for name, stacks in sorted(self._stacks.items(), key=lambda item: -sum(item[1].values())):
+            total = sum(stacks.values())
+            own: Counter = Counter()
+            inclusive: Counter = Counter()
+            for stack, count in stacks.items():
+                own[stack[-1]] += count
+                for label in set(stack):
+                    inclusive[label] += count
+            lines.append(f"== {name} ({total} samples) ==")
+            lines.append(f"{'self%':>7} {'total%':>7}  function")
+            for label, count in own.most_common(TOP_FUNCTIONS):
+                lines.append(f"{100 * count / total:7.1f} {100 * inclusive[label] / total:7.1f}  {label}")
+            lines.append("")
+        return '\n'.join(lines)
+
+    def stacks_report(self) -> str:
+        return '\n'.join(f"{';'.join((name,) + stack)} {count}"
+                         for name, stacks in sorted(self._stacks.items())
+                         for stack, count in stacks.most_common()) + '\n'
+
+    def memory_report(self) -> str:
+        if self._snapshot is None or not tracemalloc.is_tracing():
+            return "tracemalloc was not running\n"
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ))
+        differences = snapshot.compare_to(self._snapshot, 'lineno')
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"Python heap now {current / 1024:.0f} KiB, peak {peak / 1024:.0f} KiB", "",
+                 f"Top {TOP_ALLOCATIONS} lines by growth during the profile:"]
+        lines.extend(str(stat) for stat in differences[:TOP_ALLOCATIONS])
+        return '\n'.join(lines) + '\n'
+
+    def write_reports(self) -> List[str]:
+        folder = str(self.config_manager.get('dataFolder'))
+        os.makedirs(folder, exist_ok=True)
+        prefix = os.path.join(folder, datetime.datetime.fromtimestamp(self._started_at)
+                              .strftime('diagnostics_%Y%m%d_%H%M%S'))
+        paths = []
+        for suffix, text in (('profile', self.profile_report()), ('stacks', self.stacks_report()),
+                             ('memory', self.memory_report())):
+            path = f"{prefix}_{suffix}.txt"
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            paths.append(path)
+        self.logger.info(f"Diagnostics reports written: {', '.join(paths)}")
+        return paths
@@ -1,49 +1,104 @@
 # -*- coding: utf-8 -*-
 
 import os
-import time
+import hashlib
 import socket
 import platform
 import requests
+from PIL import Image
 import threading
 import logging
-from PIL import ImageGrab
-from datetime import datetime
 from typing import Optional
 
+from metrics import REGISTRY
+from capture_backends import ConfiguredCapture
+from memory_budget import CycleMemory, MultipartStream, fit_to_budget
+from clock import SYSTEM_CLOCK
+from system_actions import SystemActions
+from send_scheduler import BANDWIDTH, PACING_KEYS, AdaptiveInterval, pacing_settings
+from outbound_queue import FRAME, OUTBOX
+from connectivity import network_down, network_up, pause_while_offline
+from url_cache import UploadUrlCache
+
+# 判断“几乎相同”的截图：缩成这个尺寸、每个颜色通道保留高 5 位后比较
+FINGERPRINT_SIZE = (64, 36)
+FINGERPRINT_SHIFT = 3
+
+# 发送循环出错后等待多久再继续（秒）
+ERROR_RETRY_SECONDS = 60
+
 
 class DingTalkSender:
     """
     钉钉图片发送器 - 定期发送桌面截图到钉钉群
     """
 
-    def __init__(self, config_manager, usage_tracker=None):
+    def __init__(self, config_manager, usage_tracker=None, capture=None, clock=SYSTEM_CLOCK, actions=None,
+                 archive=None, outbox=None, connectivity=None, on_frame=None, url_cache=None):
         """
         初始化钉钉发送器
 
         Args:
             config_manager: 配置管理器实例
             usage_tracker: 使用时间追踪器实例（可选）
+            capture: 返回 PIL 图像的截图函数（可选，默认截取主屏幕）
+            clock: 时钟（可选，模拟器中注入虚拟时钟）
+            actions: 系统动作层（可选，用于记录发送决策）
+            archive: 本地截图存档（可选，发送后存入历史）
+            outbox: 出站队列（可选，默认使用本机共用的队列）
+            connectivity: 连通性监视（可选，离线时暂停截图和上传）
+            on_frame: 每张截图的回调（可选，局域网接口的缩略图）
+            url_cache: 截图哈希到 ImgBB URL 的缓存（可选，默认保存在 dataFolder）
         """
         self.config_manager = config_manager
         self.usage_tracker = usage_tracker
+        self.capture = capture or ConfiguredCapture(config_manager, all_screens=False)
+        self.clock = clock
+        self.actions = actions or SystemActions()
+        self.archive = archive
+        self.outbox = outbox or OUTBOX
+        self.connectivity = connectivity
+        self.on_frame = on_frame
+        # 已上传截图的 URL：内容相同的截图不再上传
+        self.url_cache = url_cache or UploadUrlCache(config_manager, clock)
+        self._fingerprint = None
         self.logger = logging.getLogger("DingTalkSender")
         self.running = False
         self.thread = None
+        # 发送间隔：按计算机名错开发送时刻，可按活动情况自适应调整
+        self.pacer = AdaptiveInterval(config_manager.get('dingtalkInterval') * 60, clock=clock,
+                                      away=usage_tracker.is_away if usage_tracker else None)
 
         # 从配置文件读取参数
-        self.webhook_url = self.config_manager.get_setting('Settings', 'dingtalkwebhook', fallback='')
-        self.imgbb_api_key = self.config_manager.get_setting('Settings', 'imgbbapi', fallback='')
-        self.interval_minutes = self.config_manager.get_setting('Settings', 'dingtalkinterval', type=int, fallback=5)
-
-        # API URLs
-        self.imgbb_upload_url = "https://api.imgbb.com/1/upload"
+        self.apply_config()
+        self.config_manager.add_listener(self._on_config_changed)
+        self.outbox.add_alert_channel('dingtalk', self.send_alert)
 
         # 临时文件名
         self.screenshot_filename = "dingtalk_screenshot_temp.png"
 
         self.logger.info("DingTalkSender initialized")
 
+    def apply_config(self):
+        """
+        从配置管理器读取参数，初始化和配置热加载时都会调用
+        """
+        self.webhook_url = self.config_manager.get('dingtalkWebhook')
+        self.imgbb_api_key = self.config_manager.get('imgbbApi')
+        self.imgbb_upload_url = self.config_manager.get('imgbbUploadUrl')
+        self.imgbb_expiration = self.config_manager.get('imgbbExpirationSeconds')
+        self.reuse_similar = self.config_manager.get('imgbbReuseSimilar')
+        self.interval_minutes = self.config_manager.get('dingtalkInterval')
+        self.pacer.configure(self.interval_minutes * 60, **pacing_settings(self.config_manager))
+        BANDWIDTH.configure(self.config_manager.get('uploadBudgetKBps') * 1024)
+
+    def _on_config_changed(self, changed):
+        if changed & ({'dingtalkWebhook', 'imgbbApi', 'imgbbUploadUrl', 'imgbbExpirationSeconds',
+                       'imgbbReuseSimilar', 'dingtalkInterval', 'uploadBudgetKBps'}
+                      | PACING_KEYS):
+            self.apply_config()
+            self.logger.info(f"钉钉配置已更新，发送间隔: {self.interval_minutes}分钟")
+
     def get_system_info(self) -> dict:
         """
         获取系统信息
@@ -82,7 +137,7 @@ class DingTalkSender:
                 usage_time = self.usage_tracker.format_time(today_usage_seconds)
 
             # 获取当前时间
-            current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            current_time = self.clock.now().strftime("%Y-%m-%d %H:%M:%S")
 
             return {
                 'ip': ip_address,  # 使用新的ip_address变量
@@ -97,7 +152,7 @@ class DingTalkSender:
                 'ip': '未知',
                 'computer_name': '未知',
                 'usage_time': '未知',
-                'current_time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                'current_time': self.clock.now().strftime("%Y-%m-%d %H:%M:%S"),
                 'hostname': '未知'
             }
 
@@ -109,20 +164,68 @@ class DingTalkSender:
             成功返回True，失败返回False
         """
         try:
-            screenshot = ImageGrab.grab()
-            screenshot.save(self.screenshot_filename)
-            self.logger.debug(f"截图已保存: {self.screenshot_filename}")
+            with REGISTRY.stage('dingtalk', 'grab'):
+                # 超过 captureMaxPixels 的截图在复制全尺寸图像之前就缩小
+                max_pixels = self.config_manager.get('captureMaxPixels')
+                grab_scaled = getattr(self.capture, 'grab_scaled', None)
+                screenshot = grab_scaled(max_pixels) if grab_scaled else fit_to_budget(self.capture(), max_pixels)
+            self.pacer.observe_frame(screenshot)
+            if self.reuse_similar:
+                thumbnail = screenshot.convert('RGB').resize(FINGERPRINT_SIZE, Image.BOX)
+                self._fingerprint = hashlib.sha256(
+                    bytes(value >> FINGERPRINT_SHIFT for value in thumbnail.tobytes())).hexdigest()
+            if self.on_frame:
+                self.on_frame(screenshot)
+            with REGISTRY.stage('dingtalk', 'save') as stage:
+                screenshot.save(self.screenshot_filename)
+                stage.bytes = os.path.getsize(self.screenshot_filename)
+            self.logger.debug("截图已保存: %s", self.screenshot_filename)
             return True
         except Exception as e:
             self.logger.error(f"截图失败: {e}")
             return False
 
-    def upload_to_imgbb(self, file_path: str) -> Optional[str]:
+    def frame_key(self, file_path: str) -> str:
+        """
+        截图在 URL 缓存中的键：imgbbReuseSimilar 开启时为量化缩略图的哈希（几乎相同的截图键相同），
+        否则为文件内容的哈希
+
+        Args:
+            file_path: 图片文件路径
+        """
+        if self.reuse_similar and self._fingerprint:
+            return self._fingerprint
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def cached_upload(self, file_path: str) -> Optional[str]:
+        """
+        上传截图，相同的截图直接使用缓存中的 URL
+
+        Args:
+            file_path: 图片文件路径
+
+        Returns:
+            成功返回图片URL，失败返回None
+        """
+        key = self.frame_key(file_path)
+        image_url = self.url_cache.get(key)
+        if image_url:
+            self.logger.debug("截图与已上传的相同，跳过上传: %s", image_url)
+            return image_url
+        return self.upload_to_imgbb(file_path, cache_key=key)
+
+    @REGISTRY.timed('dingtalk', 'upload')
+    def upload_to_imgbb(self, file_path: str, cache_key: Optional[str] = None) -> Optional[str]:
         """
         上传图片到ImgBB图床
 
         Args:
             file_path: 图片文件路径
+            cache_key: 上传成功后以此为键记入 URL 缓存（可选）
 
         Returns:
             成功返回图片URL，失败返回None
@@ -132,29 +235,42 @@ class DingTalkSender:
             return None
 
         try:
-            with open(file_path, 'rb') as f:
-                params = {'key': self.imgbb_api_key}
-                files = {'image': f}
-                response = requests.post(self.imgbb_upload_url, params=params, files=files, timeout=60)
-                response.raise_for_status()
+            params = {'key': self.imgbb_api_key}
+            if self.imgbb_expiration > 0:
+                params['expiration'] = self.imgbb_expiration
+            # 请求体从文件流式读取，不在内存中拼出完整的 multipart
+            body = MultipartStream({}, 'image', os.path.basename(file_path), path=file_path,
+                                   content_type='image/png')
+            size = os.path.getsize(file_path)
+            REGISTRY.observe_bytes(size, sender='dingtalk', stage='upload')
+            BANDWIDTH.acquire(size, 'dingtalk')
+            response = requests.post(self.imgbb_upload_url, params=params, data=body,
+                                     headers={'Content-Type': body.content_type}, timeout=60)
+            response.raise_for_status()
+            network_up(self.connectivity)
 
-                data = response.json()
-                if data.get("success") and data.get("data"):
-                    image_url = data['data']['url']
-                    self.logger.debug(f"图片上传成功: {image_url}")
-                    return image_url
-                else:
-                    error_message = data.get("error", {}).get("message", "未知错误")
-                    self.logger.error(f"图片上传失败: {error_message}")
-                    return None
+            data = response.json()
+            if data.get("success") and data.get("data"):
+                image_url = data['data']['url']
+                self.logger.debug("图片上传成功: %s", image_url)
+                if cache_key:
+                    # ImgBB 返回这张图片实际的保存期限，"0" 表示不删除
+                    self.url_cache.put(cache_key, image_url, float(data['data'].get('expiration') or 0))
+                return image_url
+            else:
+                error_message = data.get("error", {}).get("message", "未知错误")
+                self.logger.error(f"图片上传失败: {error_message}")
+                return None
 
         except requests.exceptions.RequestException as e:
-            self.logger.error(f"上传图片网络错误: {e}")
+            if not network_down(self.connectivity, e):
+                self.logger.error(f"上传图片网络错误: {e}")
             return None
         except Exception as e:
             self.logger.error(f"上传图片时发生错误: {e}")
             return None
 
+    @REGISTRY.timed('dingtalk', 'webhook')
     def send_webhook_message(self, image_url: str, system_info: dict) -> bool:
         """
         通过Webhook发送消息到钉钉
@@ -192,6 +308,7 @@ class DingTalkSender:
 
             response = requests.post(self.webhook_url, json=payload, headers=headers, timeout=30)
             response.raise_for_status()
+            network_up(self.connectivity)
 
             data = response.json()
             if data.get("errcode") == 0:
@@ -202,12 +319,38 @@ class DingTalkSender:
                 return False
 
         except requests.exceptions.RequestException as e:
-            self.logger.error(f"发送钉钉消息网络错误: {e}")
+            if not network_down(self.connectivity, e):
+                self.logger.error(f"发送钉钉消息网络错误: {e}")
             return False
         except Exception as e:
             self.logger.error(f"发送钉钉消息时发生错误: {e}")
             return False
 
+    def send_alert(self, text: str) -> bool:
+        """
+        告警渠道：发送一条文字消息；钉钉发送关闭或未配置 Webhook 时不发送
+
+        Args:
+            text: 告警内容
+        """
+        if not self.config_manager.get('enableDingTalk') or not self.webhook_url:
+            return False
+        try:
+            with REGISTRY.stage('dingtalk', 'send_alert') as stage:
+                response = requests.post(self.webhook_url, json={"msgtype": "text", "text": {"content": text}},
+                                         timeout=30)
+                response.raise_for_status()
+                data = response.json()
+                if data.get("errcode") != 0:
+                    self.logger.error(f"发送钉钉告警失败: {data.get('errmsg')}")
+                    stage.fail()
+                    return False
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self.logger.error(f"发送钉钉告警失败: {e}")
+            return False
+        return True
+
+    @REGISTRY.timed('dingtalk', 'cycle')
     def send_screenshot(self) -> bool:
         """
         发送截图到钉钉
@@ -226,7 +369,7 @@ class DingTalkSender:
             # 3. 通过Webhook方式发送
             if self.webhook_url and self.imgbb_api_key:
                 self.logger.debug("使用Webhook方式发送")
-                image_url = self.upload_to_imgbb(self.screenshot_filename)
+                image_url = self.cached_upload(self.screenshot_filename)
                 if image_url:
                     success = self.send_webhook_message(image_url, system_info)
                     if success:
@@ -243,6 +386,8 @@ class DingTalkSender:
         finally:
             # 清理临时文件
             if os.path.exists(self.screenshot_filename):
+                if self.archive:
+                    self.archive.add_file(self.screenshot_filename, 'dingtalk')
                 try:
                     os.remove(self.screenshot_filename)
                     self.logger.debug("临时截图文件已清理")
@@ -257,33 +402,55 @@ class DingTalkSender:
         self.logger.info(f"钉钉发送器开始运行，发送间隔: {self.interval_minutes}分钟")
 
         try:
+            # 第一次发送也等到本机的时间槽，开机时间相同的电脑不会同时上传
+            started = self.clock.time()
+            while self.running and self.next_delay(started) > 0:
+                self.clock.sleep(1)
+
             while self.running:
                 try:
+                    # 离线时暂停；恢复联网后不等下一个时间槽，立即发送一次
+                    pause_while_offline(self.connectivity, lambda: self.running)
+                    if not self.running:
+                        break
                     # 发送截图
-                    self.send_screenshot()
-
-                    # 等待指定间隔
-                    for _ in range(self.interval_minutes * 60):  # 转换为秒
-                        if not self.running:
-                            break
-                        time.sleep(1)
+                    uploaded_before = BANDWIDTH.used_today()[0]
+                    with CycleMemory('dingtalk'):
+                        ok = self.outbox.send(FRAME, self.send_screenshot, 'dingtalk screenshot',
+                                              key='dingtalk-frame')
+                    interval = self.pacer.finish_cycle(max(0, BANDWIDTH.used_today()[0] - uploaded_before))
+                    self.actions.record('send', sender='dingtalk', ok=ok, interval=interval)
+
+                    # 等待下一次发送，每秒重新计算，配置修改或用户回来后立即生效
+                    cycle_end = self.clock.time()
+                    while self.running and self.next_delay(cycle_end) > 0:
+                        self.clock.sleep(1)
 
                 except Exception as e:
                     self.logger.error(f"发送循环中发生错误: {e}")
                     # 发生错误时等待一段时间再继续
-                    time.sleep(60)
+                    self.clock.sleep(ERROR_RETRY_SECONDS)
 
         except Exception as e:
             self.logger.critical(f"钉钉发送器运行时发生严重错误: {e}")
         finally:
             self.logger.info("钉钉发送器已停止")
 
+    def next_delay(self, last_send):
+        """
+        距离下一次发送还有多少秒
+
+        Args:
+            last_send: 上一次发送结束的时间戳
+        """
+        return self.pacer.next_send(last_send) - self.clock.time()
+
     def start(self):
         """
         启动钉钉发送器线程
         """
         if not self.running:
-            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread = threading.Thread(target=self.run, name="DingTalk sender", daemon=True)
             self.thread.start()
             self.logger.info("钉钉发送器线程已启动")
 
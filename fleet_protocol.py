@@ -0,0 +1,121 @@
+"""
+代理(agent)与汇聚服务(collector)之间的批量传输格式。
+
+一个批次 = 头部 + 若干记录:
+    头部:  b'KPCB' | 版本(1 字节) | agent_id 长度(1 字节) | agent_id(UTF-8) | 记录数(2 字节)
+    记录:  类型(1 字节) | 负载长度(4 字节) | 负载
+所有整数均为大端序。帧记录的负载为: 元数据长度(2 字节) | 元数据 JSON | 图像字节。
+增量帧记录的负载格式相同，图像字节换成 tile_delta 编码的关键帧或增量帧；不认识该类型的旧 collector 直接跳过。
+心跳记录的负载为定长二进制(见 encode_heartbeat)，约 25 字节加前台程序名。
+"""
+import json
+import struct
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+MAGIC = b'KPCB'
+VERSION = 1
+
+RECORD_HEARTBEAT = 1
+RECORD_FRAME = 2
+RECORD_DELTA = 3
+
+_HEADER = struct.Struct('>4sBB')
+_COUNT = struct.Struct('>H')
+_RECORD = struct.Struct('>BI')
+_META = struct.Struct('>H')
+# 心跳: 版本 | 标志位 | 序号 | 时间戳 | 今日累计秒 | 连续使用秒 | 空闲秒 | 程序名长度
+HEARTBEAT_VERSION = 1
+HEARTBEAT_IDLE = 0x01
+_HEARTBEAT = struct.Struct('>BBIIIIIB')
+_U32 = 0xFFFFFFFF
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+class Record(NamedTuple):
+    type: int
+    payload: bytes
+
+
+def encode_frame(meta: Dict[str, Any], image: bytes) -> bytes:
+    meta_bytes = json.dumps(meta, separators=(',', ':')).encode('utf-8')
+    return _META.pack(len(meta_bytes)) + meta_bytes + image
+
+
+def decode_frame(payload: bytes) -> Tuple[Dict[str, Any], bytes]:
+    if len(payload) < _META.size:
+        raise ProtocolError("truncated frame record")
+    (meta_len,) = _META.unpack_from(payload)
+    end = _META.size + meta_len
+    if len(payload) < end:
+        raise ProtocolError("truncated frame metadata")
+    return json.loads(payload[_META.size:end].decode('utf-8')), payload[end:]
+
+
+def encode_heartbeat(heartbeat: Dict[str, Any]) -> bytes:
+    """
+    heartbeat 的键: seq, ts, daily, continuous, idle, idle_seconds, app。
+    整数按 32 位无符号截断，程序名按 UTF-8 截断到 255 字节。
+    """
+    app = heartbeat.get('app', '').encode('utf-8')[:255].decode('utf-8', 'ignore').encode('utf-8')
+    flags = HEARTBEAT_IDLE if heartbeat.get('idle') else 0
+    return _HEARTBEAT.pack(HEARTBEAT_VERSION, flags,
+                           int(heartbeat.get('seq', 0)) & _U32, int(heartbeat.get('ts', 0)) & _U32,
+                           min(int(heartbeat.get('daily', 0)), _U32), min(int(heartbeat.get('continuous', 0)), _U32),
+                           min(int(heartbeat.get('idle_seconds', 0)), _U32), len(app)) + app
+
+
+def decode_heartbeat(payload: bytes) -> Dict[str, Any]:
+    if len(payload) < _HEARTBEAT.size:
+        raise ProtocolError("truncated heartbeat record")
+    version, flags, seq, ts, daily, continuous, idle_seconds, app_len = _HEARTBEAT.unpack_from(payload)
+    if version != HEARTBEAT_VERSION:
+        raise ProtocolError(f"unsupported heartbeat version {version}")
+    end = _HEARTBEAT.size + app_len
+    if len(payload) < end:
+        raise ProtocolError("truncated heartbeat app name")
+    # end 之后的字节留给同一版本内追加的字段，旧的 collector 忽略它们
+    return {'seq': seq, 'ts': ts, 'daily': daily, 'continuous': continuous,
+            'idle': bool(flags & HEARTBEAT_IDLE), 'idle_seconds': idle_seconds,
+            'app': payload[_HEARTBEAT.size:end].decode('utf-8', 'replace')}
+
+
+def encode_batch(agent_id: str, records: List[Record]) -> bytes:
+    agent = agent_id.encode('utf-8')[:255]
+    if len(records) > 0xFFFF:
+        raise ProtocolError("too many records in one batch")
+    parts = [_HEADER.pack(MAGIC, VERSION, len(agent)), agent, _COUNT.pack(len(records))]
+    for record in records:
+        parts.append(_RECORD.pack(record.type, len(record.payload)))
+        parts.append(record.payload)
+    return b''.join(parts)
+
+
+def decode_batch(data: bytes) -> Tuple[str, List[Record]]:
+    if len(data) < _HEADER.size:
+        raise ProtocolError("truncated batch header")
+    magic, version, agent_len = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ProtocolError("bad magic")
+    if version != VERSION:
+        raise ProtocolError(f"unsupported batch version {version}")
+    offset = _HEADER.size
+    agent_id = data[offset:offset + agent_len].decode('utf-8')
+    offset += agent_len
+    if len(data) < offset + _COUNT.size:
+        raise ProtocolError("truncated record count")
+    (count,) = _COUNT.unpack_from(data, offset)
+    offset += _COUNT.size
+    records = []
+    for _ in range(count):
+        if len(data) < offset + _RECORD.size:
+            raise ProtocolError("truncated record header")
+        record_type, length = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        if len(data) < offset + length:
+            raise ProtocolError("truncated record payload")
+        records.append(Record(record_type, data[offset:offset + length]))
+        offset += length
+    return agent_id, records
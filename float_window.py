@@ -1,10 +1,14 @@
 import tkinter as tk
 from tkinter import font
-import threading
 import logging
 import time
 from typing import Optional
 from usage_tracker import UsageTracker
+from calendar_rules import ScheduleCalendar
+from quota import QuotaEngine
+
+# 剩余可用时间少于这么多分钟时，在使用时间后面显示
+REMAINING_DISPLAY_MINUTES = 60
 
 
 class FloatWindow:
@@ -14,14 +18,20 @@ class FloatWindow:
     time_label: Optional[tk.Label]
     running: bool
     master_root: tk.Tk
+    calendar: Optional[ScheduleCalendar]
+    quota: Optional[QuotaEngine]
 
     # 为拖动功能添加实例变量类型提示
     _drag_x: int
     _drag_y: int
 
-    def __init__(self, master_root: tk.Tk, usage_tracker: UsageTracker) -> None:
+    def __init__(self, master_root: tk.Tk, usage_tracker: UsageTracker,
+                 calendar: Optional[ScheduleCalendar] = None, quota: Optional[QuotaEngine] = None) -> None:
         self.logger = logging.getLogger("FloatWindow")
         self.usage_tracker = usage_tracker
+        # 可选：允许时段和每日额度，快用完时显示剩余分钟数
+        self.calendar = calendar
+        self.quota = quota
         self.root = None
         self.time_label = None
         self.running = False
@@ -50,7 +60,7 @@ class FloatWindow:
         # 创建时间标签
         self.time_label = tk.Label(
             self.root,
-            text=f"今日使用: {self.usage_tracker.format_time(self.usage_tracker.get_usage_time())}",
+            text=self.display_text(),
             font=display_font,
             bg="#333333",
             fg="white",
@@ -92,7 +102,7 @@ class FloatWindow:
             # Ensure window_width is calculated or fetched if dynamic
             # For instance, self.root.update_idletasks(); window_width = self.root.winfo_width();
             x_position = (screen_width - window_width) // 2
-            self.root.geometry(f"{window_width}x50+{x_position}+0") # Assuming height 50
+            self.root.geometry(f"+{x_position}+0") # 高度随是否显示剩余时间变化
 
             self.update_time()  # 首次调用更新时间
             self.logger.info("Float window Toplevel created.")
@@ -100,13 +110,34 @@ class FloatWindow:
             self.logger.error("Root window was not created, cannot complete setup.")
 
 
+    def remaining_minutes(self) -> Optional[int]:
+        """允许时段结束和额度用完中较早的一个还剩多少分钟；都没有限制时返回 None"""
+        candidates = []
+        if self.calendar:
+            now = self.calendar.clock.now()
+            allowed_until = self.calendar.allowed_until(now)
+            if allowed_until is not None:
+                candidates.append((allowed_until - now).total_seconds())
+        if self.quota:
+            remaining = self.quota.remaining()
+            if remaining is not None:
+                candidates.append(remaining)
+        return int(min(candidates) // 60) if candidates else None
+
+    def display_text(self) -> str:
+        text = f"今日使用: {self.usage_tracker.format_time(self.usage_tracker.get_usage_time())}"
+        remaining = self.remaining_minutes()
+        if remaining is not None and remaining < REMAINING_DISPLAY_MINUTES:
+            text += f"\n还可使用 {remaining} 分钟"
+        return text
+
     def update_time(self) -> None:
         """更新时间显示"""
         if self.time_label and self.running and self.root and self.root.winfo_exists():
-            current_usage_seconds = self.usage_tracker.get_usage_time()
-            current_time_formatted = self.usage_tracker.format_time(current_usage_seconds)
-            self.time_label.config(text=f"今日使用: {current_time_formatted}")
-            self.logger.debug(f"Updated float window time: {current_time_formatted}")
+            text = self.display_text()
+            self.time_label.config(text=text)
+            if self.logger.isEnabledFor(logging.DEBUG):  # 每秒刷新，避免无谓的日志格式化
+                self.logger.debug("Updated float window time: %s", text)
             self.root.after(1000, self.update_time)
         elif self.running and (not self.root or not self.root.winfo_exists()):
             self.logger.info("Float window no longer exists or not running, stopping updates.")
@@ -0,0 +1,141 @@
+import datetime
+import gzip
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+from typing import Optional, Set
+
+from config_manager import ConfigManager
+
+LOG_FORMAT = '%(asctime)s - %(threadName)s - %(name)s - %(levelname)s - %(message)s'
+# 存放各模块日志级别的配置段，例如 UsageTracker = DEBUG
+LEVELS_SECTION = 'LogLevels'
+# 各组件使用的 logger 名称；configparser 会把键名转成小写，需要据此还原大小写
+KNOWN_LOGGERS = ('ConfigManager', 'ConfigUI', 'UsageTracker', 'FloatWindow', 'RestReminder',
+                 'ScreenshotSender', 'DingTalkSender', 'LogManager', 'Metrics',
+                 'CollectorSink', 'ActivityProbe',
+                 'SendScheduler', 'ScreenshotArchive',
+                 'Timelapse', 'Capture', 'TelegramCommands', 'Quota',
+                 'Schedule', 'Outbound', 'Connectivity', 'Diagnostics',
+                 'UsageApi', 'DailyReport', 'UrlCache', 'Profiles')
+
+
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    按大小和日期轮转的日志文件，旧日志压缩为 .gz。
+    轮转和压缩都在 QueueListener 线程中执行，不会阻塞业务线程。
+    """
+
+    def __init__(self, filename: str, max_bytes: int, backup_count: int, rotate_daily: bool) -> None:
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.rotate_daily = rotate_daily
+        self._opened_on = datetime.date.today()
+        if os.path.exists(filename):
+            self._opened_on = datetime.date.fromtimestamp(os.path.getmtime(filename))
+        self.namer = lambda name: name + '.gz'
+        self.rotator = self._compress
+
+    @staticmethod
+    def _compress(source: str, dest: str) -> None:
+        with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(source)
+
+    def shouldRollover(self, record: logging.LogRecord) -> int:
+        if self.rotate_daily and datetime.date.today() != self._opened_on:
+            return 1
+        return super().shouldRollover(record)
+
+    def doRollover(self) -> None:
+        super().doRollover()
+        self._opened_on = datetime.date.today()
+
+
+class LogManager:
+    """
+    非阻塞日志：业务线程只把日志记录放进队列，由 QueueListener 线程写文件。
+    在读取配置之前就安装队列，这样启动阶段的日志会先缓存，等监听线程启动后再写入。
+    """
+    logger: logging.Logger
+    queue: "queue.SimpleQueue[logging.LogRecord]"
+    listener: Optional[logging.handlers.QueueListener]
+    config_manager: Optional[ConfigManager]
+
+    def __init__(self) -> None:
+        self.logger = logging.getLogger("LogManager")
+        self.queue = queue.SimpleQueue()
+        self.listener = None
+        self.config_manager = None
+        self._configured_loggers: Set[str] = set()
+
+        root = logging.getLogger()
+        root.handlers[:] = [logging.handlers.QueueHandler(self.queue)]
+        root.setLevel(logging.INFO)
+
+    def start(self, config_manager: ConfigManager) -> None:
+        """根据配置创建文件处理器并启动写日志线程"""
+        self.config_manager = config_manager
+        self._start_listener()
+        self.apply_levels()
+        config_manager.add_listener(self._on_config_changed)
+
+    def _start_listener(self) -> None:
+        assert self.config_manager is not None
+        handler = CompressingRotatingFileHandler(
+            str(self.config_manager.get('logFile')),
+            max_bytes=int(self.config_manager.get('logMaxSizeMB')) * 1024 * 1024,
+            backup_count=int(self.config_manager.get('logBackupCount')),
+            rotate_daily=bool(self.config_manager.get('logRotateDaily')),
+        )
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        self.listener = logging.handlers.QueueListener(self.queue, handler, respect_handler_level=False)
+        self.listener.start()
+
+    def apply_levels(self) -> None:
+        """设置全局日志级别，以及 [LogLevels] 段中按模块名指定的级别"""
+        assert self.config_manager is not None
+        logging.getLogger().setLevel(self._parse_level(self.config_manager.get('logLevel'), logging.INFO))
+
+        # 配置中删掉的模块恢复为继承全局级别
+        for name in self._configured_loggers:
+            logging.getLogger(name).setLevel(logging.NOTSET)
+        self._configured_loggers.clear()
+
+        levels = self.config_manager.get_all_settings().get(LEVELS_SECTION, {})
+        for name, level in levels.items():
+            logger_name = self._resolve_logger_name(name)
+            logging.getLogger(logger_name).setLevel(self._parse_level(level, logging.NOTSET))
+            self._configured_loggers.add(logger_name)
+
+    @staticmethod
+    def _resolve_logger_name(name: str) -> str:
+        for existing in KNOWN_LOGGERS + tuple(logging.root.manager.loggerDict):
+            if existing.lower() == name.lower():
+                return existing
+        return name
+
+    def _parse_level(self, value: str, default: int) -> int:
+        level = logging.getLevelName(str(value).strip().upper())
+        if isinstance(level, int):
+            return level
+        self.logger.error(f"Unknown log level '{value}', using {logging.getLevelName(default)}")
+        return default
+
+    def _on_config_changed(self, changed: Set[str]) -> None:
+        if changed & {'logFile', 'logMaxSizeMB', 'logBackupCount', 'logRotateDaily'}:
+            self.stop()
+            self._start_listener()
+            self.logger.info("Log file handler reconfigured.")
+        if 'logLevel' in changed or any(key.startswith(LEVELS_SECTION + '.') for key in changed):
+            self.apply_levels()
+            self.logger.info("Log levels reloaded.")
+
+    def stop(self) -> None:
+        """停止写日志线程，队列中剩余的记录会先写完"""
+        if self.listener:
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.close()
+            self.listener = None
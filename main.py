@@ -1,5 +1,4 @@
 import tkinter as tk
-import time
 import threading
 import logging
 from screenshot_sender import ScreenshotSender
@@ -9,14 +8,24 @@ from rest_reminder import RestReminder
 from config_manager import ConfigManager # 确保导入 ConfigManager
 from config_ui import ConfigUI # 确保导入 ConfigUI
 from dingtalk_sender import DingTalkSender # 导入钉钉发送器
+from logging_setup import LogManager
+from metrics import MetricsServer
+from collector_sink import CollectorSink
+from screenshot_archive import ScreenshotArchive
+from timelapse import TimelapseRecorder
+from memory_budget import configure_image_arena, set_tracing
+from telegram_commands import minutes_arg
+from quota import QuotaEngine
+from calendar_rules import ScheduleCalendar
+from outbound_queue import OUTBOX, STATUS, queue_settings
+from connectivity import ConnectivityMonitor
+from usage_api import UsageApi
+from daily_report import DailyReport, ReportActions
+from profiles import ProfileSwitcher
 
 # 配置日志
-logging.basicConfig(
-    level=logging.DEBUG, # 调试时改为 DEBUG，生产环境建议 INFO
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    filename='screenshot_bot.log',
-    filemode='a'
-)
+# 日志先进入内存队列，读取配置后由后台线程按配置写入可轮转的日志文件
+log_manager = LogManager()
 
 logging.info("Starting Screenshot Bot application.")
 
@@ -27,7 +36,13 @@ root.title("Kid PC Monitor (Hidden)") # 避免无标题窗口警告
 
 # 初始化配置管理器
 config_manager = ConfigManager()
+log_manager.start(config_manager) # 日志级别和轮转参数来自配置
 logging.info("Loaded configuration from config.ini")
+# 按修改时间热加载 config.ini，各组件通过监听回调应用新设置
+config_manager.start_watching()
+# 按登录的系统用户切换配置和使用统计（enableProfiles），先确定当前用户，各组件按该用户的设置初始化
+profiles = ProfileSwitcher(config_manager)
+profiles.check()
 
 # 初始化组件，并传递必要的实例
 # 所有组件都应接收 main_root 和 config_manager
@@ -36,61 +51,184 @@ tracker = UsageTracker(config_manager) # 传递 ConfigManager
 today_usage_time_seconds = tracker.get_usage_time()
 logging.info(f"Loaded today's usage time: {tracker.format_time(today_usage_time_seconds)}")
 
-sender = ScreenshotSender(config_manager, usage_tracker=tracker) # 传递 ConfigManager
-dingtalk_sender = DingTalkSender(config_manager, usage_tracker=tracker) # 钉钉发送器
-float_window = FloatWindow(root, tracker) # 传递主根窗口
-reminder = RestReminder(root, config_manager, usage_tracker=tracker) # 传递主根窗口和 ConfigManager
+
+def configure_memory():
+    """截图图像内存的复用上限和 tracemalloc 开关"""
+    configure_image_arena(config_manager.get('imageArenaMB'))
+    set_tracing(config_manager.get('traceMemory'))
+
+
+configure_memory()
+# 本机共用的出站队列：告警 > 命令回复 > 例行截图，过期的截图直接丢弃
+OUTBOX.configure(*queue_settings(config_manager))
+# 所有发送器共用的网络连通性：离线时暂停截图和上传，出站队列中的消息等恢复联网后再发
+connectivity = ConnectivityMonitor(config_manager)
+OUTBOX.connectivity = connectivity
+
+# 允许使用的时段（[Schedule] 段），提醒、额度和浮窗共用同一份编译结果
+calendar = ScheduleCalendar(config_manager)
+# 按星期几的每日额度（dailyQuotaMinutes），由 tracker 每秒的使用增量驱动
+quota = QuotaEngine(config_manager, tracker, calendar=calendar)
+
+# 局域网只读接口（usageApiPort 不为 0 时开启），响应都来自预先生成的快照
+usage_api = UsageApi(config_manager, tracker, quota=quota, calendar=calendar)
+# 每日使用报告图：dailyReportTime 定时发送，/report 随时获取；提醒事件经 ReportActions 记入报告
+# 等到消息真正发出（或被丢弃）才返回结果，定时报告发送失败时会重试
+report = DailyReport(config_manager, tracker, deliver=lambda png, caption: OUTBOX.send(
+    STATUS, lambda: sender.send_image(png, 'report.png', caption), 'daily report', key='telegram-report'))
+archive = ScreenshotArchive(config_manager) # 本地截图存档（enableArchive 开启时生效）
+# 每日延时视频（enableTimelapse 开启时生效），完成后由 Telegram 发送器作为一个文件发送
+timelapse = TimelapseRecorder(config_manager, deliver=lambda path, caption: sender.send_document(path, caption))
+sender = ScreenshotSender(config_manager, usage_tracker=tracker, archive=archive, timelapse=timelapse,
+                          quota=quota, connectivity=connectivity,
+                          on_frame=usage_api.publish_frame) # 传递 ConfigManager
+dingtalk_sender = DingTalkSender(config_manager, usage_tracker=tracker, archive=archive,
+                                 connectivity=connectivity, on_frame=usage_api.publish_frame) # 钉钉发送器
+collector_sink = CollectorSink(config_manager, usage_tracker=tracker, connectivity=connectivity) # 多电脑汇聚服务
+float_window = FloatWindow(root, tracker, calendar=calendar, quota=quota) # 传递主根窗口
+reminder = RestReminder(root, config_manager, usage_tracker=tracker, quota=quota,
+                        calendar=calendar, outbox=OUTBOX,
+                        actions=ReportActions(report)) # 传递主根窗口和 ConfigManager
+quota.on_warning = reminder.quota_warning
+quota.on_exhausted = reminder.quota_exhausted
+
+
+def extend_today(args):
+    """Telegram 远程命令 /extend：顺延今天的提醒和关机时间，并增加今天的额度"""
+    minutes = minutes_arg(args)
+    return '\n'.join(text for text in (reminder.extend(minutes), quota.extend(minutes)) if text)
+
+
+sender.commands.register('extend', extend_today, "延长今天的使用时间 N 分钟")
+sender.commands.register('report', lambda args: None if report.send("使用报告") else "报告发送失败",
+                         "发送今天的使用报告图")
 
 # 初始化配置 UI
 # ConfigUI 实例必须在 main.py 中创建
 config_ui = ConfigUI(root, config_manager) # 传递主根窗口和 ConfigManager
+# 截图/发送各阶段的耗时指标：本机 HTTP 接口 + 定期日志摘要
+metrics_server = None
+
+
+def start_metrics():
+    """按 metricsPort / metricsSummaryMinutes 重新启动指标接口和摘要线程"""
+    global metrics_server
+    if metrics_server:
+        metrics_server.stop()
+    metrics_server = MetricsServer(config_manager.get('metricsPort'), config_manager.get('metricsSummaryMinutes'))
+    metrics_server.start()
+
+
+start_metrics()
+usage_api.start()
+
 logging.info("All UI components and managers initialized.")
 logging.info("Tray icon created (by ConfigUI).") # ConfigUI 内部会创建并启动托盘图标线程
 
+threads = {}
+
+
+def start_component(name, target, enabled=lambda: True):
+    """
+    启动组件线程；已在运行则跳过。
+    刚停止的旧线程还没退出时（例如发送器正在等待下一次截图），在后台等它结束，开关仍为 enabled() 时再启动
+    """
+    thread = threads.get(name)
+    if thread and thread.is_alive():
+        if getattr(target.__self__, 'running', True):
+            return
+
+        def restart_after_exit():
+            thread.join()
+            if enabled():
+                start_component(name, target, enabled)
+
+        threading.Thread(target=restart_after_exit, name=f"{name} restart", daemon=True).start()
+        return
+    threads[name] = threading.Thread(target=target, name=name, daemon=True)  # 性能分析报告按线程名归类
+    threads[name].start()
+    logging.info(f"{name} thread started.")
+
+
+def on_config_changed(changed):
+    """配置热加载后按开关启停可选组件，无需重启程序"""
+    if 'showFloatWindow' in changed:
+        if config_manager.get('showFloatWindow'):
+            start_component("FloatWindow", float_window.run, lambda: config_manager.get('showFloatWindow'))
+        else:
+            root.after(0, float_window.stop)
+    if 'enableRestReminder' in changed:
+        if config_manager.get('enableRestReminder'):
+            start_component("RestReminder", reminder.run, lambda: config_manager.get('enableRestReminder'))
+        else:
+            reminder.stop()
+    if 'enableDingTalk' in changed:
+        if config_manager.get('enableDingTalk'):
+            start_component("DingTalk sender", dingtalk_sender.run, lambda: config_manager.get('enableDingTalk'))
+        else:
+            dingtalk_sender.stop()
+    if 'enableTelegram' in changed:
+        if config_manager.get('enableTelegram'):
+            start_component("Screenshot sender", sender.run, lambda: config_manager.get('enableTelegram'))
+        else:
+            sender.stop()
+    if 'collectorUrl' in changed:
+        if config_manager.get('collectorUrl'):
+            start_component("Collector sink", collector_sink.run, lambda: config_manager.get('collectorUrl'))
+        else:
+            collector_sink.stop()
+    if changed & {'metricsPort', 'metricsSummaryMinutes'}:
+        start_metrics()
+    if changed & {'imageArenaMB', 'traceMemory'}:
+        configure_memory()
+    if changed & {'alertDeadlineSeconds', 'statusDeadlineSeconds', 'frameDeadlineSeconds', 'outboundMaxQueued'}:
+        OUTBOX.configure(*queue_settings(config_manager))
+
+
+config_manager.add_listener(on_config_changed)
+
 try:
+    # 补全并发送前几天未发送的延时视频
+    timelapse.finish_pending()
+
     # 启动时间统计线程
-    tracker_thread = threading.Thread(target=tracker.start_tracking, daemon=True)
-    tracker_thread.start()
-    logging.info("UsageTracker thread started.")
+    start_component("UsageTracker", tracker.start_tracking)
+
+    # 启动网络连通性监视线程
+    start_component("Connectivity", connectivity.run)
+
+    # 启动登录用户检查线程
+    start_component("Profiles", profiles.run)
 
     # 启动浮窗线程
-    if config_manager.get_setting('Settings', 'showFloatWindow', type=bool, fallback=True):
-        window_thread = threading.Thread(target=float_window.run, daemon=True)
-        window_thread.start()
-        logging.info("FloatWindow thread started.")
+    if config_manager.get('showFloatWindow'):
+        start_component("FloatWindow", float_window.run)
     else:
         logging.info("Float window is disabled in config.")
 
     # 启动休息提醒线程
-    if config_manager.get_setting('Settings', 'enableRestReminder', type=bool, fallback=True):
-        reminder_thread = threading.Thread(target=reminder.run, daemon=True)
-        reminder_thread.start()
-        logging.info("RestReminder thread started.")
+    if config_manager.get('enableRestReminder'):
+        start_component("RestReminder", reminder.run)
     else:
         logging.info("Rest reminder is disabled in config.")
 
     # 启动截图发送线程
     # sender.run() 方法现在包含了循环逻辑
-    screenshot_sender_thread = threading.Thread(target=sender.run, daemon=True)
-    screenshot_sender_thread.start()
-    logging.info("Screenshot sender thread started.")
+    if config_manager.get('enableTelegram'):
+        start_component("Screenshot sender", sender.run)
+    else:
+        logging.info("Telegram sender is disabled in config.")
 
     # 启动钉钉发送线程
-    # 尝试多种可能的键名来读取钉钉启用状态
-    dingtalk_enabled = False
-    for key in ['enabledingtalk', 'enableDingTalk', 'enable_dingtalk']:
-        setting = config_manager.get_setting('Settings', key, type=bool, fallback=None)
-        if setting is not None:
-            dingtalk_enabled = setting
-            break
-    
-    if dingtalk_enabled:
-        dingtalk_sender_thread = threading.Thread(target=dingtalk_sender.run, daemon=True)
-        dingtalk_sender_thread.start()
-        logging.info("DingTalk sender thread started.")
+    if config_manager.get('enableDingTalk'):
+        start_component("DingTalk sender", dingtalk_sender.run)
     else:
         logging.info("DingTalk sender is disabled in config.")
 
+    # 推送到多电脑汇聚服务
+    if config_manager.get('collectorUrl'):
+        start_component("Collector sink", collector_sink.run)
+
     # 运行 Tkinter 主循环
     # 这一行必须是主线程的最后一步，它会保持程序运行，处理所有UI事件
     logging.info("Starting Tkinter main loop.")
@@ -103,11 +241,22 @@ except Exception as e:
 finally:
     logging.info("Application shutting down.")
     # 在这里添加清理代码，确保所有线程停止和数据保存
+    config_manager.stop_watching()
+    profiles.stop()
     tracker.stop_tracking() # 确保tracker停止并保存数据
     float_window.stop() # 确保浮窗线程停止
     dingtalk_sender.stop() # 确保钉钉发送线程停止
+    collector_sink.stop()
+    connectivity.stop()
+    OUTBOX.stop()
+    archive.close()
+    timelapse.close()
+    metrics_server.stop()
+    usage_api.stop()
     # reminder 线程和 sender 线程的停止已在其 run() 方法的 finally 块中处理，
     # 或者通过 self.running 标志位在外部控制。
     # 对于守护线程，当主程序退出时它们会自动终止，但显式停止会更好。
     # 鉴于 mainloop 退出后程序可能很快终止，这些 stop() 调用有时可能无法完全执行。
-    # 但在 try-finally 块中放置，是为了尽可能地进行清理。
\ No newline at end of file
+    # 但在 try-finally 块中放置，是为了尽可能地进行清理。
+    logging.info("Flushing log queue.")
+    log_manager.stop() # 写完队列中剩余的日志
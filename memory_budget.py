@@ -0,0 +1,170 @@
+"""
+截图流水线的内存控制：
+
+- Pillow 图像内存按固定大小的块分配，并缓存释放的块供下一帧复用（imageArenaMB），
+  避免每个周期向系统申请和归还上百 MB 的大块内存造成碎片；
+- 截图超过 captureMaxPixels 时按整数倍缩小，缩小发生在完整复制之前（见 CaptureBackend.grab_scaled）；
+- MultipartStream 以 64KB 为单位从文件流式上传，不在内存中拼出完整的请求体；
+- CycleMemory 记录每个周期的内存：Python 堆峰值（traceMemory 开启时的 tracemalloc）、
+  周期结束时的 RSS，以及本周期是否刷新了进程的 RSS 峰值。
+"""
+import logging
+import os
+import sys
+import tracemalloc
+import uuid
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from PIL import Image
+
+from metrics import REGISTRY
+
+CHUNK_SIZE = 64 * 1024
+BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def configure_image_arena(arena_mb: int) -> None:
+    """Pillow 按 BLOCK_SIZE 分块分配图像，最多缓存 arena_mb 的空闲块；0 表示不缓存"""
+    core = Image.core
+    core.set_use_block_allocator(1)
+    core.set_block_size(BLOCK_SIZE)
+    core.set_blocks_max(max(0, arena_mb) * 1024 * 1024 // BLOCK_SIZE)
+
+
+def reduce_factor(width: int, height: int, max_pixels: int) -> int:
+    """把 width x height 缩小到不超过 max_pixels 所需的最小整数倍数"""
+    factor = 1
+    if max_pixels > 0:
+        while (width // factor) * (height // factor) > max_pixels:
+            factor += 1
+    return factor
+
+
+def fit_to_budget(image: Image.Image, max_pixels: int) -> Image.Image:
+    factor = reduce_factor(image.width, image.height, max_pixels)
+    return image.reduce(factor) if factor > 1 else image
+
+
+def _memory_linux() -> Tuple[int, int]:
+    rss = peak = 0
+    with open('/proc/self/status', 'rb') as f:
+        for line in f:
+            if line.startswith(b'VmRSS:'):
+                rss = int(line.split()[1]) * 1024
+            elif line.startswith(b'VmHWM:'):
+                peak = int(line.split()[1]) * 1024
+    return rss, peak
+
+
+def _memory_windows() -> Tuple[int, int]:
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                    ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                    ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                    ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters),
+                                             counters.cb)
+    return counters.WorkingSetSize, counters.PeakWorkingSetSize
+
+
+def process_memory() -> Tuple[int, int]:
+    """(当前 RSS, 进程启动以来的 RSS 峰值)，单位字节；无法获取时返回 (0, 0)"""
+    try:
+        if sys.platform == 'win32':
+            return _memory_windows()
+        if sys.platform.startswith('linux'):
+            return _memory_linux()
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # macOS 上单位是字节
+        return peak, peak
+    except (OSError, AttributeError, ValueError, ImportError):
+        return 0, 0
+
+
+def set_tracing(enabled: bool) -> None:
+    """开启/关闭 tracemalloc；开启后 Python 分配会变慢，只用于排查"""
+    if enabled and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not enabled and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+class CycleMemory:
+    """
+    with CycleMemory('telegram') as memory: ...
+    退出时把内存数据记入指标（stage = py_peak / rss / rss_peak_growth），并保存在 memory.result 中。
+    """
+    logger = logging.getLogger("Metrics")
+
+    def __init__(self, sender: str) -> None:
+        self.sender = sender
+        self.result: Dict[str, int] = {}
+
+    def __enter__(self) -> "CycleMemory":
+        self._peak_before = process_memory()[1]
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        rss, peak = process_memory()
+        self.result = {'rss': rss, 'rss_peak_growth': max(0, peak - self._peak_before)}
+        if tracemalloc.is_tracing():
+            self.result['py_peak'] = tracemalloc.get_traced_memory()[1]
+        for stage, value in self.result.items():
+            REGISTRY.observe_bytes(value, sender=self.sender, stage=stage)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("%s cycle memory: %s", self.sender,
+                              ', '.join(f"{k}={v / 1048576:.1f}MB" for k, v in self.result.items()))
+
+
+class MultipartStream:
+    """
+    流式 multipart/form-data 请求体。作为 requests 的 data 参数传入：
+    有 __len__，requests 会设置 Content-Length 而不是分块传输；每次迭代都从头读取文件，可用于重试。
+    """
+
+    def __init__(self, fields: Dict[str, str], file_field: str, filename: str,
+                 path: Optional[str] = None, content: Optional[bytes] = None,
+                 content_type: str = 'application/octet-stream') -> None:
+        self.boundary = uuid.uuid4().hex
+        self.path = path
+        self.content = content
+        parts = []
+        for name, value in fields.items():
+            parts.append(f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+                         .encode('utf-8') + str(value).encode('utf-8') + b'\r\n')
+        parts.append(f'--{self.boundary}\r\nContent-Disposition: form-data; name="{file_field}"; '
+                     f'filename="{filename}"\r\nContent-Type: {content_type}\r\n\r\n'.encode('utf-8'))
+        self._head = b''.join(parts)
+        self._tail = f'\r\n--{self.boundary}--\r\n'.encode('ascii')
+        self._size = os.path.getsize(path) if path is not None else len(content or b'')
+
+    @property
+    def content_type(self) -> str:
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self) -> int:
+        return len(self._head) + self._size + len(self._tail)
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield self._head
+        if self.path is not None:
+            with open(self.path, 'rb') as f:
+                while True:
+                    chunk = f.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    yield chunk
+        else:
+            view = memoryview(self.content or b'')
+            for start in range(0, len(view), CHUNK_SIZE):
+                yield bytes(view[start:start + CHUNK_SIZE])
+        yield self._tail
@@ -0,0 +1,260 @@
+import bisect
+import functools
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+# 耗时直方图的桶（秒），覆盖从截图的几十毫秒到上传超时的 60 秒
+DURATION_BUCKETS: Tuple[float, ...] = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 数据量直方图的桶（字节），从 16KB 到 64MB
+BYTES_BUCKETS: Tuple[float, ...] = tuple(float(16 * 1024 * 4 ** i) for i in range(8))
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """固定桶的直方图，记录次数、总和以及各桶计数"""
+
+    def __init__(self, buckets: Tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个是 +Inf
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """按桶上界估算分位数"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for upper, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= target:
+                return upper
+        return self.max
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+            'buckets': {str(b): n for b, n in zip(self.buckets, self.counts)},
+        }
+
+
+class StageRecord:
+    """一次阶段计时的结果；调用方可以填写字节数、标记失败或记录重试"""
+
+    def __init__(self) -> None:
+        self.bytes: Optional[int] = None
+        self.ok = True
+        self.retries = 0
+
+    def fail(self) -> None:
+        self.ok = False
+
+
+class MetricsRegistry:
+    """
+    截图/发送流水线的指标：每个 (sender, stage) 的耗时和字节直方图、成功/失败次数和重试次数。
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.durations: Dict[LabelKey, Histogram] = {}
+        self.sizes: Dict[LabelKey, Histogram] = {}
+        self.counters: Dict[Tuple[str, LabelKey], float] = {}
+
+    @staticmethod
+    def _labels(**labels: str) -> LabelKey:
+        return tuple(sorted(labels.items()))
+
+    def observe_duration(self, seconds: float, **labels: str) -> None:
+        key = self._labels(**labels)
+        with self._lock:
+            self.durations.setdefault(key, Histogram(DURATION_BUCKETS)).observe(seconds)
+
+    def observe_bytes(self, size: int, **labels: str) -> None:
+        key = self._labels(**labels)
+        with self._lock:
+            self.sizes.setdefault(key, Histogram(BYTES_BUCKETS)).observe(float(size))
+
+    def inc(self, name: str, amount: float = 1, **labels: str) -> None:
+        key = (name, self._labels(**labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    @contextmanager
+    def stage(self, sender: str, stage: str) -> Iterator[StageRecord]:
+        """
+        记录一个阶段的耗时、字节数、结果和重试次数。
+        阶段内抛出异常或调用 record.fail() 都记为失败。
+        """
+        record = StageRecord()
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException:
+            record.ok = False
+            raise
+        finally:
+            self.observe_duration(time.perf_counter() - start, sender=sender, stage=stage)
+            if record.bytes is not None:
+                self.observe_bytes(record.bytes, sender=sender, stage=stage)
+            self.inc('stage_total', sender=sender, stage=stage, result='success' if record.ok else 'failure')
+            if record.retries:
+                self.inc('retries_total', record.retries, sender=sender, stage=stage)
+
+    def timed(self, sender: str, stage: str) -> Callable[[F], F]:
+        """
+        装饰器版本的 stage()：返回值为假（False/None）或抛出异常时记为失败。
+        """
+        def decorator(func: F) -> F:
+            @functools.wraps(func)
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                with self.stage(sender, stage) as record:
+                    result = func(*args, **kwargs)
+                    if not result:
+                        record.fail()
+                    return result
+            return wrapper  # type: ignore[return-value]
+        return decorator
+
+    def to_json(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                'durations_seconds': [dict(labels=dict(k), **h.to_dict()) for k, h in self.durations.items()],
+                'bytes': [dict(labels=dict(k), **h.to_dict()) for k, h in self.sizes.items()],
+                'counters': [{'name': name, 'labels': dict(k), 'value': v} for (name, k), v in self.counters.items()],
+            }
+
+    def to_prometheus(self) -> str:
+        """Prometheus 文本格式"""
+        lines: List[str] = []
+
+        def fmt(labels: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+            items = labels + extra
+            return '{' + ','.join(f'{k}="{v}"' for k, v in items) + '}' if items else ''
+
+        with self._lock:
+            for metric, hists in (('kidpc_stage_duration_seconds', self.durations), ('kidpc_stage_bytes', self.sizes)):
+                lines.append(f'# TYPE {metric} histogram')
+                for labels, h in hists.items():
+                    cumulative = 0
+                    for upper, n in zip(h.buckets, h.counts):
+                        cumulative += n
+                        lines.append(f'{metric}_bucket{fmt(labels, (("le", repr(upper)),))} {cumulative}')
+                    lines.append(f'{metric}_bucket{fmt(labels, (("le", "+Inf"),))} {h.count}')
+                    lines.append(f'{metric}_sum{fmt(labels)} {h.total}')
+                    lines.append(f'{metric}_count{fmt(labels)} {h.count}')
+            names = sorted({name for name, _ in self.counters})
+            for name in names:
+                lines.append(f'# TYPE kidpc_{name} counter')
+                for (n, labels), value in self.counters.items():
+                    if n == name:
+                        lines.append(f'kidpc_{name}{fmt(labels)} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> str:
+        """适合写进日志的一行一阶段摘要"""
+        with self._lock:
+            parts = []
+            for labels, h in sorted(self.durations.items()):
+                label = '/'.join(v for _, v in labels)
+                ok = self.counters.get(('stage_total', self._labels(result='success', **dict(labels))), 0)
+                failed = self.counters.get(('stage_total', self._labels(result='failure', **dict(labels))), 0)
+                retries = self.counters.get(('retries_total', labels), 0)
+                size = self.sizes.get(labels)
+                avg_bytes = f", avg {size.total / size.count / 1024:.0f}KB" if size and size.count else ""
+                parts.append(f"{label}: n={h.count} ok={ok:g} fail={failed:g} retries={retries:g} "
+                             f"avg={h.total / h.count:.3f}s p99<={h.quantile(0.99)}s max={h.max:.3f}s{avg_bytes}")
+        return '\n'.join(parts)
+
+
+# 全局指标注册表，各发送器共用
+REGISTRY = MetricsRegistry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry: MetricsRegistry = REGISTRY
+
+    def do_GET(self) -> None:
+        if self.path in ('/metrics', '/'):
+            body = self.registry.to_prometheus().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        elif self.path == '/metrics.json':
+            body = json.dumps(self.registry.to_json(), ensure_ascii=False).encode('utf-8')
+            content_type = 'application/json; charset=utf-8'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: object) -> None:
+        # 不把每次抓取写进日志
+        pass
+
+
+class MetricsServer:
+    """
+    本机指标接口：/metrics 为 Prometheus 文本，/metrics.json 为 JSON。
+    另有一个后台线程定期把摘要写进日志。
+    """
+    logger: logging.Logger
+    port: int
+    summary_interval: float
+    registry: MetricsRegistry
+
+    def __init__(self, port: int, summary_minutes: int = 0, registry: MetricsRegistry = REGISTRY) -> None:
+        self.logger = logging.getLogger("Metrics")
+        self.port = port
+        self.summary_interval = summary_minutes * 60
+        self.registry = registry
+        self.httpd: Optional[ThreadingHTTPServer] = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        if self.port:
+            handler = type('MetricsHandler', (_MetricsHandler,), {'registry': self.registry})
+            try:
+                self.httpd = ThreadingHTTPServer(('127.0.0.1', self.port), handler)
+            except OSError as e:
+                self.logger.error(f"Cannot start metrics endpoint on 127.0.0.1:{self.port}: {e}")
+            else:
+                self.httpd.daemon_threads = True
+                threading.Thread(target=self.httpd.serve_forever, name="metrics-http", daemon=True).start()
+                self.logger.info(f"Metrics endpoint listening on http://127.0.0.1:{self.port}/metrics")
+        if self.summary_interval > 0:
+            threading.Thread(target=self._report_loop, name="metrics-summary", daemon=True).start()
+
+    def _report_loop(self) -> None:
+        while not self._stop.wait(self.summary_interval):
+            summary = self.registry.summary()
+            if summary:
+                self.logger.info("Pipeline metrics summary:\n%s", summary)
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
@@ -0,0 +1,227 @@
+"""
+按显示器分别截图：各显示器并行截取、缩小和编码，并分别做变化检测，
+只有画面变化的显示器才需要发送（作为同一个相册中的多张图片）。
+
+显示器列表在 Windows 上来自 EnumDisplayMonitors，在 Linux 上来自 XRandR；
+都不可用时把整个桌面当作一个显示器。
+"""
+import ctypes
+import ctypes.util
+import io
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from PIL import Image, ImageChops, ImageStat
+
+from capture_backends import BBox, CaptureBackend, XShmCapture, create_capture
+from config_manager import ConfigManager
+from metrics import REGISTRY
+
+# 变化检测用的缩略图大小：足够发现窗口切换和滚动，又能忽略时钟、光标等小变化
+THUMBNAIL_SIZE = (64, 36)
+
+
+class Monitor(NamedTuple):
+    index: int  # 从 1 开始，与系统显示设置中的编号顺序一致
+    bbox: BBox  # 在虚拟桌面中的坐标
+    primary: bool
+
+
+class MonitorFrame(NamedTuple):
+    monitor: Monitor
+    image: Image.Image  # 缩小后的图像
+    changed: bool
+    jpeg: Optional[bytes]  # 只有变化的显示器才编码
+
+
+def _windows_monitors() -> List[Monitor]:
+    from ctypes import wintypes
+    user32 = ctypes.windll.user32
+    rects: List[Tuple[BBox, bool]] = []
+
+    class MONITORINFO(ctypes.Structure):
+        _fields_ = [('cbSize', wintypes.DWORD), ('rcMonitor', wintypes.RECT), ('rcWork', wintypes.RECT),
+                    ('dwFlags', wintypes.DWORD)]
+
+    def callback(hmonitor, hdc, rect, data):
+        info = MONITORINFO()
+        info.cbSize = ctypes.sizeof(info)
+        user32.GetMonitorInfoW(hmonitor, ctypes.byref(info))
+        r = info.rcMonitor
+        rects.append(((r.left, r.top, r.right, r.bottom), bool(info.dwFlags & 1)))
+        return 1
+
+    proc = ctypes.WINFUNCTYPE(ctypes.c_int, wintypes.HMONITOR, wintypes.HDC, ctypes.POINTER(wintypes.RECT),
+                              wintypes.LPARAM)(callback)
+    user32.EnumDisplayMonitors(None, None, proc, 0)
+    return [Monitor(i + 1, bbox, primary) for i, (bbox, primary) in enumerate(rects)]
+
+
+class _XRRMonitorInfo(ctypes.Structure):
+    _fields_ = [('name', ctypes.c_ulong), ('primary', ctypes.c_int), ('automatic', ctypes.c_int),
+                ('noutput', ctypes.c_int), ('x', ctypes.c_int), ('y', ctypes.c_int),
+                ('width', ctypes.c_int), ('height', ctypes.c_int), ('mwidth', ctypes.c_int),
+                ('mheight', ctypes.c_int), ('outputs', ctypes.c_void_p)]
+
+
+def _xrandr_monitors() -> List[Monitor]:
+    x11_path, xrandr_path = ctypes.util.find_library('X11'), ctypes.util.find_library('Xrandr')
+    if not x11_path or not xrandr_path:
+        raise OSError("libX11 / libXrandr not found")
+    x11, xrandr = ctypes.CDLL(x11_path), ctypes.CDLL(xrandr_path)
+    vp = ctypes.c_void_p
+    x11.XOpenDisplay.restype = vp
+    x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+    x11.XDefaultRootWindow.restype = ctypes.c_ulong
+    x11.XDefaultRootWindow.argtypes = [vp]
+    x11.XCloseDisplay.argtypes = [vp]
+    xrandr.XRRGetMonitors.restype = ctypes.POINTER(_XRRMonitorInfo)
+    xrandr.XRRGetMonitors.argtypes = [vp, ctypes.c_ulong, ctypes.c_int, ctypes.POINTER(ctypes.c_int)]
+    xrandr.XRRFreeMonitors.argtypes = [ctypes.POINTER(_XRRMonitorInfo)]
+    display = x11.XOpenDisplay(None)
+    if not display:
+        raise OSError("cannot open X display")
+    try:
+        count = ctypes.c_int()
+        infos = xrandr.XRRGetMonitors(display, x11.XDefaultRootWindow(display), 1, ctypes.byref(count))
+        if not infos:
+            raise OSError("XRRGetMonitors failed")
+        try:
+            return [Monitor(i + 1, (m.x, m.y, m.x + m.width, m.y + m.height), bool(m.primary))
+                    for i, m in enumerate(infos[:count.value])]
+        finally:
+            xrandr.XRRFreeMonitors(infos)
+    finally:
+        x11.XCloseDisplay(display)
+
+
+def list_monitors() -> List[Monitor]:
+    """当前的显示器列表；无法枚举时返回空列表"""
+    try:
+        if sys.platform == 'win32':
+            return _windows_monitors()
+        if sys.platform.startswith('linux'):
+            return _xrandr_monitors()
+    except (OSError, AttributeError) as e:
+        logging.getLogger("Capture").warning(f"Cannot enumerate monitors: {e}")
+    return []
+
+
+def parse_selection(text: str) -> Set[int]:
+    """"1,3" → {1, 3}；空字符串表示全部显示器"""
+    return {int(part) for part in text.replace(' ', '').split(',') if part}
+
+
+class MultiMonitorCapture:
+    """
+    每次 capture() 返回每个选中显示器的一帧。
+    xshm 后端为每个显示器建立独立的共享内存截图，真正并行截取；
+    其他后端（如 Windows 上的 ImageGrab，本身只能截整个桌面）截一次全桌面，再按显示器裁剪。
+    裁剪之后的缩小、变化检测和 JPEG 编码都在线程池中并行执行（PIL 在这些操作中释放 GIL）。
+    """
+    logger: logging.Logger
+    config_manager: ConfigManager
+
+    def __init__(self, config_manager: ConfigManager, monitors: Optional[List[Monitor]] = None,
+                 full_capture: Optional[CaptureBackend] = None) -> None:
+        self.logger = logging.getLogger("Capture")
+        self.config_manager = config_manager
+        self._fixed_monitors = monitors
+        self._injected_capture = full_capture
+        self._full_capture: Optional[CaptureBackend] = None
+        self.monitors: List[Monitor] = []
+        self._backends: Dict[int, CaptureBackend] = {}
+        self._thumbnails: Dict[int, Image.Image] = {}
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._layout_key: Optional[Tuple[str, str]] = None
+        self._origin = (0, 0)
+
+    def _setup(self) -> None:
+        backend = str(self.config_manager.get('captureBackend'))
+        selection = parse_selection(str(self.config_manager.get('monitorSelection')))
+        if self._layout_key == (backend, str(selection)):
+            return
+        self.close()
+        monitors = self._fixed_monitors if self._fixed_monitors is not None else list_monitors()
+        # 全桌面截图的左上角对应所有显示器（不只是选中的）的最小坐标
+        self._origin = (min((m.bbox[0] for m in monitors), default=0), min((m.bbox[1] for m in monitors), default=0))
+        if selection:
+            monitors = [m for m in monitors if m.index in selection] or monitors
+        if not monitors:
+            # 无法枚举显示器时把整个桌面当作一个显示器
+            monitors = [Monitor(1, (0, 0, 0, 0), True)]
+        self.monitors = monitors
+        self._full_capture = self._injected_capture
+        if self._full_capture is None and backend in ('auto', 'xshm') and sys.platform.startswith('linux'):
+            try:
+                for m in monitors:
+                    self._backends[m.index] = XShmCapture(m.bbox if m.bbox[2] else None)
+            except (OSError, AttributeError) as e:
+                self.logger.warning(f"Per-monitor shared-memory capture unavailable: {e}")
+                self.close()
+        if not self._backends and self._full_capture is None:
+            self._full_capture = create_capture(backend, all_screens=True)
+        self._pool = ThreadPoolExecutor(max_workers=len(monitors), thread_name_prefix='monitor-capture')
+        self._layout_key = (backend, str(selection))
+        self.logger.info(f"Capturing {len(monitors)} monitor(s): "
+                         + ', '.join(f"#{m.index} {m.bbox[2] - m.bbox[0]}x{m.bbox[3] - m.bbox[1]}" for m in monitors))
+
+    def capture(self, threshold: float, max_width: int, quality: int = 80) -> List[MonitorFrame]:
+        """
+        threshold: 缩略图平均差异（占 255 的百分比）达到该值才算变化；
+        max_width: 变化的显示器缩小到的最大宽度，0 表示不缩小。
+        """
+        self._setup()
+        full = None
+        if not self._backends:
+            with REGISTRY.stage('monitors', 'grab'):
+                full = self._full_capture()
+        origin = self._origin
+
+        def work(monitor: Monitor) -> MonitorFrame:
+            if full is None:
+                image = self._backends[monitor.index].grab()
+            elif monitor.bbox[2]:
+                left, top, right, bottom = monitor.bbox
+                image = full.crop((left - origin[0], top - origin[1], right - origin[0], bottom - origin[1]))
+            else:
+                image = full
+            # 先缩小再做其他处理，后续操作的像素量与显示器分辨率无关
+            if max_width and image.width > max_width:
+                image = image.resize((max_width, round(image.height * max_width / image.width)), Image.BILINEAR)
+            thumbnail = image.resize(THUMBNAIL_SIZE, Image.BOX).convert('L')
+            previous = self._thumbnails.get(monitor.index)
+            changed = previous is None or \
+                ImageStat.Stat(ImageChops.difference(previous, thumbnail)).mean[0] * 100 / 255 >= threshold
+            jpeg = None
+            if changed:
+                # 只在发送时更新基准：缓慢的累积变化最终也会超过阈值
+                self._thumbnails[monitor.index] = thumbnail
+                buffer = io.BytesIO()
+                image.convert('RGB').save(buffer, format='JPEG', quality=quality)
+                jpeg = buffer.getvalue()
+            return MonitorFrame(monitor, image, changed, jpeg)
+
+        try:
+            with REGISTRY.stage('monitors', 'process') as stage:
+                frames = list(self._pool.map(work, self.monitors))
+                stage.bytes = sum(len(f.jpeg) for f in frames if f.jpeg)
+        except Exception:
+            # 显示器插拔等情况下重新枚举
+            self._layout_key = None
+            raise
+        return frames
+
+    def close(self) -> None:
+        for backend in self._backends.values():
+            backend.close()
+        self._backends = {}
+        if self._full_capture is not None and self._full_capture is not self._injected_capture:
+            self._full_capture.close()
+        self._full_capture = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        self._layout_key = None
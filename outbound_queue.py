@@ -0,0 +1,229 @@
+"""
+出站消息队列：本机所有发往家长的消息按优先级排队，告警（强制关机、额度用完）不会排在截图上传后面。
+
+- 优先级：告警 > 状态（命令回复、/shot 按需截图）> 例行截图；
+- 两个工作线程：紧急通道只处理告警和状态，常规通道按优先级处理所有消息，
+  一次 60 秒的截图上传不会挡住告警；
+- 同一个 key 的新消息替换队列中还没发出的旧消息（例如同一发送器的上一张截图）；
+- 每类消息有各自的期限，过期还没发出的直接丢弃；队列满时先丢弃优先级最低、最早的消息；
+- 设置了 connectivity 时，离线期间消息留在队列中，恢复联网后按优先级发出。
+"""
+import heapq
+import itertools
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from clock import Clock, SYSTEM_CLOCK
+from config_manager import ConfigManager
+from connectivity import ConnectivityMonitor
+from metrics import REGISTRY
+
+ALERT = 0
+STATUS = 1
+FRAME = 2
+PRIORITY_NAMES = ('alert', 'status', 'frame')
+
+# 各类消息的默认期限（秒），0 表示不过期；由 configure() 按配置覆盖
+DEFAULT_DEADLINES = {ALERT: 3600.0, STATUS: 300.0, FRAME: 120.0}
+DEFAULT_MAX_QUEUED = 32
+# 强制关机前最多等待告警发出的时间（秒）
+ALERT_FLUSH_SECONDS = 10
+
+SendFunction = Callable[[], bool]
+
+
+class OutboundItem:
+    """队列中的一条消息。result: True/False 为发送结果，None 表示被丢弃或替换，没有发送"""
+
+    def __init__(self, priority: int, send: SendFunction, description: str, created: float,
+                 deadline: Optional[float], key: Optional[str]) -> None:
+        self.priority = priority
+        self.send = send
+        self.description = description
+        self.created = created
+        self.deadline = deadline
+        self.key = key
+        self.result: Optional[bool] = None
+        self.discarded = False
+        self.done = threading.Event()
+
+    def finish(self, result: Optional[bool]) -> None:
+        self.result = result
+        self.done.set()
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[bool]:
+        self.done.wait(timeout)
+        return self.result
+
+
+class OutboundQueue:
+    logger: logging.Logger
+    running: bool
+
+    def __init__(self, clock: Clock = SYSTEM_CLOCK, connectivity: Optional[ConnectivityMonitor] = None) -> None:
+        self.logger = logging.getLogger("Outbound")
+        self.clock = clock
+        # 可选的连通性监视，离线时工作线程不取消息
+        self.connectivity = connectivity
+        self.running = False
+        self.deadlines: Dict[int, float] = dict(DEFAULT_DEADLINES)
+        self.max_queued = DEFAULT_MAX_QUEUED
+        self._heap: List[Tuple[int, int, OutboundItem]] = []
+        self._keyed: Dict[str, OutboundItem] = {}
+        self._pending = 0
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._alert_channels: Dict[str, Callable[[str], bool]] = {}
+
+    def configure(self, deadlines: Dict[int, float], max_queued: int) -> None:
+        with self._cond:
+            self.deadlines.update(deadlines)
+            self.max_queued = max(1, max_queued)
+
+    def add_alert_channel(self, name: str, send_text: Callable[[str], bool]) -> None:
+        """注册告警的发送渠道（Telegram、钉钉等），send_text 返回 False 表示未发送"""
+        self._alert_channels[name] = send_text
+
+    def put(self, priority: int, send: SendFunction, description: str, key: Optional[str] = None,
+            deadline: Optional[float] = None) -> OutboundItem:
+        """
+        排入一条消息并立即返回。deadline 为绝对时间戳，不传时按这类消息的默认期限计算。
+        """
+        now = self.clock.time()
+        if deadline is None and self.deadlines.get(priority, 0) > 0:
+            deadline = now + self.deadlines[priority]
+        item = OutboundItem(priority, send, description, now, deadline, key)
+        dropped: List[OutboundItem] = []
+        with self._cond:
+            if key is not None:
+                previous = self._keyed.pop(key, None)
+                if previous is not None and not previous.discarded:
+                    self._discard(previous)
+                    dropped.append(previous)
+                    REGISTRY.inc('outbound_dropped_total', priority=PRIORITY_NAMES[previous.priority],
+                                 reason='replaced')
+                self._keyed[key] = item
+            heapq.heappush(self._heap, (priority, next(self._seq), item))
+            self._pending += 1
+            while self._pending > self.max_queued:
+                victim = self._lowest()
+                self._discard(victim)
+                dropped.append(victim)
+                REGISTRY.inc('outbound_dropped_total', priority=PRIORITY_NAMES[victim.priority], reason='overflow')
+                self.logger.warning(f"Outbound queue full, dropped {victim.description}")
+            self._cond.notify_all()
+        for victim in dropped:
+            victim.finish(None)
+        self._ensure_workers()
+        return item
+
+    def send(self, priority: int, send: SendFunction, description: str, key: Optional[str] = None,
+             deadline: Optional[float] = None) -> bool:
+        """排入并等待发送完成；被丢弃或替换时返回 False"""
+        return bool(self.put(priority, send, description, key, deadline).wait())
+
+    def alert(self, text: str) -> List[OutboundItem]:
+        """通过所有已注册的渠道发送告警"""
+        return [self.put(ALERT, lambda send_text=send_text: send_text(text), f"{name} alert")
+                for name, send_text in self._alert_channels.items()]
+
+    def _discard(self, item: OutboundItem) -> None:
+        """标记为丢弃；堆中的条目在取出时跳过。调用方持有锁"""
+        item.discarded = True
+        self._pending -= 1
+        if item.key is not None and self._keyed.get(item.key) is item:
+            del self._keyed[item.key]
+
+    def _lowest(self) -> OutboundItem:
+        """优先级最低、最早排入的消息；调用方持有锁"""
+        live = [entry for entry in self._heap if not entry[2].discarded]
+        return max(live, key=lambda entry: (entry[0], -entry[1]))[2]
+
+    def _take(self, max_priority: int, timeout: float) -> Optional[OutboundItem]:
+        """取出 max_priority 及更紧急的下一条未过期消息；没有或离线时等待 timeout 秒后返回 None"""
+        if self.connectivity is not None and not self.connectivity.is_online():
+            self.connectivity.wait_online(timeout)
+            return None
+        expired: List[OutboundItem] = []
+        item = None
+        with self._cond:
+            while self._heap and self._heap[0][2].discarded:
+                heapq.heappop(self._heap)
+            if not self._heap or self._heap[0][0] > max_priority:
+                self._cond.wait(timeout)
+            now = self.clock.time()
+            while self._heap and self._heap[0][0] <= max_priority:
+                candidate = heapq.heappop(self._heap)[2]
+                if candidate.discarded:
+                    continue
+                self._discard(candidate)
+                if candidate.deadline is not None and now > candidate.deadline:
+                    expired.append(candidate)
+                    continue
+                item = candidate
+                break
+        for stale in expired:
+            REGISTRY.inc('outbound_dropped_total', priority=PRIORITY_NAMES[stale.priority], reason='expired')
+            self.logger.info(f"Dropped stale {stale.description} after {now - stale.created:.0f}s in queue")
+            stale.finish(None)
+        return item
+
+    def process_once(self, max_priority: int = FRAME, timeout: float = 0.0) -> bool:
+        """发送一条消息，返回是否处理了消息；工作线程循环调用"""
+        item = self._take(max_priority, timeout)
+        if item is None:
+            return False
+        name = PRIORITY_NAMES[item.priority]
+        REGISTRY.observe_duration(max(0.0, self.clock.time() - item.created), sender='outbound', stage=f'wait_{name}')
+        result = False
+        try:
+            result = bool(item.send())
+        except Exception as e:
+            self.logger.error(f"Error sending {item.description}: {e}", exc_info=True)
+        finally:
+            REGISTRY.inc('outbound_sent_total', priority=name, result='success' if result else 'failure')
+            item.finish(result)
+        return True
+
+    def _worker(self, max_priority: int) -> None:
+        while self.running:
+            self.process_once(max_priority, timeout=1.0)
+
+    def _ensure_workers(self) -> None:
+        with self._cond:
+            if self.running:
+                return
+            self.running = True
+            self._threads = [
+                threading.Thread(target=self._worker, args=(STATUS,), name="outbound-urgent", daemon=True),
+                threading.Thread(target=self._worker, args=(FRAME,), name="outbound-bulk", daemon=True),
+            ]
+        for thread in self._threads:
+            thread.start()
+        self.logger.info("Outbound queue workers started.")
+
+    def stop(self) -> None:
+        """停止工作线程；还在排队的消息不再发送"""
+        with self._cond:
+            self.running = False
+            pending = [entry[2] for entry in self._heap if not entry[2].discarded]
+            for item in pending:
+                self._discard(item)
+            self._heap.clear()
+            self._cond.notify_all()
+        for item in pending:
+            item.finish(None)
+
+
+def queue_settings(config_manager: ConfigManager) -> Tuple[Dict[int, float], int]:
+    """从配置读取各类消息的期限和队列长度，供 OUTBOX.configure() 使用"""
+    deadlines = {ALERT: float(config_manager.get('alertDeadlineSeconds')),
+                 STATUS: float(config_manager.get('statusDeadlineSeconds')),
+                 FRAME: float(config_manager.get('frameDeadlineSeconds'))}
+    return deadlines, int(config_manager.get('outboundMaxQueued'))
+
+
+# 本机所有发送器和提醒共用的出站队列
+OUTBOX = OutboundQueue()
@@ -0,0 +1,80 @@
+"""
+按登录的系统用户切换配置：兄弟姐妹共用一台电脑时，每个人有自己的使用统计、额度和允许时段。
+
+config.ini 中 [Settings:用户名] 覆盖 [Settings] 中的同名键（例如 dailyQuotaMinutes），
+[Schedule:用户名] 覆盖 [Schedule]；没有覆盖段的用户使用公共设置。使用统计按用户各存一个文件
+（usage_stats.json → usage_stats.用户名.json）。
+
+每 profileCheckSeconds 秒读取一次控制台会话的用户名，变化时调用 ConfigManager.set_profile：
+不重新读取配置文件，也不重启组件，各组件照常通过配置监听回调应用变化的设置，
+UsageTracker 在跟踪线程中保存原来用户的统计并载入新用户的统计。
+没有用户登录（登录界面）时保持原来的用户。
+"""
+import logging
+import threading
+from typing import Optional, Set
+
+from activity_probe import ActivityProbe, default_probe
+from clock import Clock, SYSTEM_CLOCK
+from config_manager import ConfigManager
+
+# 关闭时多久检查一次是否重新开启（秒）
+DISABLED_CHECK_SECONDS = 60
+
+
+class ProfileSwitcher:
+    logger: logging.Logger
+    running: bool
+    config_manager: ConfigManager
+    enabled: bool
+    check_seconds: int
+
+    def __init__(self, config_manager: ConfigManager, probe: Optional[ActivityProbe] = None,
+                 clock: Clock = SYSTEM_CLOCK) -> None:
+        self.logger = logging.getLogger("Profiles")
+        self.config_manager = config_manager
+        self.probe = probe or default_probe()
+        self.clock = clock
+        self.running = False
+        self._wake = threading.Event()
+
+        self.apply_config()
+        self.config_manager.add_listener(self._on_config_changed)
+
+    def apply_config(self) -> None:
+        self.enabled = bool(self.config_manager.get('enableProfiles'))
+        self.check_seconds = max(1, int(self.config_manager.get('profileCheckSeconds')))
+
+    def _on_config_changed(self, changed: Set[str]) -> None:
+        if changed & {'enableProfiles', 'profileCheckSeconds'}:
+            self.apply_config()
+            self._wake.set()
+
+    def check(self) -> str:
+        """按当前登录的用户切换配置，返回生效的用户配置名（空字符串为公共配置）"""
+        if not self.enabled:
+            self.config_manager.set_profile('')
+            return ''
+        user = self.probe.user().strip().lower()
+        if user and user != self.config_manager.profile:
+            self.logger.info(f"Logged-in user is now '{user}'.")
+            self.config_manager.set_profile(user)
+        return self.config_manager.profile
+
+    def run(self) -> None:
+        self.running = True
+        self.logger.info("Profile switcher started.")
+        try:
+            while self.running:
+                self.check()
+                self.clock.wait(self._wake, self.check_seconds if self.enabled else DISABLED_CHECK_SECONDS)
+                self._wake.clear()
+        except Exception as e:
+            self.logger.critical(f"Profile switcher encountered a critical error: {e}", exc_info=True)
+        finally:
+            self.running = False
+            self.logger.info("Profile switcher stopped.")
+
+    def stop(self) -> None:
+        self.running = False
+        self._wake.set()
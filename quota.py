@@ -0,0 +1,235 @@
+"""
+每日使用额度：按星期几分别设置额度，用到配置的百分比时提醒，用完时执行限制；
+前一天没用完的时间可以按上限结转到今天。
+
+额度由 UsageTracker 每次累加的使用时间增量驱动，每次更新只比较下一个阈值，是 O(1) 的；
+阈值（各级提醒和用完）按顺序排好，任何时刻都知道下一次触发的时刻（假设一直使用）。
+"""
+import bisect
+import datetime
+import logging
+import threading
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set
+
+from calendar_rules import ScheduleCalendar
+from clock import Clock, SYSTEM_CLOCK
+from config_manager import SETTINGS_SCHEMA, ConfigManager
+from system_actions import SystemActions
+from usage_tracker import UsageTracker
+
+WEEKDAY_NAMES = ('周一', '周二', '周三', '周四', '周五', '周六', '周日')
+
+
+class Threshold(NamedTuple):
+    at: float  # 今天累计使用达到多少秒时触发
+    percent: int  # 100 表示额度用完
+
+
+def parse_weekday_minutes(text: str) -> List[int]:
+    """"120,120,120,120,150,240,240" → 周一到周日的分钟数；只写一个数表示每天相同，留空表示不限（0）"""
+    values = [int(part) for part in text.replace(' ', '').split(',') if part]
+    if not values:
+        return [0] * 7
+    if len(values) == 1:
+        return values * 7
+    if len(values) != 7:
+        raise ValueError(f"expected 1 or 7 values, got {len(values)}")
+    return values
+
+
+def parse_percents(text: str) -> List[int]:
+    return sorted({int(part) for part in text.replace(' ', '').split(',') if part and 0 < int(part) < 100})
+
+
+class QuotaEngine:
+    """
+    on_warning(percent, remaining_seconds) 和 on_exhausted() 在 UsageTracker 的线程中调用。
+    当天的结转时间保存在使用统计文件中（quota_date / quota_carry），重启后不会重复结转。
+    """
+    logger: logging.Logger
+    config_manager: ConfigManager
+    budgets: List[int]
+    warn_percents: List[int]
+    rollover_cap: int
+
+    def __init__(self, config_manager: ConfigManager, usage_tracker: UsageTracker, clock: Clock = SYSTEM_CLOCK,
+                 actions: Optional[SystemActions] = None,
+                 on_warning: Optional[Callable[[int, float], None]] = None,
+                 on_exhausted: Optional[Callable[[], None]] = None,
+                 calendar: Optional[ScheduleCalendar] = None) -> None:
+        self.logger = logging.getLogger("Quota")
+        self.config_manager = config_manager
+        self.usage_tracker = usage_tracker
+        self.clock = clock
+        self.actions = actions or SystemActions()
+        self.on_warning = on_warning
+        self.on_exhausted = on_exhausted
+        # 可选的日历规则：节假日按周日的额度，下一个截止时间不晚于允许时段的结束
+        self.calendar = calendar
+        self._lock = threading.Lock()
+        self.day = self.clock.today()
+        self.used = 0.0
+        self.carry = 0.0
+        self.extension = 0.0
+        self.allowance = 0.0
+        self._thresholds: List[Threshold] = []
+        self._next = 0
+
+        self.apply_config()
+        self.config_manager.add_listener(self._on_config_changed)
+        self._start_day(self.day, usage_tracker.get_usage_time(), self._restore_carry(usage_tracker.previous_stats))
+        usage_tracker.add_usage_listener(self.add_usage)
+        usage_tracker.add_profile_listener(self._on_profile_switched)
+
+    def apply_config(self) -> None:
+        try:
+            self.budgets = [minutes * 60 for minutes in parse_weekday_minutes(str(self.config_manager.get('dailyQuotaMinutes')))]
+        except ValueError as e:
+            self.logger.error(f"Invalid dailyQuotaMinutes, quota disabled: {e}")
+            self.budgets = [0] * 7
+        try:
+            self.warn_percents = parse_percents(str(self.config_manager.get('quotaWarnPercents')))
+        except ValueError as e:
+            self.logger.error(f"Invalid quotaWarnPercents, using the default: {e}")
+            self.warn_percents = parse_percents(SETTINGS_SCHEMA['quotaWarnPercents'].default)
+        try:
+            self.rollover_cap = int(self.config_manager.get('quotaRolloverMinutes')) * 60
+        except ValueError as e:
+            self.logger.error(f"Invalid quotaRolloverMinutes, using the default: {e}")
+            self.rollover_cap = SETTINGS_SCHEMA['quotaRolloverMinutes'].default * 60
+
+    def _on_config_changed(self, changed: Set[str]) -> None:
+        if changed & {'dailyQuotaMinutes', 'quotaWarnPercents', 'quotaRolloverMinutes'} or \
+                any(key.startswith('Schedule.') for key in changed):
+            self.apply_config()
+            with self._lock:
+                self._rebuild()
+
+    def budget_for(self, day: datetime.date) -> int:
+        return self.budgets[self.calendar.quota_weekday(day) if self.calendar else day.weekday()]
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget_for(self.day) > 0
+
+    def _restore_carry(self, stats: Dict[str, Any]) -> float:
+        """启动时恢复今天的结转时间；统计文件是昨天的，就按昨天的剩余计算"""
+        today = self.day
+        try:
+            stats_day = datetime.date.fromisoformat(stats.get('today_date', ''))
+        except ValueError:
+            return 0.0
+        if stats_day == today and stats.get('quota_date') == today.isoformat():
+            return float(stats.get('quota_carry', 0))
+        if stats_day == today - datetime.timedelta(days=1):
+            carried_in = float(stats.get('quota_carry', 0)) if stats.get('quota_date') == stats_day.isoformat() else 0.0
+            return self._leftover(stats_day, float(stats.get('daily_usage_time', 0)), carried_in)
+        return 0.0
+
+    def _on_profile_switched(self) -> None:
+        """切换用户后按新用户的统计重新开始今天的计数（延长的时间不带过去）"""
+        self._start_day(self.clock.today(), self.usage_tracker.daily_usage_time,
+                        self._restore_carry(self.usage_tracker.previous_stats))
+
+    def _leftover(self, day: datetime.date, used: float, carried_in: float) -> float:
+        budget = self.budget_for(day)
+        if budget <= 0 or self.rollover_cap <= 0:
+            return 0.0
+        return min(self.rollover_cap, max(0.0, budget + carried_in - used))
+
+    def _start_day(self, day: datetime.date, used: float, carry: float) -> None:
+        with self._lock:
+            self.day, self.used, self.carry, self.extension = day, used, carry, 0.0
+            self._rebuild(fire_passed=False)
+        with self.usage_tracker.lock:
+            self.usage_tracker.extra_stats.update(quota_date=day.isoformat(), quota_carry=int(carry))
+        if self.enabled:
+            self.logger.info(f"{WEEKDAY_NAMES[day.weekday()]} quota {self.allowance / 60:.0f} min "
+                             f"(carry {carry / 60:.0f} min), used {used / 60:.0f} min")
+
+    def _rebuild(self, fire_passed: bool = False) -> None:
+        """额度或提醒比例变化后重新排列阈值；调用方持有锁。已经越过的阈值默认不再触发"""
+        budget = self.budget_for(self.day)
+        self.allowance = budget + self.carry + self.extension if budget > 0 else 0.0
+        if self.allowance <= 0:
+            self._thresholds, self._next = [], 0
+            return
+        self._thresholds = [Threshold(self.allowance * p / 100, p) for p in self.warn_percents]
+        self._thresholds.append(Threshold(self.allowance, 100))
+        self._next = 0 if fire_passed else bisect.bisect_right([t.at for t in self._thresholds], self.used)
+
+    def _roll_day(self) -> None:
+        """跨天后把昨天的剩余结转到今天，重新开始计数"""
+        today = self.clock.today()
+        if today != self.day:
+            with self._lock:
+                carry = self._leftover(self.day, self.used, self.carry)
+            self._start_day(today, 0.0, carry)
+
+    def add_usage(self, delta: float) -> None:
+        """UsageTracker 的增量回调：只和下一个阈值比较"""
+        self._roll_day()
+        fired: List[Threshold] = []
+        with self._lock:
+            self.used += delta
+            while self._next < len(self._thresholds) and self.used >= self._thresholds[self._next].at:
+                fired.append(self._thresholds[self._next])
+                self._next += 1
+        for threshold in fired:
+            self._fire(threshold)
+
+    def _fire(self, threshold: Threshold) -> None:
+        remaining = max(0.0, self.allowance - self.used)
+        if threshold.percent >= 100:
+            self.logger.info(f"Daily quota of {self.allowance / 60:.0f} minutes used up")
+            self.actions.record('quota_exhausted', allowance=self.allowance)
+            if self.on_exhausted:
+                self.on_exhausted()
+        else:
+            self.logger.info(f"Daily quota {threshold.percent}% used, {remaining / 60:.0f} minutes left")
+            self.actions.record('quota_warning', percent=threshold.percent, remaining=remaining)
+            if self.on_warning:
+                self.on_warning(threshold.percent, remaining)
+
+    def remaining(self) -> Optional[float]:
+        """今天还剩多少秒；没有额度限制时返回 None"""
+        self._roll_day()
+        with self._lock:
+            return max(0.0, self.allowance - self.used) if self.allowance > 0 else None
+
+    def exhausted(self) -> bool:
+        self._roll_day()
+        with self._lock:
+            return 0 < self.allowance <= self.used
+
+    def next_deadline(self) -> Optional[float]:
+        """
+        如果一直使用，下一次需要处理的时刻（时间戳）：下一个阈值，或者更早结束的允许时段；
+        两者都没有时返回 None
+        """
+        self._roll_day()
+        deadlines = []
+        with self._lock:
+            if self._next < len(self._thresholds):
+                deadlines.append(self.clock.time() + self._thresholds[self._next].at - self.used)
+        if self.calendar:
+            allowed_until = self.calendar.allowed_until(self.clock.now())
+            if allowed_until is not None:
+                deadlines.append(allowed_until.timestamp())
+        return min(deadlines) if deadlines else None
+
+    def extend(self, minutes: int) -> str:
+        """给今天增加额度；用完之后再延长，会重新在新的额度用完时执行限制"""
+        self._roll_day()
+        with self._lock:
+            self.extension += minutes * 60
+            self._rebuild()
+        self.actions.record('quota_extended', minutes=minutes)
+        remaining = self.remaining()
+        return f"今天的额度增加 {minutes} 分钟，还剩 {remaining / 60:.0f} 分钟" if remaining is not None else ""
+
+    def status(self) -> Optional[str]:
+        remaining = self.remaining()
+        if remaining is None:
+            return None
+        return f"今日额度 {self.allowance / 60:.0f} 分钟，还剩 {remaining / 60:.0f} 分钟"
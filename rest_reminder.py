@@ -1,13 +1,17 @@
 import tkinter as tk
 from tkinter import messagebox
 import time
-from typing import Optional, Tuple, Any, Dict
+from typing import Optional, Tuple, Any, Dict, List, Set
 from config_manager import ConfigManager
 from usage_tracker import UsageTracker
+from quota import QuotaEngine
+from calendar_rules import FORCED, PLANNED_SHUTDOWN, REMINDER, ScheduleCalendar
+from outbound_queue import ALERT_FLUSH_SECONDS, OutboundItem, OutboundQueue
+from clock import Clock, SYSTEM_CLOCK
+from system_actions import SystemActions
 import datetime
-import os
+import platform
 import threading
-import sys  # Not strictly needed for type hints here but often imported with os/logging
 import logging
 
 # import configparser # 不需要单独导入，通过 config_manager 访问
@@ -18,6 +22,7 @@ REMINDER_STRINGS: Dict[str, Dict[str, str]] = {
         'time_to_rest_message': "该休息啦！",
         'shutdown_warning_message': "电脑将在 {minutes} 分钟后自动关机\n请保存好您的工作！",
         'late_night_message': "已经很晚了，请注意休息！\n长时间使用电脑会影响健康。",
+        'quota_warning_message': "今天的使用时间已用掉 {percent}%\n还剩 {minutes} 分钟。",
         'cancel_shutdown_button': "取消关机",
         'acknowledge_button': "知道了",
         'forced_rest_title': "强制休息提醒",
@@ -28,6 +33,12 @@ REMINDER_STRINGS: Dict[str, Dict[str, str]] = {
         'cancel_shutdown_info_title': "取消关机",
         # Added for consistency, though original used "取消关机" directly as title
         'cancel_shutdown_info_message': "已取消自动关机计划。\n但请记得早点休息！",
+        # 发给家长的告警
+        'alert_shutdown_scheduled': "{computer}: {reason}，{minutes} 分钟后自动关机",
+        'alert_forced_shutdown': "{computer}: 到达强制关机时间，正在关机",
+        'alert_shutdown_now': "{computer}: {reason}，正在关机",
+        'alert_reason_schedule': "已过允许使用的时段",
+        'alert_reason_quota': "今日使用额度已用完",
     }
 }
 
@@ -35,11 +46,12 @@ REMINDER_STRINGS: Dict[str, Dict[str, str]] = {
 class RestReminder:
     logger: logging.Logger
     shutdown_scheduled: bool
+    shutdown_reason: str
     shutdown_time: Optional[datetime.datetime]
     root: Optional[tk.Toplevel]
     usage_tracker: Optional[UsageTracker]
     window_open: bool
-    main_root: tk.Tk
+    main_root: Optional[tk.Tk]
     config_manager: ConfigManager
     first_reminder_hour: int
     shutdown_plan_hour: int
@@ -49,6 +61,12 @@ class RestReminder:
     continuous_usage_threshold: int
     forced_rest_duration: int
     forced_shutdown_hour: int
+    running: bool
+    clock: Clock
+    actions: SystemActions
+    quota: Optional[QuotaEngine]
+    calendar: ScheduleCalendar
+    outbox: Optional[OutboundQueue]
 
     def get_string(self, key: str, lang: str = 'zh_CN', **kwargs: Any) -> str:
         template = REMINDER_STRINGS.get(lang, {}).get(key, f"Missing string: {key}")
@@ -58,64 +76,110 @@ class RestReminder:
             self.logger.error(f"Missing placeholder {e} in string for key '{key}' with args {kwargs}")
             return f"Error formatting string: {key}"
 
-    def __init__(self, main_root: tk.Tk, config_manager: ConfigManager,
-                 usage_tracker: Optional[UsageTracker] = None) -> None:
+    def __init__(self, main_root: Optional[tk.Tk], config_manager: ConfigManager,
+                 usage_tracker: Optional[UsageTracker] = None, clock: Clock = SYSTEM_CLOCK,
+                 actions: Optional[SystemActions] = None, quota: Optional[QuotaEngine] = None,
+                 calendar: Optional[ScheduleCalendar] = None, outbox: Optional[OutboundQueue] = None) -> None:
         self.logger = logging.getLogger("RestReminder")
         self.shutdown_scheduled = False
+        self.shutdown_reason = 'schedule'
         self.shutdown_time = None
         self.root = None
         self.usage_tracker = usage_tracker
         self.window_open = False
         self.main_root = main_root
         self.config_manager = config_manager
-
-        # 从 ConfigManager 获取参数, ensuring types and providing defaults if get_setting returns None
-        frh_setting = self.config_manager.get_setting('Settings', 'firstReminderHour', type=int, fallback=21)
-        self.first_reminder_hour = int(frh_setting) if frh_setting is not None else 21
-
-        sph_setting = self.config_manager.get_setting('Settings', 'shutdownPlanHour', type=int, fallback=21)
-        self.shutdown_plan_hour = int(sph_setting) if sph_setting is not None else 21
-
-        spm_setting = self.config_manager.get_setting('Settings', 'shutdownPlanMinute', type=int, fallback=30)
-        self.shutdown_plan_minute = int(spm_setting) if spm_setting is not None else 30
-
-        sdm_setting = self.config_manager.get_setting('Settings', 'shutdownDelayMinutes', type=int, fallback=5)
-        self.shutdown_delay_minutes = int(sdm_setting) if sdm_setting is not None else 5
-
-        ris_setting = self.config_manager.get_setting('Settings', 'reminderIntervalSeconds', type=int, fallback=300)
-        self.reminder_interval_seconds = int(ris_setting) if ris_setting is not None else 300
-
-        cut_setting = self.config_manager.get_setting('Settings', 'continuousUsageThreshold', type=int, fallback=10)
-        self.continuous_usage_threshold = (int(cut_setting) if cut_setting is not None else 10) * 60
-
-        frd_setting = self.config_manager.get_setting('Settings', 'forcedRestDuration', type=int, fallback=1)
-        self.forced_rest_duration = (int(frd_setting) if frd_setting is not None else 1) * 60
-
-        fsh_setting = self.config_manager.get_setting('Settings', 'forcedShutdownHour', type=int, fallback=22)
-        self.forced_shutdown_hour = int(fsh_setting) if fsh_setting is not None else 22
+        # 时钟和系统动作可注入；main_root 为 None 时不创建窗口（模拟器中使用）
+        self.clock = clock
+        self.actions = actions or SystemActions()
+        # 每日额度（可选）：用完后和晚间计划关机一样执行 shutdownDelayMinutes 后关机
+        self.quota = quota
+        # 允许使用的时段（[Schedule] 段，未配置时由提醒/关机时间生成），与额度和浮窗共用
+        self.calendar = calendar or ScheduleCalendar(config_manager, clock)
+        # 出站队列（可选）：计划关机和强制关机时通知家长，告警排在所有截图之前
+        self.outbox = outbox
+
+        self.running = False
+        # 配置变更时唤醒提醒循环，新的时间设置无需重启即可生效
+        self._wake = threading.Event()
+        # 远程 /extend 命令给出的当天延长时间（分钟），所有晚间时间点一起顺延
+        self._extension_day: Optional[datetime.date] = None
+        self._extension_minutes = 0
+
+        self.apply_config()
+        self.config_manager.add_listener(self._on_config_changed)
 
         self.logger.info("RestReminder initialized with settings from ConfigManager.")
 
-    def check_time(self) -> Tuple[bool, bool, bool]:
-        # ... (保持不变) ...
-        now = datetime.datetime.now()
-        first_reminder_time = now.replace(hour=self.first_reminder_hour, minute=0, second=0, microsecond=0)
-        shutdown_plan_time = now.replace(hour=self.shutdown_plan_hour, minute=self.shutdown_plan_minute,
-                                         second=0, microsecond=0)
-        forced_shutdown_time = now.replace(hour=self.forced_shutdown_hour, minute=0, second=0, microsecond=0)
-
-        return now >= first_reminder_time, now >= shutdown_plan_time, now >= forced_shutdown_time
+    def apply_config(self) -> None:
+        """从 ConfigManager 读取参数，初始化和配置热加载时都会调用"""
+        self.first_reminder_hour = int(self.config_manager.get('firstReminderHour'))
+        self.shutdown_plan_hour = int(self.config_manager.get('shutdownPlanHour'))
+        self.shutdown_plan_minute = int(self.config_manager.get('shutdownPlanMinute'))
+        self.shutdown_delay_minutes = int(self.config_manager.get('shutdownDelayMinutes'))
+        self.reminder_interval_seconds = int(self.config_manager.get('reminderIntervalSeconds'))
+        self.continuous_usage_threshold = int(self.config_manager.get('continuousUsageThreshold')) * 60
+        self.forced_rest_duration = int(self.config_manager.get('forcedRestDuration')) * 60
+        self.forced_shutdown_hour = int(self.config_manager.get('forcedShutdownHour'))
+
+    def _on_config_changed(self, changed: Set[str]) -> None:
+        if changed & {'firstReminderHour', 'shutdownPlanHour', 'shutdownPlanMinute', 'shutdownDelayMinutes',
+                      'reminderIntervalSeconds', 'continuousUsageThreshold', 'forcedRestDuration',
+                      'forcedShutdownHour'} or any(key.startswith('Schedule.') for key in changed):
+            self.apply_config()
+            self.logger.info("RestReminder settings reloaded.")
+            self._wake.set()
+
+    def extension_minutes(self) -> int:
+        return self._extension_minutes if self._extension_day == self.clock.today() else 0
+
+    def extend(self, minutes: int) -> str:
+        """把今天的提醒、计划关机和强制关机时间顺延 minutes 分钟；已计划的关机会被取消"""
+        if self._extension_day != self.clock.today():
+            self._extension_day, self._extension_minutes = self.clock.today(), 0
+        self._extension_minutes += minutes
+        self.actions.record('extend', minutes=minutes, total=self._extension_minutes)
+        self.logger.info(f"使用时间延长 {minutes} 分钟，今天共延长 {self._extension_minutes} 分钟")
+        if self.shutdown_scheduled:
+            self.cancel_shutdown()
+        self._wake.set()
+        shifted_now = self.clock.now() - datetime.timedelta(minutes=self._extension_minutes)
+        forced = self.calendar.next_zone_start(FORCED, shifted_now)
+        if forced is None:
+            return f"今天共延长 {self._extension_minutes} 分钟"
+        forced += datetime.timedelta(minutes=self._extension_minutes)
+        return f"今天共延长 {self._extension_minutes} 分钟，强制关机时间顺延到 {forced:%H:%M}"
 
-    def show_reminder_window(self, is_shutdown: bool = False, countdown: int = 300) -> None:
-        """显示提醒窗口"""
+    def check_time(self) -> Tuple[bool, bool, bool]:
+        """(是否进入提醒阶段, 是否到了计划关机, 是否到了强制关机)，由日历规则二分查找得出"""
+        # 延长的时间相当于把当前时间往回拨
+        zone = self.calendar.zone(self.clock.now() - datetime.timedelta(minutes=self.extension_minutes()))
+        return zone >= REMINDER, zone >= PLANNED_SHUTDOWN, zone >= FORCED
+
+    def show_reminder_window(self, is_shutdown: bool = False, countdown: int = 300,
+                             message: Optional[str] = None) -> None:
+        """显示提醒窗口；message 替换默认的晚间提醒文字"""
         if self.window_open:
             self.logger.info("提醒窗口已打开，跳过显示")
             return
 
+        self.actions.record('shutdown_warning' if is_shutdown else 'reminder', countdown=countdown)
+        if self.main_root is None:
+            return
         # 在主线程中调度窗口创建
-        self.main_root.after(0, lambda: self._create_reminder_window(is_shutdown, countdown))
+        self.main_root.after(0, lambda: self._create_reminder_window(is_shutdown, countdown, message))
+
+    def quota_warning(self, percent: int, remaining: float) -> None:
+        """QuotaEngine 的提醒回调：额度用到 percent% 时显示剩余时间"""
+        self.show_reminder_window(message=self.get_string('quota_warning_message', percent=percent,
+                                                          minutes=int(remaining // 60)))
 
-    def _create_reminder_window(self, is_shutdown: bool = False, countdown: int = 300) -> None:
+    def quota_exhausted(self) -> None:
+        """QuotaEngine 的用完回调：立即唤醒提醒循环计划关机"""
+        self._wake.set()
+
+    def _create_reminder_window(self, is_shutdown: bool = False, countdown: int = 300,
+                                message: Optional[str] = None) -> None:
         if self.window_open:  # 再次检查，防止多重调度
             return
 
@@ -136,7 +200,7 @@ class RestReminder:
         if is_shutdown:
             content = self.get_string('shutdown_warning_message', minutes=countdown // 60)
         else:
-            content = self.get_string('late_night_message')
+            content = message or self.get_string('late_night_message')
 
         content_label = tk.Label(self.root, text=content, font=content_font, bg="#FF6B6B", fg="white", wraplength=500)
         content_label.pack(pady=20)
@@ -166,6 +230,9 @@ class RestReminder:
             self.logger.info("强制休息窗口已打开，跳过显示")
             return
 
+        self.actions.record('forced_rest', duration=countdown)
+        if self.main_root is None:
+            return
         # 在主线程中调度窗口创建
         self.main_root.after(0, lambda: self._create_forced_rest_window(countdown))
 
@@ -257,8 +324,9 @@ class RestReminder:
 
         if seconds <= 0:
             self.close_window()
-            # 在主线程中调度关机
-            self.main_root.after(0, self.execute_shutdown)
+            # 等待告警发出最多需要 ALERT_FLUSH_SECONDS 秒，放到后台线程，不阻塞 Tk 主线程
+            threading.Thread(target=self.execute_shutdown, args=(self.shutdown_reason,),
+                             name="Shutdown", daemon=True).start()
             return
 
         content = self.get_string('shutdown_warning_message_seconds', shutdown_minutes=seconds // 60,
@@ -273,23 +341,30 @@ class RestReminder:
         if self.root:  # Ensure root is not None
             self.root.after(1000, lambda: self.update_countdown(seconds - 1))
 
-    def schedule_shutdown(self, minutes: int = 5) -> None:
-        # ... (保持不变) ...
+    def _alert(self, key: str, **kwargs: Any) -> List[OutboundItem]:
+        """通过出站队列通知家长；未注入队列或 sendAlerts 关闭时不发送"""
+        if self.outbox is None or not self.config_manager.get('sendAlerts'):
+            return []
+        return self.outbox.alert(self.get_string(key, computer=platform.node(), **kwargs))
+
+    def schedule_shutdown(self, minutes: int = 5, reason: str = 'schedule') -> None:
         if self.shutdown_scheduled:
             return
 
         self.shutdown_scheduled = True
-        self.shutdown_time = datetime.datetime.now() + datetime.timedelta(minutes=minutes)
+        self.shutdown_reason = reason
+        self.shutdown_time = self.clock.now() + datetime.timedelta(minutes=minutes)
 
-        os.system(f"shutdown /s /t {minutes * 60}")
+        self.actions.schedule_shutdown(minutes * 60)
         self.logger.info(f"已计划在 {minutes} 分钟后关机")
+        self._alert('alert_shutdown_scheduled', minutes=minutes, reason=self.get_string(f'alert_reason_{reason}'))
 
         self.show_reminder_window(is_shutdown=True, countdown=minutes * 60)
 
     def cancel_shutdown(self) -> None:
         # ... (保持不变) ...
         if self.shutdown_scheduled:
-            os.system("shutdown /a")
+            self.actions.cancel_shutdown()
             self.shutdown_scheduled = False
             self.logger.info("已取消关机计划")
 
@@ -297,7 +372,8 @@ class RestReminder:
             self.close_window()
 
             # 显示取消提示 (通过主线程调度)
-            self.main_root.after(0, self._show_cancel_message_on_main_thread)
+            if self.main_root is not None:
+                self.main_root.after(0, self._show_cancel_message_on_main_thread)
 
     def _show_cancel_message_on_main_thread(self) -> None:
         """在主线程中显示取消关机提示"""
@@ -306,46 +382,74 @@ class RestReminder:
                             self.get_string('cancel_shutdown_info_message'), parent=self.main_root)
         self.logger.info("Cancel shutdown message shown.")
 
-    def execute_shutdown(self) -> None:
-        self.logger.info("执行自动关机")
-        os.system("shutdown /s /t 0")
+    def execute_shutdown(self, reason: str = 'forced') -> None:
+        """reason 为 'forced'（到达强制关机时间），或倒计时结束时 schedule_shutdown 的原因（'schedule' / 'quota'）"""
+        self.logger.info(f"执行自动关机 ({reason})")
+        if reason == 'forced':
+            alert = self._alert('alert_forced_shutdown')
+        else:
+            alert = self._alert('alert_shutdown_now', reason=self.get_string(f'alert_reason_{reason}'))
+        # 关机前给告警一点时间发出去
+        deadline = time.monotonic() + ALERT_FLUSH_SECONDS
+        for item in alert:
+            item.wait(max(0.0, deadline - time.monotonic()))
+        self.actions.shutdown_now()
+
+    def tick(self) -> bool:
+        """
+        执行一次提醒检查。返回 False 表示已经执行强制关机，循环应当结束。
+        run() 每隔 reminderIntervalSeconds 调用一次，模拟器直接调用。
+        """
+        is_evening, is_late_evening, is_forced_shutdown = self.check_time()
+
+        if is_forced_shutdown:
+            self.logger.info("到达强制关机时间，执行关机")
+            # 直接调用系统关机，不需要通过 Tkinter 调度
+            self.execute_shutdown()
+            return False
+
+        if self.usage_tracker:
+            continuous_usage_time = self.usage_tracker.get_continuous_usage_time()
+            if continuous_usage_time >= self.continuous_usage_threshold and not self.window_open:
+                self.logger.info(
+                    f"连续使用{continuous_usage_time // 60}分钟，超过阈值{self.continuous_usage_threshold // 60}分钟，强制休息")
+                self.show_forced_rest_window(self.forced_rest_duration)
+
+        if self.quota and self.quota.exhausted() and not self.shutdown_scheduled:
+            self.logger.info(f"今日额度已用完，计划 {self.shutdown_delay_minutes} 分钟后关机")
+            self.schedule_shutdown(self.shutdown_delay_minutes, reason='quota')
+
+        if is_evening and not self.window_open:  # 只有当提醒窗口未打开时才显示
+            if is_late_evening and not self.shutdown_scheduled:
+                self.logger.info(f"已过允许使用的时段，计划 {self.shutdown_delay_minutes} 分钟后关机")
+                self.schedule_shutdown(self.shutdown_delay_minutes)
+            elif not is_late_evening:  # 在计划关机时间之前，显示普通提醒
+                self.logger.info("显示休息提醒")
+                self.show_reminder_window()
+        return True
 
     def run(self) -> None:
         """运行休息提醒程序"""
         self.logger.info("休息提醒程序已启动")
+        self.running = True
 
         try:
-            while True:
-                is_evening, is_late_evening, is_forced_shutdown = self.check_time()
-
-                if is_forced_shutdown:
-                    self.logger.info("到达强制关机时间，执行关机")
-                    # 直接调用系统关机，不需要通过 Tkinter 调度
-                    self.execute_shutdown()
+            while self.running:
+                if not self.tick():
                     # 关机后程序会终止，不需要继续循环
                     break
 
-                if self.usage_tracker:
-                    continuous_usage_time = self.usage_tracker.get_continuous_usage_time()
-                    if continuous_usage_time >= self.continuous_usage_threshold and not self.window_open:
-                        self.logger.info(
-                            f"连续使用{continuous_usage_time // 60}分钟，超过阈值{self.continuous_usage_threshold // 60}分钟，强制休息")
-                        self.show_forced_rest_window(self.forced_rest_duration)
-
-                if is_evening and not self.window_open:  # 只有当提醒窗口未打开时才显示
-                    if is_late_evening and not self.shutdown_scheduled:
-                        self.logger.info(
-                            f"已过晚上 {self.shutdown_plan_hour}:{self.shutdown_plan_minute}，计划 {self.shutdown_delay_minutes} 分钟后关机")
-                        self.schedule_shutdown(self.shutdown_delay_minutes)
-                    elif not is_late_evening:  # 在计划关机时间之前，显示普通提醒
-                        self.logger.info("显示休息提醒")
-                        self.show_reminder_window()
-
-                time.sleep(self.reminder_interval_seconds)
+                self.clock.wait(self._wake, self.reminder_interval_seconds)
+                self._wake.clear()
 
         except Exception as e:
             self.logger.error(f"程序运行出错: {str(e)}", exc_info=True)
         finally:
             if self.shutdown_scheduled:
                 self.cancel_shutdown()
-            self.close_window()  # 确保在线程结束时关闭所有打开的窗口
\ No newline at end of file
+            self.close_window()  # 确保在线程结束时关闭所有打开的窗口
+
+    def stop(self) -> None:
+        """停止休息提醒线程"""
+        self.running = False
+        self._wake.set()
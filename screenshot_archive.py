@@ -0,0 +1,274 @@
+"""
+本地截图存档：按内容哈希存放(hash → 文件)，相同画面只存一份；
+SQLite 索引记录每张截图的时间，按时间查找不需要扫描目录。
+保留策略按总大小和天数执行，每次存入后只淘汰必要的少量条目（按最近访问时间的 LRU）。
+
+archiveDelta 开启时，截图文件按图块增量编码（见 tile_delta.py）：大部分帧只存变化的图块，
+帧记录中的 key_hash 指向它的关键帧，关键帧的引用计数包含引用它的增量帧。
+
+目录结构:
+    archiveFolder/index.sqlite
+    archiveFolder/ab/abcdef....png
+    archiveFolder/cd/cdef01....kpd  (增量编码的帧)
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from typing import Dict, List, NamedTuple, Optional, Set
+
+from PIL import Image
+
+from clock import Clock, SYSTEM_CLOCK
+from config_manager import ConfigManager
+from tile_delta import TileDeltaEncoder, decode
+
+# 每次存入后最多处理的过期条目数，避免一次淘汰太多阻塞发送线程
+EVICT_BATCH = 64
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    ext TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    refs INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blobs_lru ON blobs (last_access);
+CREATE TABLE IF NOT EXISTS frames (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    hash TEXT NOT NULL,
+    source TEXT NOT NULL,
+    key_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS frames_ts ON frames (ts);
+CREATE INDEX IF NOT EXISTS frames_hash ON frames (hash);
+"""
+# 建表之后执行：旧版本的索引没有 key_hash 列，需要先补上
+_KEY_INDEX = "CREATE INDEX IF NOT EXISTS frames_key ON frames (key_hash)"
+DELTA_EXT = '.kpd'
+_FRAME_QUERY = ("SELECT f.ts, f.hash, f.source, b.ext, f.key_hash, k.ext FROM frames f "
+                "JOIN blobs b ON b.hash = f.hash LEFT JOIN blobs k ON k.hash = f.key_hash ")
+
+
+class ArchivedFrame(NamedTuple):
+    timestamp: float
+    hash: str
+    source: str
+    path: str
+    key_path: Optional[str] = None  # 增量帧的关键帧文件
+
+
+class ScreenshotArchive:
+    logger: logging.Logger
+    config_manager: ConfigManager
+    enabled: bool
+    folder: str
+    max_bytes: int
+    max_age: float
+    delta: bool
+
+    def __init__(self, config_manager: ConfigManager, clock: Clock = SYSTEM_CLOCK) -> None:
+        self.logger = logging.getLogger("ScreenshotArchive")
+        self.config_manager = config_manager
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.total_bytes = 0
+        # 每个来源一个增量编码器，以及它当前关键帧的哈希
+        self._encoders: Dict[str, TileDeltaEncoder] = {}
+        self._key_hashes: Dict[str, str] = {}
+
+        self.apply_config()
+        self.config_manager.add_listener(self._on_config_changed)
+
+    def apply_config(self) -> None:
+        folder = str(self.config_manager.get('archiveFolder')) or os.path.join(
+            str(self.config_manager.get('dataFolder')), 'archive')
+        with self._lock:
+            self.enabled = bool(self.config_manager.get('enableArchive'))
+            self.max_bytes = int(self.config_manager.get('archiveMaxMB')) * 1024 * 1024
+            self.max_age = int(self.config_manager.get('archiveMaxDays')) * 86400
+            self.delta = bool(self.config_manager.get('archiveDelta'))
+            if self._db is not None and folder != self.folder:
+                self._db.close()
+                self._db = None
+            self.folder = folder
+
+    def _on_config_changed(self, changed: Set[str]) -> None:
+        if changed & {'enableArchive', 'archiveFolder', 'dataFolder', 'archiveMaxMB', 'archiveMaxDays',
+                       'archiveDelta'}:
+            self.apply_config()
+
+    def _open(self) -> sqlite3.Connection:
+        """首次使用时打开索引；调用方持有 self._lock"""
+        if self._db is None:
+            os.makedirs(self.folder, exist_ok=True)
+            self._db = sqlite3.connect(os.path.join(self.folder, 'index.sqlite'), check_same_thread=False)
+            self._db.executescript(_SCHEMA)
+            if 'key_hash' not in [row[1] for row in self._db.execute("PRAGMA table_info(frames)")]:
+                self._db.execute("ALTER TABLE frames ADD COLUMN key_hash TEXT")
+            self._db.execute(_KEY_INDEX)
+            self.total_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            self.logger.info(f"Archive opened at '{self.folder}' ({self.total_bytes / 1048576:.1f} MB)")
+        return self._db
+
+    def _blob_path(self, digest: str, ext: str) -> str:
+        return os.path.join(self.folder, digest[:2], digest + ext)
+
+    def add_file(self, path: str, source: str = '', timestamp: Optional[float] = None) -> Optional[str]:
+        """存入一个截图文件（原文件保持不动），返回内容哈希；存档未启用时返回 None"""
+        if not self.enabled:
+            return None
+        try:
+            if self.delta:
+                with Image.open(path) as image:
+                    return self.add_image(image, source, timestamp)
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            self.logger.error(f"Error reading screenshot for archive: {e}")
+            return None
+        return self.add(data, os.path.splitext(path)[1] or '.png', source, timestamp)
+
+    def add_image(self, image: Image.Image, source: str = '', timestamp: Optional[float] = None) -> Optional[str]:
+        """按图块增量编码后存入；画面大部分不变时只存变化的图块"""
+        if not self.enabled:
+            return None
+        encoder = self._encoders.setdefault(source, TileDeltaEncoder(codec='PNG'))
+        frame = encoder.encode(image)
+        key_hash = self._key_hashes.get(source)
+        if not frame.key:
+            with self._lock:
+                exists = key_hash and self._open().execute("SELECT 1 FROM blobs WHERE hash = ?",
+                                                           (key_hash,)).fetchone()
+            if not exists:
+                # 关键帧已被淘汰（或还没存入），重新输出关键帧
+                encoder.reset()
+                frame = encoder.encode(image)
+        digest = self.add(frame.data, DELTA_EXT, source, timestamp, key_hash=None if frame.key else key_hash)
+        if frame.key and digest:
+            self._key_hashes[source] = digest
+        return digest
+
+    def add(self, data: bytes, ext: str = '.png', source: str = '', timestamp: Optional[float] = None,
+            key_hash: Optional[str] = None) -> Optional[str]:
+        if not self.enabled:
+            return None
+        digest = hashlib.sha256(data).hexdigest()
+        now = self.clock.time()
+        timestamp = now if timestamp is None else timestamp
+        try:
+            with self._lock:
+                db = self._open()
+                row = db.execute("SELECT refs FROM blobs WHERE hash = ?", (digest,)).fetchone()
+                if row:
+                    # 相同画面：只增加引用，不再写文件
+                    db.execute("UPDATE blobs SET refs = refs + 1, last_access = ? WHERE hash = ?", (now, digest))
+                else:
+                    path = self._blob_path(digest, ext)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    tmp = path + '.tmp'
+                    with open(tmp, 'wb') as f:
+                        f.write(data)
+                    os.replace(tmp, path)
+                    db.execute("INSERT INTO blobs (hash, ext, size, refs, last_access) VALUES (?, ?, ?, 1, ?)",
+                               (digest, ext, len(data), now))
+                    self.total_bytes += len(data)
+                if key_hash:
+                    # 增量帧同时引用关键帧，关键帧在所有增量帧删除之前不会被删除
+                    db.execute("UPDATE blobs SET refs = refs + 1, last_access = ? WHERE hash = ?", (now, key_hash))
+                db.execute("INSERT INTO frames (ts, hash, source, key_hash) VALUES (?, ?, ?, ?)",
+                           (timestamp, digest, source, key_hash))
+                self._evict(db, now)
+                db.commit()
+        except (OSError, sqlite3.Error) as e:
+            self.logger.error(f"Error archiving screenshot: {e}")
+            return None
+        return digest
+
+    def _evict(self, db: sqlite3.Connection, now: float) -> None:
+        """增量执行保留策略：按时间索引删过期帧，再按 LRU 索引删到总大小以内"""
+        if self.max_age > 0:
+            self._drop_frames(db, db.execute("SELECT id, hash, key_hash FROM frames WHERE ts < ? ORDER BY ts LIMIT ?",
+                                             (now - self.max_age, EVICT_BATCH)).fetchall())
+            self._remove_unreferenced(db)
+        if self.max_bytes > 0:
+            evicted = 0
+            while self.total_bytes > self.max_bytes and evicted < EVICT_BATCH:
+                row = db.execute("SELECT hash, ext, size FROM blobs ORDER BY last_access LIMIT 1").fetchone()
+                if not row:
+                    break
+                # 删除关键帧时，引用它的增量帧也无法还原，一起删除
+                self._drop_frames(db, db.execute("SELECT id, hash, key_hash FROM frames WHERE hash = ? OR key_hash = ?",
+                                                 (row[0], row[0])).fetchall())
+                self._remove_blob(db, *row)
+                self._remove_unreferenced(db)
+                evicted += 1
+
+    @staticmethod
+    def _drop_frames(db: sqlite3.Connection, rows: List[tuple]) -> None:
+        for frame_id, digest, key_hash in rows:
+            db.execute("DELETE FROM frames WHERE id = ?", (frame_id,))
+            db.execute("UPDATE blobs SET refs = refs - 1 WHERE hash = ?", (digest,))
+            if key_hash:
+                db.execute("UPDATE blobs SET refs = refs - 1 WHERE hash = ?", (key_hash,))
+
+    def _remove_unreferenced(self, db: sqlite3.Connection) -> None:
+        for digest, ext, size in db.execute(
+                "SELECT hash, ext, size FROM blobs WHERE refs <= 0 LIMIT ?", (EVICT_BATCH,)).fetchall():
+            self._remove_blob(db, digest, ext, size)
+
+    def _remove_blob(self, db: sqlite3.Connection, digest: str, ext: str, size: int) -> None:
+        db.execute("DELETE FROM blobs WHERE hash = ?", (digest,))
+        self.total_bytes -= size
+        try:
+            os.remove(self._blob_path(digest, ext))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            self.logger.warning(f"Error removing archived screenshot {digest}: {e}")
+
+    def _frames(self, query: str, params: tuple) -> List[ArchivedFrame]:
+        with self._lock:
+            db = self._open()
+            rows = db.execute(query, params).fetchall()
+            # 被查看的截图（和它的关键帧）更新访问时间，LRU 淘汰时最后才轮到
+            now = self.clock.time()
+            db.executemany("UPDATE blobs SET last_access = ? WHERE hash = ?",
+                           [(now, digest) for row in rows for digest in (row[1], row[4]) if digest])
+            db.commit()
+        return [ArchivedFrame(ts, digest, source, self._blob_path(digest, ext),
+                              self._blob_path(key_hash, key_ext) if key_hash else None)
+                for ts, digest, source, ext, key_hash, key_ext in rows]
+
+    def at(self, timestamp: float) -> Optional[ArchivedFrame]:
+        """时间点之前（含）最近的一张截图"""
+        frames = self._frames(_FRAME_QUERY + "WHERE f.ts <= ? ORDER BY f.ts DESC LIMIT 1", (timestamp,))
+        return frames[0] if frames else None
+
+    def between(self, start: float, end: float, limit: int = 1000) -> List[ArchivedFrame]:
+        return self._frames(_FRAME_QUERY + "WHERE f.ts >= ? AND f.ts < ? ORDER BY f.ts LIMIT ?", (start, end, limit))
+
+    @staticmethod
+    def load(frame: ArchivedFrame) -> Image.Image:
+        """读取存档中的一帧；增量帧用它的关键帧还原"""
+        if not frame.path.endswith(DELTA_EXT):
+            image = Image.open(frame.path)
+            image.load()
+            return image
+        with open(frame.path, 'rb') as f:
+            data = f.read()
+        key = None
+        if frame.key_path:
+            with open(frame.key_path, 'rb') as f:
+                key = f.read()
+        return decode(data, key)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -1,14 +1,28 @@
 from config_manager import ConfigManager
 from usage_tracker import UsageTracker
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Set, Callable
 import os
-import time
+import threading
 # import configparser # 移除，使用 ConfigManager
 import requests
-from PIL import ImageGrab
+from PIL import Image
 import logging
 import socket
 import datetime  # 确保导入 datetime
+import json
+from metrics import REGISTRY
+from capture_backends import ConfiguredCapture
+from monitor_capture import MultiMonitorCapture
+from memory_budget import CycleMemory, MultipartStream, fit_to_budget
+from clock import Clock, SYSTEM_CLOCK
+from system_actions import SystemActions
+from send_scheduler import ACTIVITY_POLL_SECONDS, BANDWIDTH, PACING_KEYS, AdaptiveInterval, pacing_settings
+from screenshot_archive import ScreenshotArchive
+from timelapse import TimelapseRecorder
+from quota import QuotaEngine
+from telegram_commands import TelegramCommandPoller, minutes_arg
+from outbound_queue import FRAME, OUTBOX, STATUS, OutboundQueue
+from connectivity import ConnectivityMonitor, network_down, network_up, pause_while_offline
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
 # 禁用安全请求警告
@@ -26,29 +40,73 @@ class ScreenshotSender:
     proxy: Optional[str]
     interval: int
     proxies: Optional[Dict[str, str]]
+    pacer: AdaptiveInterval
+    commands_enabled: bool
 
-    def __init__(self, config_manager: ConfigManager, usage_tracker: Optional[UsageTracker] = None) -> None:
+    def __init__(self, config_manager: ConfigManager, usage_tracker: Optional[UsageTracker] = None,
+                 capture: Optional[Callable[[], Image.Image]] = None, clock: Clock = SYSTEM_CLOCK,
+                 actions: Optional[SystemActions] = None, archive: Optional[ScreenshotArchive] = None,
+                 timelapse: Optional[TimelapseRecorder] = None, quota: Optional[QuotaEngine] = None,
+                 outbox: Optional[OutboundQueue] = None,
+                 connectivity: Optional[ConnectivityMonitor] = None,
+                 on_frame: Optional[Callable[[Image.Image], None]] = None) -> None:
         self.logger = logging.getLogger("ScreenshotSender")
         self.usage_tracker = usage_tracker
+        # 截图来源，默认按 captureBackend 截取全部显示器；基准测试中替换为合成图像
+        self.capture = capture or ConfiguredCapture(config_manager, all_screens=True)
+        # captureMode = monitors 时按显示器分别截图；注入 capture 时把它当作整个桌面裁剪
+        self.monitors = MultiMonitorCapture(config_manager, full_capture=capture)
+        self.clock = clock
+        self.actions = actions or SystemActions()
+        # 可选的本地截图存档，发送后的截图存入历史再删除临时文件
+        self.archive = archive
+        # 可选的每日延时视频，每张截图缩小后追加一帧
+        self.timelapse = timelapse
+        # 可选的每日额度，/status 中显示剩余时间
+        self.quota = quota
+        # 截图、命令回复和告警都经过本机共用的出站队列，告警和回复优先
+        self.outbox = outbox or OUTBOX
+        # 可选的连通性监视：离线时不截图，恢复联网后立即发送一张
+        self.connectivity = connectivity
+        # 可选：每张截图的回调（局域网接口的缩略图）
+        self.on_frame = on_frame
         self.running = False
 
         self.config_manager = config_manager
 
-        # 从 ConfigManager 获取参数, ensuring types
-        data_folder_setting = self.config_manager.get_setting('Settings', 'dataFolder')
-        self.data_folder = str(data_folder_setting) if data_folder_setting is not None else ".\\default_screenshots"
+        # 配置变更时唤醒等待中的发送循环，让新的间隔立即生效
+        self._wake = threading.Event()
+        # 发送间隔：按计算机名错开发送时刻，可按活动情况自适应调整
+        self.pacer = AdaptiveInterval(int(config_manager.get('screenshotInterval')) * 60, clock=clock,
+                                      away=usage_tracker.is_away if usage_tracker else None)
+        # 远程命令：/shot 请求立即截图，/pause 暂停定时截图到 _paused_until
+        self._shot_requested = threading.Event()
+        self._paused_until = 0.0
+        self.commands = TelegramCommandPoller(clock, outbox=self.outbox, connectivity=connectivity)
+        self.commands.register('shot', self._command_shot, "立即截图")
+        self.commands.register('status', self._command_status, "查看今天的使用情况")
+        self.commands.register('pause', self._command_pause, "暂停定时截图 N 分钟（默认 60）")
+        self.commands.register('resume', self._command_resume, "恢复定时截图")
 
-        bot_token_setting = self.config_manager.get_setting('Settings', 'botToken')
-        self.bot_token = str(bot_token_setting) if bot_token_setting is not None else "YOUR_BOT_TOKEN"
+        self.apply_config()
+        self.config_manager.add_listener(self._on_config_changed)
+        self.outbox.add_alert_channel('telegram', self.send_alert)
 
-        chat_id_setting = self.config_manager.get_setting('Settings', 'chatId')
-        self.chat_id = str(chat_id_setting) if chat_id_setting is not None else "YOUR_CHAT_ID"
-
-        proxy_setting = self.config_manager.get_setting('Settings', 'proxy', fallback='')
-        self.proxy = str(proxy_setting) if proxy_setting else None # Ensure it's None if empty string
-
-        interval_setting = self.config_manager.get_setting('Settings', 'screenshotInterval', type=int, fallback=1)
-        self.interval = int(interval_setting) * 60 if interval_setting is not None else 60 # Ensure int, convert to seconds
+    def apply_config(self) -> None:
+        """从 ConfigManager 读取参数，初始化和配置热加载时都会调用"""
+        self.data_folder = str(self.config_manager.get('dataFolder'))
+        self.bot_token = str(self.config_manager.get('botToken'))
+        self.chat_id = str(self.config_manager.get('chatId'))
+        self.api_url = str(self.config_manager.get('telegramApiUrl')).rstrip('/')
+        self.proxy = str(self.config_manager.get('proxy')) or None # Ensure it's None if empty string
+        self.interval = int(self.config_manager.get('screenshotInterval')) * 60 # convert to seconds
+        self.capture_mode = str(self.config_manager.get('captureMode'))
+        self.capture_max_pixels = int(self.config_manager.get('captureMaxPixels'))
+        self.monitor_threshold = float(self.config_manager.get('monitorChangeThreshold'))
+        self.monitor_max_width = int(self.config_manager.get('monitorMaxWidth'))
+        self.pacer.configure(self.interval, **pacing_settings(self.config_manager))
+        self.commands_enabled = bool(self.config_manager.get('enableCommands'))
+        BANDWIDTH.configure(self.config_manager.get('uploadBudgetKBps') * 1024)
 
         # 配置代理
         if self.proxy:
@@ -58,27 +116,126 @@ class ScreenshotSender:
             self.proxies = None
             self.logger.info("No proxy configured.")
 
+        self.commands.configure(self.api_url, self.bot_token, self.chat_id, self.proxies)
+
         # 确保数据文件夹存在
         os.makedirs(self.data_folder, exist_ok=True)
         self.logger.info(f"Data folder '{self.data_folder}' ensured to exist for screenshots.")
 
+    def _on_config_changed(self, changed: Set[str]) -> None:
+        if changed & ({'dataFolder', 'botToken', 'chatId', 'telegramApiUrl', 'proxy', 'screenshotInterval',
+                       'uploadBudgetKBps', 'captureMode', 'monitorChangeThreshold', 'monitorMaxWidth',
+                       'captureMaxPixels', 'enableCommands'} | PACING_KEYS):
+            self.apply_config()
+            if self.running:
+                self._update_commands()
+            self._wake.set()
+
+    def _update_commands(self) -> None:
+        if self.commands_enabled:
+            self.commands.start()
+        else:
+            self.commands.stop()
+
+    def request_shot(self) -> None:
+        """唤醒发送循环立即截图一次，不影响定时截图的节奏"""
+        self._shot_requested.set()
+        self._wake.set()
+
+    def paused(self) -> bool:
+        return self.clock.time() < self._paused_until
+
+    def _command_shot(self, args: List[str]) -> Optional[str]:
+        self.request_shot()
+        return None
+
+    def _command_pause(self, args: List[str]) -> str:
+        minutes = minutes_arg(args, 60)
+        self._paused_until = self.clock.time() + minutes * 60
+        until = datetime.datetime.fromtimestamp(self._paused_until).strftime('%H:%M')
+        return f"定时截图已暂停 {minutes} 分钟，到 {until} 恢复。/shot 仍可随时截图"
+
+    def _command_resume(self, args: List[str]) -> str:
+        self._paused_until = 0.0
+        self._wake.set()
+        return "定时截图已恢复"
+
+    def _command_status(self, args: List[str]) -> str:
+        lines = []
+        if self.usage_tracker:
+            state = self.usage_tracker.heartbeat_state()
+            lines.append(f"今日累计使用: {self.usage_tracker.format_time(state['daily'])}")
+            lines.append(f"连续使用: {state['continuous'] // 60} 分钟")
+            if state['idle']:
+                lines.append(f"空闲 {state['idle_seconds'] // 60} 分钟")
+            if state['app']:
+                lines.append(f"前台程序: {state['app']}")
+        quota_status = self.quota.status() if self.quota else None
+        if quota_status:
+            lines.append(quota_status)
+        if self.paused():
+            until = datetime.datetime.fromtimestamp(self._paused_until).strftime('%H:%M')
+            lines.append(f"定时截图暂停到 {until}")
+        else:
+            lines.append(f"截图间隔: {round(self.pacer.current() / 60, 1)} 分钟")
+        return '\n'.join(lines)
+
     def take_screenshot(self) -> Optional[str]:
         """截取全屏并保存"""
         try:
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            timestamp = self.clock.now().strftime("%Y%m%d_%H%M%S")
             filename = os.path.join(self.data_folder, f"screenshot_{timestamp}.png")
 
             # 兼容多显示器
-            screenshot = ImageGrab.grab(all_screens=True)
-            screenshot.save(filename)
-            self.logger.info(f"Screenshot saved to {filename}")
+            with REGISTRY.stage('telegram', 'grab'):
+                # 超过 captureMaxPixels 的截图在复制全尺寸图像之前就缩小
+                grab_scaled = getattr(self.capture, 'grab_scaled', None)
+                if grab_scaled:
+                    screenshot = grab_scaled(self.capture_max_pixels)
+                else:
+                    screenshot = fit_to_budget(self.capture(), self.capture_max_pixels)
+            self.pacer.observe_frame(screenshot)
+            if self.timelapse:
+                self.timelapse.add_image(screenshot)
+            if self.on_frame:
+                self.on_frame(screenshot)
+            with REGISTRY.stage('telegram', 'save') as stage:
+                screenshot.save(filename)
+                stage.bytes = os.path.getsize(filename)
+            self.logger.debug("Screenshot saved to %s", filename)
             return filename
         except Exception as e:
             self.logger.error(f"Error taking screenshot: {str(e)}")
             return None
 
+    def _caption(self, usage_time_seconds: float) -> str:
+        ip_address = "Unknown IP"
+        try:
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.connect(("8.8.8.8", 80))
+            ip_address = s.getsockname()[0]
+        except Exception:
+            ip_address = "127.0.0.1"
+        finally:
+            s.close()
+
+        current_time = self.clock.now().strftime("%Y-%m-%d %H:%M:%S")
+        usage_time_formatted = self.usage_tracker.format_time(usage_time_seconds) if self.usage_tracker else "N/A"
+
+        caption = (
+            f"IP地址: {ip_address}\n"
+            f"截图时间: {current_time}\n"
+            f"今日累计使用: {usage_time_formatted}"
+        )
+        if self.config_manager.profile:
+            caption += f"\n用户: {self.config_manager.profile}"
+        return caption
+
+    @REGISTRY.timed('telegram', 'cycle')
     def send_screenshot(self, usage_time_seconds: float) -> bool:
         """发送截图到 Telegram"""
+        if self.capture_mode == 'monitors':
+            return self.send_monitors(usage_time_seconds)
         filepath = self.take_screenshot()
         if not filepath:
             return False
@@ -88,46 +245,35 @@ class ScreenshotSender:
             return False
 
         try:
-            url = f"https://api.telegram.org/bot{self.bot_token}/sendPhoto"
-
-            ip_address = "Unknown IP"
-            try:
-                s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                s.connect(("8.8.8.8", 80))
-                ip_address = s.getsockname()[0]
-            except Exception:
-                ip_address = "127.0.0.1"
-            finally:
-                s.close()
-
-            current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            usage_time_formatted = self.usage_tracker.format_time(usage_time_seconds) if self.usage_tracker else "N/A"
-
-            caption = (
-                f"IP地址: {ip_address}\n"
-                f"截图时间: {current_time}\n"
-                f"今日累计使用: {usage_time_formatted}"
-            )
-
-            with open(filepath, 'rb') as photo:
-                files = {'photo': photo}
-                data = {'chat_id': self.chat_id, 'caption': caption}
+            url = f"{self.api_url}/bot{self.bot_token}/sendPhoto"
+
+            caption = self._caption(usage_time_seconds)
+
+            # 请求体从文件流式读取，每次重试重新从头读
+            body = MultipartStream({'chat_id': self.chat_id, 'caption': caption}, 'photo',
+                                   os.path.basename(filepath), path=filepath, content_type='image/png')
+            with REGISTRY.stage('telegram', 'send_photo') as stage:
+                stage.bytes = os.path.getsize(filepath)
 
                 for attempt in range(3):
                     try:
-                        response = requests.post(url, files=files, data=data,
+                        BANDWIDTH.acquire(stage.bytes, 'telegram')
+                        response = requests.post(url, data=body, headers={'Content-Type': body.content_type},
                                                  proxies=self.proxies, verify=False, timeout=60)
                         response.raise_for_status()
+                        network_up(self.connectivity)
                         self.logger.info("Photo sent successfully")
                         if self.usage_tracker:
                             self.usage_tracker.save_usage_stats()
-                            self.logger.info("Usage stats saved after sending screenshot")
+                            self.logger.debug("Usage stats saved after sending screenshot")
                         break
                     except requests.exceptions.RequestException as e:
                         self.logger.warning(f"Send attempt {attempt + 1} failed: {str(e)}")
-                        if attempt == 2:
+                        if attempt == 2 or network_down(self.connectivity, e):
                             self.logger.error("Max retries reached, giving up on sending screenshot")
+                            stage.fail()
                             return False
+                        stage.retries += 1
                 else:
                     return False
 
@@ -136,29 +282,194 @@ class ScreenshotSender:
             return False
         finally:
             if os.path.exists(filepath):
+                if self.archive:
+                    self.archive.add_file(filepath, 'telegram')
                 try:
                     os.remove(filepath)
-                    self.logger.info(f"Screenshot file {filepath} deleted.")
+                    self.logger.debug("Screenshot file %s deleted.", filepath)
                 except Exception as e:
                     self.logger.error(f"Error deleting screenshot file {filepath}: {e}")
         return True
 
+    def send_monitors(self, usage_time_seconds: float) -> bool:
+        """按显示器截图，只把画面变化的显示器作为一个相册发送"""
+        try:
+            frames = self.monitors.capture(self.monitor_threshold, self.monitor_max_width)
+        except Exception as e:
+            self.logger.error(f"Error capturing monitors: {e}")
+            return False
+        if not frames:
+            self.logger.warning("No monitors selected or captured, skipping")
+            return False
+        primary = next((f for f in frames if f.monitor.primary), frames[0])
+        self.pacer.observe_frame(primary.image)
+        if self.timelapse:
+            self.timelapse.add_image(primary.image)
+        if self.on_frame:
+            self.on_frame(primary.image)
+        changed = [f for f in frames if f.changed]
+        if not changed:
+            self.logger.debug("No monitor changed since the last send, skipping")
+            return True
+        if self.archive:
+            for frame in changed:
+                # archiveDelta 开启时每个显示器各有一条关键帧链
+                if self.archive.delta:
+                    self.archive.add_image(frame.image, f'telegram#{frame.monitor.index}')
+                else:
+                    self.archive.add(frame.jpeg, '.jpg', f'telegram#{frame.monitor.index}')
+
+        caption = self._caption(usage_time_seconds)
+        if len(frames) > 1:
+            caption += f"\n显示器: {', '.join(f'#{f.monitor.index}' for f in changed)} (共 {len(frames)} 个)"
+        base = f"{self.api_url}/bot{self.bot_token}"
+        if len(changed) == 1:
+            url = f"{base}/sendPhoto"
+            data = {'chat_id': self.chat_id, 'caption': caption}
+            files = {'photo': ('monitor.jpg', changed[0].jpeg, 'image/jpeg')}
+        else:
+            # Telegram 相册最多 10 张，标题写在第一张上
+            changed = changed[:10]
+            url = f"{base}/sendMediaGroup"
+            media = [{'type': 'photo', 'media': f'attach://m{f.monitor.index}'} for f in changed]
+            media[0]['caption'] = caption
+            data = {'chat_id': self.chat_id, 'media': json.dumps(media)}
+            files = {f'm{f.monitor.index}': (f'monitor{f.monitor.index}.jpg', f.jpeg, 'image/jpeg') for f in changed}
+
+        with REGISTRY.stage('telegram', 'send_album') as stage:
+            stage.bytes = sum(len(f.jpeg) for f in changed)
+            for attempt in range(3):
+                try:
+                    BANDWIDTH.acquire(stage.bytes, 'telegram')
+                    response = requests.post(url, files=files, data=data, proxies=self.proxies, verify=False,
+                                             timeout=60)
+                    response.raise_for_status()
+                    network_up(self.connectivity)
+                    self.logger.info(f"Sent {len(changed)} of {len(frames)} monitor(s)")
+                    if self.usage_tracker:
+                        self.usage_tracker.save_usage_stats()
+                    return True
+                except requests.exceptions.RequestException as e:
+                    self.logger.warning(f"Send attempt {attempt + 1} failed: {str(e)}")
+                    if network_down(self.connectivity, e):
+                        break
+                    stage.retries += 1
+            self.logger.error("Max retries reached, giving up on sending monitors")
+            stage.fail()
+        return False
+
+    def send_alert(self, text: str) -> bool:
+        """告警渠道：发送一条文字消息；Telegram 发送关闭时不发送"""
+        if not self.config_manager.get('enableTelegram'):
+            return False
+        try:
+            with REGISTRY.stage('telegram', 'send_alert'):
+                response = requests.post(f"{self.api_url}/bot{self.bot_token}/sendMessage",
+                                         json={'chat_id': self.chat_id, 'text': text},
+                                         proxies=self.proxies, verify=False, timeout=30)
+                response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            self.logger.error(f"Error sending alert: {e}")
+            return False
+        self.logger.info("Alert sent")
+        return True
+
+    def send_image(self, data: bytes, filename: str, caption: str) -> bool:
+        """把内存中的图片（例如每日使用报告）作为一条照片消息发送到 Telegram"""
+        try:
+            with REGISTRY.stage('telegram', 'send_image') as stage:
+                stage.bytes = len(data)
+                BANDWIDTH.acquire(stage.bytes, 'telegram')
+                response = requests.post(f"{self.api_url}/bot{self.bot_token}/sendPhoto",
+                                         data={'chat_id': self.chat_id, 'caption': caption},
+                                         files={'photo': (filename, data, 'image/png')},
+                                         proxies=self.proxies, verify=False, timeout=60)
+                response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            self.logger.error(f"Error sending image {filename}: {e}")
+            return False
+        self.logger.info(f"Image {filename} sent successfully")
+        return True
+
+    def send_document(self, filepath: str, caption: str) -> bool:
+        """把文件（例如每日延时视频）作为一条消息发送到 Telegram"""
+        url = f"{self.api_url}/bot{self.bot_token}/sendDocument"
+        try:
+            with REGISTRY.stage('telegram', 'send_document') as stage:
+                body = MultipartStream({'chat_id': self.chat_id, 'caption': caption}, 'document',
+                                       os.path.basename(filepath), path=filepath)
+                stage.bytes = os.path.getsize(filepath)
+                BANDWIDTH.acquire(stage.bytes, 'telegram')
+                response = requests.post(url, data=body, headers={'Content-Type': body.content_type},
+                                         proxies=self.proxies, verify=False, timeout=300)
+                response.raise_for_status()
+        except (OSError, requests.exceptions.RequestException) as e:
+            self.logger.error(f"Error sending document {filepath}: {e}")
+            return False
+        self.logger.info(f"Document {os.path.basename(filepath)} sent successfully")
+        return True
+
     def run(self) -> None:
         """线程运行方法，持续发送截图"""
         self.running = True
         self.logger.info("ScreenshotSender thread started.")
+        self._update_commands()
         try:
+            # 第一次发送也等到本机的时间槽，开机时间相同的电脑不会同时上传
+            cycle_start = self.clock.time()
+            self._wait_next_cycle(cycle_start)
             while self.running:
+                # 离线时暂停；恢复联网后不等下一个时间槽，立即截图一次
+                pause_while_offline(self.connectivity, lambda: self.running)
+                if not self.running:
+                    break
+                on_demand = self._shot_requested.is_set()
+                self._shot_requested.clear()
+                if not on_demand:
+                    cycle_start = self.clock.time()
+                    if self.paused():
+                        self._wait_next_cycle(cycle_start)
+                        continue
                 usage_time = self.usage_tracker.get_usage_time() if self.usage_tracker else 0
-                self.send_screenshot(usage_time)
-                time.sleep(self.interval)
+                uploaded_before = BANDWIDTH.used_today()[0]
+                with CycleMemory('telegram'):
+                    # 按需截图和命令回复同一优先级；例行截图排在最后，新的一张替换还没发出的上一张
+                    ok = self.outbox.send(STATUS if on_demand else FRAME, lambda: self.send_screenshot(usage_time),
+                                          'telegram screenshot', key='telegram-shot' if on_demand else 'telegram-frame')
+                uploaded = max(0, BANDWIDTH.used_today()[0] - uploaded_before)
+                if on_demand:
+                    # 按需截图不改变定时截图的间隔
+                    self.actions.record('send', sender='telegram', ok=ok, on_demand=True)
+                else:
+                    interval = self.pacer.finish_cycle(uploaded)
+                    self.actions.record('send', sender='telegram', ok=ok, interval=interval)
+                self._wait_next_cycle(cycle_start)
         except Exception as e:
             self.logger.critical(f"ScreenshotSender thread encountered a critical error: {e}", exc_info=True)
         finally:
             self.running = False
+            self.commands.stop()
             self.logger.info("ScreenshotSender thread fully exited.")
 
+    def next_delay(self, cycle_start: float) -> float:
+        """距离下一次截图还有多少秒；运行循环和模拟器共用"""
+        return self.pacer.next_send(cycle_start) - self.clock.time()
+
+    def _wait_next_cycle(self, cycle_start: float) -> None:
+        """等待到下一次截图；配置变化时按新的间隔重新计算截止时间"""
+        while self.running and not self._shot_requested.is_set():
+            remaining = self.next_delay(cycle_start)
+            if remaining <= 0:
+                return
+            # 退避期间定期检查用户是否回来，回来后按基准间隔重新计算
+            if self.pacer.backed_off():
+                remaining = min(remaining, ACTIVITY_POLL_SECONDS)
+            self.clock.wait(self._wake, remaining)
+            self._wake.clear()
+
     def stop(self) -> None:
         """停止截图发送线程"""
         self.running = False
+        self.commands.stop()
+        self._wake.set()
         self.logger.info("ScreenshotSender stopping.")
\ No newline at end of file
@@ -0,0 +1,240 @@
+"""
+发送调度：把各台电脑的发送时间错开，并限制本机所有发送器共用的上传带宽。
+
+- 相位偏移：发送时刻对齐到 k * interval + phase，phase 由计算机名哈希得到，
+  同一台电脑每次启动都相同，不同电脑均匀分布在整个间隔内；
+- 抖动：在对齐的时刻之后再加 [0, jitter] 秒的随机延迟，jitter 不超过间隔的四分之一；
+- 带宽预算：令牌桶，各发送器上传前按字节数申请，超出预算时等待；同时累计当天的上传量；
+- 自适应间隔：画面变化大时缩短截图间隔，空闲或锁屏时按指数退避，并按当天剩余的上传额度放慢。
+"""
+import datetime
+import hashlib
+import logging
+import math
+import platform
+import random
+import threading
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from PIL import Image, ImageChops, ImageStat
+
+from clock import Clock, SYSTEM_CLOCK
+from config_manager import ConfigManager
+from metrics import REGISTRY
+
+# 画面变化检测用的缩略图大小，与按显示器截图的变化检测一致
+CHANGE_THUMBNAIL = (64, 36)
+# 退避状态下多久检查一次用户是否回来（秒）
+ACTIVITY_POLL_SECONDS = 30
+# 每次发送上传量的指数平均系数
+UPLOAD_SMOOTHING = 0.3
+# 影响自适应间隔的配置项
+PACING_KEYS = {'adaptiveInterval', 'adaptiveMinSeconds', 'adaptiveMaxSeconds', 'adaptiveChangePercent',
+               'dailyUploadMB', 'sendJitterSeconds', 'sendPhaseAlign'}
+
+
+def host_phase(interval: float, host: Optional[str] = None) -> float:
+    """由计算机名得到 [0, interval) 内确定的相位偏移"""
+    if interval <= 0:
+        return 0.0
+    digest = hashlib.sha256((host if host is not None else platform.node()).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') / 2 ** 64 * interval
+
+
+class SendSchedule:
+    """计算下一次发送的时刻；同一个 after 多次查询返回同一结果，方便等待循环反复计算剩余时间"""
+
+    def __init__(self, interval: float, jitter: float = 0.0, align: bool = True, host: Optional[str] = None,
+                 rng: Optional[random.Random] = None) -> None:
+        self.interval = interval
+        self.jitter = max(0.0, min(jitter, interval / 4))
+        self.align = align
+        self.phase = host_phase(interval, host) if align else 0.0
+        self.rng = rng or random.Random()
+        self._memo: Optional[Tuple[float, float]] = None
+
+    def next_send(self, after: float) -> float:
+        if self.interval <= 0:
+            return after
+        if self._memo and self._memo[0] == after:
+            return self._memo[1]
+        if self.align:
+            slot = (math.floor((after - self.phase) / self.interval) + 1) * self.interval + self.phase
+        else:
+            slot = after + self.interval
+        target = slot + (self.rng.uniform(0, self.jitter) if self.jitter else 0.0)
+        self._memo = (after, target)
+        return target
+
+
+class BandwidthBudget:
+    """
+    本机所有发送器共用的上传令牌桶（字节/秒）。rate 为 0 表示不限速。
+    acquire 先预留再等待，令牌可以透支，多个发送器并发申请时按先后顺序排队。
+    """
+    logger: logging.Logger
+
+    def __init__(self, rate: float = 0.0, clock: Clock = SYSTEM_CLOCK) -> None:
+        self.logger = logging.getLogger("SendScheduler")
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.rate = 0.0
+        self._tokens = 0.0
+        self._updated = clock.time()
+        self._day = clock.today()
+        self._used_today = 0
+        self._senders_today: Set[str] = set()
+        self.configure(rate)
+
+    def configure(self, rate: float) -> None:
+        with self._lock:
+            if rate == self.rate:
+                return
+            self.rate = float(rate)
+            # 最多积攒一秒的额度，空闲之后也不会瞬间占满上行
+            self._tokens = self.rate
+            self._updated = self.clock.time()
+        if rate:
+            self.logger.info(f"Upload budget set to {rate / 1024:.0f} KB/s")
+
+    def acquire(self, size: int, sender: str = '') -> float:
+        """申请 size 字节的额度，返回等待的秒数"""
+        with self._lock:
+            self._count_today(size, sender)
+            if self.rate <= 0:
+                return 0.0
+            now = self.clock.time()
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= size
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            REGISTRY.observe_duration(wait, sender=sender, stage='throttle')
+            self.clock.sleep(wait)
+        return wait
+
+    def _count_today(self, size: int, sender: str) -> None:
+        today = self.clock.today()
+        if today != self._day:
+            self._day, self._used_today = today, 0
+            self._senders_today = set()
+        self._used_today += size
+        if sender:
+            self._senders_today.add(sender)
+
+    def used_today(self) -> Tuple[int, int]:
+        """(今天已上传的字节数, 今天上传过的发送器数量)"""
+        with self._lock:
+            self._count_today(0, '')
+            return self._used_today, len(self._senders_today)
+
+
+class AdaptiveInterval:
+    """
+    按活动情况调整截图间隔，在 [minimum, maximum] 之间变化：
+    - 上一张截图与前一张相比变化达到 change_percent：间隔减半；
+    - 用户离开（键鼠空闲超过阈值或锁屏）：间隔加倍，直到 maximum；用户回来后立即恢复 base；
+    - 其他情况回到 base。
+    daily_budget（字节）不为 0 时，按今天剩余的额度、剩余的时间和各发送器的平均上传量计算间隔下限，
+    额度用完后按最长间隔发送。enabled 为 False 时间隔固定为 base，只受每日额度约束。
+    发送时刻仍按 SendSchedule 对齐和抖动。
+    """
+
+    def __init__(self, base: float, away: Optional[Callable[[], bool]] = None, clock: Clock = SYSTEM_CLOCK,
+                 budget: Optional[BandwidthBudget] = None, **settings: Any) -> None:
+        self.away = away or (lambda: False)
+        self.clock = clock
+        self.budget = budget or BANDWIDTH
+        self.interval = base
+        self.last_change = 0.0
+        self.average_upload = 0.0
+        self._thumbnail: Optional[Image.Image] = None
+        self._schedules: Dict[int, SendSchedule] = {}
+        self.configure(base, **settings)
+
+    def configure(self, base: float, minimum: float = 0.0, maximum: float = 0.0, change_percent: float = 2.0,
+                  daily_budget: int = 0, enabled: bool = False, jitter: float = 0.0, align: bool = True) -> None:
+        """配置热加载时调用；当前的间隔和统计保留，只限制到新的范围内"""
+        self.base = base
+        self.minimum = min(minimum, base) if minimum > 0 else base
+        self.maximum = max(maximum, base)
+        self.change_percent = change_percent
+        self.daily_budget = daily_budget
+        self.enabled = enabled
+        self.jitter = jitter
+        self.align = align
+        self.interval = min(max(self.interval, self.minimum), self.maximum) if enabled else base
+        self._schedules = {}
+
+    def observe_frame(self, image: Image.Image) -> float:
+        """记录一张截图，返回它与上一张相比的变化（缩略图平均差异，占 255 的百分比）"""
+        thumbnail = image.resize(CHANGE_THUMBNAIL, Image.BOX).convert('L')
+        if self._thumbnail is not None:
+            self.last_change = ImageStat.Stat(ImageChops.difference(self._thumbnail, thumbnail)).mean[0] * 100 / 255
+        self._thumbnail = thumbnail
+        return self.last_change
+
+    def finish_cycle(self, uploaded: int) -> float:
+        """一次发送结束后调用，uploaded 为本次上传的字节数；返回新的间隔"""
+        if uploaded > 0:
+            self.average_upload = uploaded if not self.average_upload else \
+                self.average_upload + UPLOAD_SMOOTHING * (uploaded - self.average_upload)
+        if not self.enabled:
+            self.interval = self.base
+        elif self.away():
+            self.interval = min(self.maximum, self.interval * 2)
+        elif self.last_change >= self.change_percent:
+            self.interval = max(self.minimum, self.interval / 2)
+        else:
+            self.interval = self.base
+        return self.interval
+
+    def budget_floor(self) -> float:
+        """按每日上传额度允许的最短间隔（秒），没有额度限制时为 0"""
+        if self.daily_budget <= 0 or not self.average_upload:
+            return 0.0
+        used, senders = self.budget.used_today()
+        remaining = self.daily_budget - used
+        if remaining <= 0:
+            return self.maximum
+        now = self.clock.now()
+        midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time())
+        seconds_left = (midnight - now).total_seconds()
+        # 剩余额度按今天上传过的发送器平分
+        return self.average_upload * max(1, senders) * seconds_left / remaining
+
+    def current(self) -> float:
+        interval = self.interval
+        if interval > self.base and not self.away():
+            interval = self.base
+        return max(interval, min(self.budget_floor(), self.maximum))
+
+    def next_send(self, after: float) -> float:
+        interval = round(self.current())
+        schedule = self._schedules.get(interval)
+        if schedule is None:
+            if len(self._schedules) > 8:
+                self._schedules.clear()
+            schedule = self._schedules[interval] = SendSchedule(interval, self.jitter, align=self.align)
+        return schedule.next_send(after)
+
+    def backed_off(self) -> bool:
+        """当前处于退避状态，等待时需要定期检查用户是否回来"""
+        return self.interval > self.base
+
+
+def pacing_settings(config_manager: ConfigManager) -> Dict[str, Any]:
+    """AdaptiveInterval.configure 的参数（base 除外），两个发送器共用"""
+    return {
+        'minimum': float(config_manager.get('adaptiveMinSeconds')),
+        'maximum': float(config_manager.get('adaptiveMaxSeconds')),
+        'change_percent': float(config_manager.get('adaptiveChangePercent')),
+        'daily_budget': int(config_manager.get('dailyUploadMB')) * 1024 * 1024,
+        'enabled': bool(config_manager.get('adaptiveInterval')),
+        'jitter': float(config_manager.get('sendJitterSeconds')),
+        'align': bool(config_manager.get('sendPhaseAlign')),
+    }
+
+
+# 本机共用的带宽预算，由各发送器的 apply_config 按 uploadBudgetKBps 设置
+BANDWIDTH = BandwidthBudget()
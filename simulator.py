@@ -0,0 +1,251 @@
+"""
+虚拟时钟模拟器：用 VirtualClock 驱动 UsageTracker、RestReminder 和发送器，
+几秒内跑完一天或一周的开关机、提醒、强制休息、关机和发送决策，用于回归测试作息配置和测量调度开销。
+
+示例:
+    python simulator.py --days 7 --start 2026-10-19 --weekday 16:00-23:30 --weekend 09:00-23:30
+    python simulator.py --config config.ini --days 1 --timeline
+"""
+import argparse
+import datetime
+import heapq
+import logging
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from clock import VirtualClock
+from config_manager import ConfigManager
+from dingtalk_sender import DingTalkSender
+from quota import QuotaEngine
+from calendar_rules import ScheduleCalendar
+from rest_reminder import RestReminder
+from screenshot_sender import ScreenshotSender
+from system_actions import RecordingActions
+from usage_tracker import UsageTracker
+
+Session = Tuple[datetime.time, datetime.time]
+
+
+def parse_session(text: str) -> Session:
+    """解析 "16:00-23:30" 形式的开机时段"""
+    start, _, end = text.partition('-')
+    return (datetime.datetime.strptime(start.strip(), '%H:%M').time(),
+            datetime.datetime.strptime(end.strip(), '%H:%M').time())
+
+
+class ActivityModel:
+    """每天的开机时段：工作日和周末各一个，到点开机，到点（或被强制关机时）关机"""
+
+    def __init__(self, weekday: Session, weekend: Session) -> None:
+        self.weekday = weekday
+        self.weekend = weekend
+
+    def session_for(self, day: datetime.date) -> Tuple[datetime.datetime, datetime.datetime]:
+        start, end = self.weekend if day.weekday() >= 5 else self.weekday
+        return datetime.datetime.combine(day, start), datetime.datetime.combine(day, end)
+
+
+class Simulator:
+    """
+    离散事件模拟器。所有组件共用一个 VirtualClock 和 RecordingActions；
+    RestReminder 以无窗口模式运行，模拟器负责模拟窗口打开/关闭和关机断电。
+    """
+
+    def __init__(self, config_manager: ConfigManager, start: datetime.date, days: int, activity: ActivityModel,
+                 tick_seconds: float = 1.0, acknowledge_seconds: float = 30.0) -> None:
+        self.logger = logging.getLogger("Simulator")
+        self.config_manager = config_manager
+        self.start = start
+        self.days = days
+        self.activity = activity
+        self.tick_seconds = tick_seconds
+        self.acknowledge_seconds = acknowledge_seconds
+
+        self.clock = VirtualClock(datetime.datetime.combine(start, datetime.time(0, 0)))
+        self.actions = RecordingActions(self.clock, on_event=self._on_action)
+        self.tracker = UsageTracker(config_manager, clock=self.clock)
+        self.calendar = ScheduleCalendar(config_manager, clock=self.clock)
+        self.quota = QuotaEngine(config_manager, self.tracker, clock=self.clock, actions=self.actions,
+                                 calendar=self.calendar)
+        self.reminder = RestReminder(None, config_manager, usage_tracker=self.tracker, clock=self.clock,
+                                     actions=self.actions, quota=self.quota, calendar=self.calendar)
+        self.quota.on_warning = self.reminder.quota_warning
+        self.quota.on_exhausted = self.reminder.quota_exhausted
+        self.senders: Dict[str, Any] = {
+            'telegram': ScreenshotSender(config_manager, usage_tracker=self.tracker, capture=lambda: None,
+                                         clock=self.clock, actions=self.actions),
+        }
+        if config_manager.get('enableDingTalk'):
+            self.senders['dingtalk'] = DingTalkSender(config_manager, usage_tracker=self.tracker,
+                                                      capture=lambda: None, clock=self.clock, actions=self.actions)
+
+        self._queue: List[Tuple[float, int, int, Callable[[], None]]] = []
+        self._seq = 0
+        # 每次开机加一，关机前排入队列的事件在之后被忽略
+        self._generation = 0
+        self.powered = False
+        self.events_processed = 0
+
+    def _schedule(self, at: float, callback: Callable[[], None], any_generation: bool = False) -> None:
+        self._seq += 1
+        heapq.heappush(self._queue, (at, self._seq, -1 if any_generation else self._generation, callback))
+
+    # --- 开关机 ---
+
+    def _power_on(self) -> None:
+        self._generation += 1
+        self.powered = True
+        self.tracker.load_usage_stats()
+        self.reminder.shutdown_scheduled = False
+        self.reminder.window_open = False
+        self.actions.record('power_on')
+        now = self.clock.time()
+        self._schedule(now + self.tick_seconds, self._tracker_tick)
+        self._schedule(now, self._reminder_tick)
+        for name in self.senders:
+            self._schedule(now, lambda name=name: self._send(name))
+
+    def _power_off(self, reason: str) -> None:
+        if not self.powered:
+            return
+        self.tracker.update_usage_time()
+        self.tracker.save_usage_stats()
+        self.powered = False
+        self._generation += 1
+        self.actions.record('power_off', reason=reason, usage=self.tracker.get_usage_time())
+
+    # --- 周期任务 ---
+
+    def _tracker_tick(self) -> None:
+        self.tracker.update_usage_time()
+        self._schedule(self.clock.time() + self.tick_seconds, self._tracker_tick)
+
+    def _reminder_tick(self) -> None:
+        if self.reminder.tick():
+            self._schedule(self.clock.time() + self.reminder.reminder_interval_seconds, self._reminder_tick)
+
+    def _send(self, name: str) -> None:
+        sender = self.senders[name]
+        now = self.clock.time()
+        self.actions.record('send', sender=name, usage=self.tracker.get_usage_time())
+        self._schedule(now + max(1.0, sender.next_delay(now)), lambda: self._send(name))
+
+    # --- 模拟用户对窗口和关机的反应 ---
+
+    def _on_action(self, event: str, details: Dict[str, Any]) -> None:
+        now = self.clock.time()
+        if event == 'forced_rest':
+            self.reminder.window_open = True
+            self._schedule(now + details['duration'], self._end_forced_rest)
+        elif event == 'reminder':
+            self.reminder.window_open = True
+            self._schedule(now + self.acknowledge_seconds, self._close_window)
+        elif event == 'shutdown_warning':
+            self.reminder.window_open = True
+        elif event == 'shutdown_scheduled':
+            self._schedule(now + details['delay'], lambda: self._power_off('scheduled_shutdown'))
+        elif event == 'shutdown':
+            self._schedule(now, lambda: self._power_off('forced_shutdown'))
+
+    def _end_forced_rest(self) -> None:
+        self.reminder.window_open = False
+        self.tracker.reset_continuous_usage_time()
+        self.actions.record('forced_rest_end')
+
+    def _close_window(self) -> None:
+        self.reminder.window_open = False
+
+    # --- 主循环 ---
+
+    def run(self) -> Dict[str, Any]:
+        for offset in range(self.days):
+            day = self.start + datetime.timedelta(days=offset)
+            session_start, session_end = self.activity.session_for(day)
+            self._schedule(session_start.timestamp(), self._power_on, any_generation=True)
+            self._schedule(session_end.timestamp(), lambda: self._power_off('user'), any_generation=True)
+
+        wall_start = time.perf_counter()
+        while self._queue:
+            at, _, generation, callback = heapq.heappop(self._queue)
+            if generation != -1 and generation != self._generation:
+                continue
+            if generation == -1 and callback == self._power_on and self.powered:
+                continue
+            self.clock.set(max(at, self.clock.time()))
+            callback()
+            self.events_processed += 1
+        wall = time.perf_counter() - wall_start
+
+        return {
+            'events': self.actions.events,
+            'events_processed': self.events_processed,
+            'wall_seconds': wall,
+            'simulated_seconds': self.days * 86400,
+        }
+
+    def daily_summary(self) -> List[Dict[str, Any]]:
+        summary: Dict[datetime.date, Dict[str, Any]] = {}
+        for timestamp, event, details in self.actions.events:
+            day = datetime.datetime.fromtimestamp(timestamp).date()
+            row = summary.setdefault(day, {'date': day.isoformat(), 'usage': 0.0})
+            row[event] = row.get(event, 0) + 1
+            if event == 'power_off':
+                row['usage'] = details['usage']
+                row['off_at'] = datetime.datetime.fromtimestamp(timestamp).strftime('%H:%M')
+                row['off_reason'] = details['reason']
+        return [summary[day] for day in sorted(summary)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="KidPC 作息与提醒调度模拟器")
+    parser.add_argument('--config', default=ConfigManager.CONFIG_FILE, help="读取的配置文件（不会被修改）")
+    parser.add_argument('--start', default=datetime.date.today().isoformat(), help="起始日期 YYYY-MM-DD")
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--weekday', default='16:00-23:30', help="工作日开机时段")
+    parser.add_argument('--weekend', default='09:00-23:30', help="周末开机时段")
+    parser.add_argument('--tick', type=float, default=1.0, help="UsageTracker 更新间隔（秒）")
+    parser.add_argument('--timeline', action='store_true', help="输出所有决策事件（不含发送）")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+
+    workdir = tempfile.mkdtemp(prefix='kidpc-sim-')
+    try:
+        config_file = os.path.join(workdir, 'config.ini')
+        if os.path.exists(args.config):
+            shutil.copy(args.config, config_file)
+        config = ConfigManager(config_file)
+        # 统计文件和截图目录放在临时目录，不影响真实数据
+        config.set_setting('Settings', 'usageStatsFile', os.path.join(workdir, 'usage_stats.json'))
+        config.set_setting('Settings', 'dataFolder', os.path.join(workdir, 'data'))
+
+        simulator = Simulator(config, datetime.date.fromisoformat(args.start), args.days,
+                              ActivityModel(parse_session(args.weekday), parse_session(args.weekend)),
+                              tick_seconds=args.tick)
+        result = simulator.run()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.timeline:
+        for timestamp, event, details in result['events']:
+            if event != 'send':
+                when = datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+                print(f"{when}  {event:<20} {details if details else ''}")
+        print()
+
+    print(f"{'date':<12}{'usage':>10}{'reminders':>11}{'forced rest':>13}{'shutdown':>10}{'sends':>7}  power off")
+    for row in simulator.daily_summary():
+        usage = simulator.tracker.format_time(row['usage'])
+        shutdowns = row.get('shutdown_scheduled', 0) + row.get('shutdown', 0)
+        print(f"{row['date']:<12}{usage:>10}{row.get('reminder', 0):>11}{row.get('forced_rest', 0):>13}"
+              f"{shutdowns:>10}{row.get('send', 0):>7}  {row.get('off_at', '-')} ({row.get('off_reason', '-')})")
+    per_event = result['wall_seconds'] / max(1, result['events_processed']) * 1e6
+    print(f"\n{result['events_processed']} events, {result['simulated_seconds'] / 86400:.0f} simulated days "
+          f"in {result['wall_seconds']:.2f}s ({per_event:.1f} µs/event)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+"""
+本地 HTTP 替身服务：模拟 Telegram Bot API、钉钉机器人 Webhook 和 ImgBB 上传接口。
+用于离线基准测试，可以配置延迟、带宽、失败率和限流。
+Telegram 部分还支持 getUpdates 长轮询：push_update() 模拟聊天中收到的消息，sendMessage 的内容记录在 messages 中。
+"""
+import json
+import logging
+import random
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+
+@dataclass
+class NetworkProfile:
+    """替身服务的网络条件"""
+    latency: float = 0.0  # 每个请求的固定延迟（秒）
+    bandwidth_kbps: float = 0.0  # 上行带宽（千比特/秒），0 表示不限速
+    failure_rate: float = 0.0  # 返回 HTTP 500 的概率
+    throttle_rate: float = 0.0  # 返回限流响应（Telegram 429 / 钉钉 errcode）的概率
+    retry_after: int = 1  # Telegram 429 响应中的 retry_after（秒）
+    seed: Optional[int] = None
+
+
+@dataclass
+class RequestLog:
+    """替身服务收到的一次请求"""
+    service: str
+    method: str
+    status: str
+    bytes_received: int
+    timestamp: float = field(default_factory=time.time)
+
+
+class StandInServer:
+    """
+    单个端口上同时提供三类接口的替身服务：
+      POST /bot<token>/sendPhoto, /bot<token>/sendMediaGroup   (Telegram)
+      POST /bot<token>/getUpdates                               (Telegram 长轮询)
+      POST /robot/send                                          (钉钉 Webhook)
+      POST /1/upload                                            (ImgBB)
+    """
+    # 钉钉机器人每分钟最多 20 条消息，超出返回 errcode 130101
+    DINGTALK_LIMIT_PER_MINUTE = 20
+
+    def __init__(self, profile: Optional[NetworkProfile] = None, host: str = '127.0.0.1', port: int = 0,
+                 dingtalk_limit_per_minute: int = DINGTALK_LIMIT_PER_MINUTE) -> None:
+        self.logger = logging.getLogger("StandInServer")
+        self.profile = profile or NetworkProfile()
+        self.random = random.Random(self.profile.seed)
+        self.dingtalk_limit_per_minute = dingtalk_limit_per_minute
+        self.requests: List[RequestLog] = []
+        self._dingtalk_window: Deque[float] = deque()
+        self._lock = threading.Lock()
+        self.messages: List[Dict[str, Any]] = []
+        self._updates: List[Dict[str, Any]] = []
+        self._next_update_id = 1
+        self._updates_changed = threading.Condition(self._lock)
+        self._thread: Optional[threading.Thread] = None
+
+        handler = type('StandInHandler', (_StandInHandler,), {'server_state': self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def telegram_api_url(self) -> str:
+        return self.base_url
+
+    @property
+    def dingtalk_webhook_url(self) -> str:
+        return f"{self.base_url}/robot/send?access_token=stand-in"
+
+    @property
+    def imgbb_upload_url(self) -> str:
+        return f"{self.base_url}/1/upload"
+
+    def start(self) -> "StandInServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="stand-in-http", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "StandInServer":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.requests.clear()
+            self.messages.clear()
+            self._dingtalk_window.clear()
+
+    def bytes_received(self) -> int:
+        with self._lock:
+            return sum(r.bytes_received for r in self.requests)
+
+    def record(self, service: str, method: str, status: str, size: int) -> None:
+        with self._lock:
+            self.requests.append(RequestLog(service, method, status, size))
+
+    def record_message(self, params: Dict[str, Any]) -> None:
+        with self._lock:
+            self.messages.append(params)
+
+    def push_update(self, text: str, chat_id: Any = 1, date: Optional[int] = None) -> int:
+        """模拟聊天中收到一条消息，返回 update_id"""
+        with self._updates_changed:
+            update_id = self._next_update_id
+            self._next_update_id += 1
+            self._updates.append({'update_id': update_id, 'message': {
+                'message_id': update_id, 'date': int(time.time()) if date is None else date,
+                'chat': {'id': chat_id, 'type': 'private'}, 'text': text}})
+            self._updates_changed.notify_all()
+            return update_id
+
+    def get_updates(self, offset: int, timeout: float) -> List[Dict[str, Any]]:
+        """丢弃 offset 之前（已确认）的消息；没有新消息时最多等待 timeout 秒"""
+        deadline = time.monotonic() + timeout
+        with self._updates_changed:
+            self._updates = [u for u in self._updates if u['update_id'] >= offset]
+            while not self._updates and time.monotonic() < deadline:
+                self._updates_changed.wait(deadline - time.monotonic())
+            return list(self._updates)
+
+    def roll(self, rate: float) -> bool:
+        with self._lock:
+            return self.random.random() < rate
+
+    def dingtalk_over_limit(self) -> bool:
+        """按滑动窗口统计最近一分钟的消息数"""
+        now = time.monotonic()
+        with self._lock:
+            while self._dingtalk_window and now - self._dingtalk_window[0] > 60:
+                self._dingtalk_window.popleft()
+            if len(self._dingtalk_window) >= self.dingtalk_limit_per_minute:
+                return True
+            self._dingtalk_window.append(now)
+            return False
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    server_state: StandInServer
+    protocol_version = 'HTTP/1.1'
+    TELEGRAM_PATH = re.compile(r'^/bot(?P<token>[^/]+)/(?P<method>\w+)')
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _read_body(self) -> bytes:
+        """按配置的带宽分块读取请求体，模拟慢速上行链路"""
+        length = int(self.headers.get('Content-Length') or 0)
+        profile = self.server_state.profile
+        if profile.latency:
+            time.sleep(profile.latency)
+        chunks = []
+        remaining = length
+        chunk_size = 64 * 1024
+        while remaining > 0:
+            chunk = self.rfile.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+            if profile.bandwidth_kbps:
+                time.sleep(len(chunk) * 8 / (profile.bandwidth_kbps * 1000))
+        return b''.join(chunks)
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _params(self, body: bytes) -> Dict[str, Any]:
+        """JSON 或表单格式的请求参数（multipart 上传不解析）"""
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        params: Dict[str, Any] = {key: values[-1] for key, values in query.items()}
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('application/json'):
+            params.update(json.loads(body or b'{}'))
+        elif content_type.startswith('application/x-www-form-urlencoded'):
+            params.update({key: values[-1] for key, values in urllib.parse.parse_qs(body.decode('utf-8')).items()})
+        return params
+
+    def do_POST(self) -> None:
+        path = self.path.split('?', 1)[0]
+        body = self._read_body()
+        state = self.server_state
+        match = self.TELEGRAM_PATH.match(path)
+        if match:
+            self._telegram(match.group('method'), body)
+        elif path == '/robot/send':
+            self._dingtalk(body)
+        elif path == '/1/upload':
+            self._imgbb(body)
+        else:
+            state.record('unknown', path, 'not_found', len(body))
+            self._send_json(404, {'error': 'not found'})
+
+    def _failure(self, service: str, method: str, size: int) -> bool:
+        if self.server_state.roll(self.server_state.profile.failure_rate):
+            self.server_state.record(service, method, 'error', size)
+            self._send_json(500, {'ok': False, 'error': 'stand-in failure'})
+            return True
+        return False
+
+    def _telegram(self, method: str, body: bytes) -> None:
+        state = self.server_state
+        if self._failure('telegram', method, len(body)):
+            return
+        if state.roll(state.profile.throttle_rate):
+            state.record('telegram', method, 'throttled', len(body))
+            retry_after = state.profile.retry_after
+            self._send_json(429, {'ok': False, 'error_code': 429,
+                                  'description': f'Too Many Requests: retry after {retry_after}',
+                                  'parameters': {'retry_after': retry_after}})
+            return
+        if method == 'getUpdates':
+            params = self._params(body)
+            # 等待期间不占用锁，其他请求照常处理
+            updates = state.get_updates(int(params.get('offset', 0)), min(float(params.get('timeout', 0)), 60))
+            state.record('telegram', method, 'ok', len(body))
+            self._send_json(200, {'ok': True, 'result': updates})
+            return
+        if method not in ('sendPhoto', 'sendMediaGroup', 'sendMessage', 'sendDocument', 'sendVideo'):
+            state.record('telegram', method, 'not_found', len(body))
+            self._send_json(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+            return
+        state.record('telegram', method, 'ok', len(body))
+        if method == 'sendMessage':
+            state.record_message(self._params(body))
+        message = {'message_id': len(state.requests), 'date': int(time.time())}
+        result: Any = [message] if method == 'sendMediaGroup' else message
+        self._send_json(200, {'ok': True, 'result': result})
+
+    def _dingtalk(self, body: bytes) -> None:
+        state = self.server_state
+        if self._failure('dingtalk', 'send', len(body)):
+            return
+        if state.dingtalk_over_limit() or state.roll(state.profile.throttle_rate):
+            state.record('dingtalk', 'send', 'throttled', len(body))
+            # 钉钉限流时 HTTP 状态仍为 200，通过 errcode 区分
+            self._send_json(200, {'errcode': 130101, 'errmsg': 'send too fast, exceed 20 times per minute'})
+            return
+        try:
+            json.loads(body or b'{}')
+        except ValueError:
+            state.record('dingtalk', 'send', 'bad_request', len(body))
+            self._send_json(200, {'errcode': 300001, 'errmsg': 'param error'})
+            return
+        state.record('dingtalk', 'send', 'ok', len(body))
+        self._send_json(200, {'errcode': 0, 'errmsg': 'ok'})
+
+    def _imgbb(self, body: bytes) -> None:
+        state = self.server_state
+        if self._failure('imgbb', 'upload', len(body)):
+            return
+        if state.roll(state.profile.throttle_rate):
+            state.record('imgbb', 'upload', 'throttled', len(body))
+            self._send_json(429, {'status_code': 429, 'success': False,
+                                  'error': {'message': 'Rate limit exceeded', 'code': 429}})
+            return
+        image_id = uuid.uuid4().hex[:8]
+        state.record('imgbb', 'upload', 'ok', len(body))
+        url = f"{state.base_url}/i/{image_id}.png"
+        self._send_json(200, {'success': True, 'status': 200,
+                              'data': {'id': image_id, 'url': url, 'display_url': url, 'size': len(body)}})
+
+
+def parse_profile(text: str) -> Tuple[str, NetworkProfile]:
+    """
+    解析命令行中的网络条件，例如 "home:latency=0.05,bandwidth_kbps=20000,throttle_rate=0.05"
+    """
+    name, _, spec = text.partition(':')
+    values: Dict[str, Any] = {}
+    for item in filter(None, spec.split(',')):
+        key, _, value = item.partition('=')
+        values[key.strip()] = float(value) if key.strip() not in ('retry_after', 'seed') else int(value)
+    return name, NetworkProfile(**values)
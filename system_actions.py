@@ -0,0 +1,59 @@
+"""
+系统动作层：关机、取消关机等有副作用的操作，以及提醒/发送决策的记录。
+正常运行时执行真实命令；模拟器使用 RecordingActions 只记录不执行。
+"""
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from clock import Clock, SYSTEM_CLOCK
+
+
+class SystemActions:
+    logger: logging.Logger
+
+    def __init__(self) -> None:
+        self.logger = logging.getLogger("SystemActions")
+
+    def schedule_shutdown(self, seconds: int) -> None:
+        """计划在 seconds 秒后关机"""
+        os.system(f"shutdown /s /t {seconds}")
+
+    def cancel_shutdown(self) -> None:
+        os.system("shutdown /a")
+
+    def shutdown_now(self) -> None:
+        os.system("shutdown /s /t 0")
+
+    def record(self, event: str, **details: Any) -> None:
+        """记录一次决策（提醒、强制休息、发送等）；真实运行时不做任何事"""
+        pass
+
+
+class RecordingActions(SystemActions):
+    """
+    只记录不执行的动作层。每条记录为 (时间戳, 事件名, 详情)，
+    可选的 on_event 回调让模拟器对关机等事件做出反应。
+    """
+    events: List[Tuple[float, str, Dict[str, Any]]]
+
+    def __init__(self, clock: Clock = SYSTEM_CLOCK,
+                 on_event: Optional[Callable[[str, Dict[str, Any]], None]] = None) -> None:
+        super().__init__()
+        self.clock = clock
+        self.on_event = on_event
+        self.events = []
+
+    def record(self, event: str, **details: Any) -> None:
+        self.events.append((self.clock.time(), event, details))
+        if self.on_event:
+            self.on_event(event, details)
+
+    def schedule_shutdown(self, seconds: int) -> None:
+        self.record('shutdown_scheduled', delay=seconds)
+
+    def cancel_shutdown(self) -> None:
+        self.record('shutdown_cancelled')
+
+    def shutdown_now(self) -> None:
+        self.record('shutdown')
@@ -0,0 +1,193 @@
+"""
+通过 Telegram 远程控制：长轮询 getUpdates，执行家长在聊天中发送的命令。
+
+命令只接受来自配置的 chatId 的消息；启动前积压太久的命令直接确认丢弃，不会在开机后补执行。
+同一个机器人只能有一个 getUpdates 的使用者，多台电脑共用机器人时只在一台上开启 enableCommands。
+"""
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+
+from clock import Clock, SYSTEM_CLOCK
+from connectivity import ConnectivityMonitor, network_down, network_up, pause_while_offline
+from metrics import REGISTRY
+from outbound_queue import STATUS, OutboundQueue
+
+# 长轮询的等待时间（秒），Telegram 在有新消息时立即返回
+POLL_TIMEOUT = 50
+# 启动时比这更早的命令不再执行（秒）
+MAX_COMMAND_AGE = 600
+# 请求失败后的重试间隔（秒），连续失败时翻倍
+RETRY_SECONDS = 5
+MAX_RETRY_SECONDS = 300
+
+# 命令处理函数接收命令参数，返回回复的文字；返回 None 表示不回复（例如 /shot 直接回复截图）
+CommandHandler = Callable[[List[str]], Optional[str]]
+
+
+def parse_command(text: str) -> Optional[Tuple[str, List[str]]]:
+    """'/extend@kid_bot 30' → ('extend', ['30'])；不是命令时返回 None"""
+    if not text.startswith('/'):
+        return None
+    parts = text.split()
+    name = parts[0][1:].split('@', 1)[0].lower()
+    return (name, parts[1:]) if name else None
+
+
+def minutes_arg(args: List[str], default: Optional[int] = None) -> int:
+    """命令的分钟数参数；缺少参数且没有默认值、或参数不是正整数时抛出 ValueError"""
+    if not args:
+        if default is None:
+            raise ValueError("missing minutes")
+        return default
+    minutes = int(args[0])
+    if minutes <= 0:
+        raise ValueError("minutes must be positive")
+    return minutes
+
+
+class TelegramCommandPoller:
+    logger: logging.Logger
+    running: bool
+
+    def __init__(self, clock: Clock = SYSTEM_CLOCK, outbox: Optional[OutboundQueue] = None,
+                 connectivity: Optional[ConnectivityMonitor] = None) -> None:
+        self.logger = logging.getLogger("TelegramCommands")
+        self.clock = clock
+        # 可选的出站队列：回复按状态优先级排队，排在告警之后、例行截图之前
+        self.outbox = outbox
+        # 可选的连通性监视：离线时不轮询，恢复联网后立即继续
+        self.connectivity = connectivity
+        self.running = False
+        self.api_url = ''
+        self.bot_token = ''
+        self.chat_id = ''
+        self.proxies: Optional[Dict[str, str]] = None
+        self.offset: Optional[int] = None
+        self._handlers: Dict[str, Tuple[CommandHandler, str]] = {}
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # 长轮询和回复共用一个持久连接
+        self.session = requests.Session()
+        self.register('help', self._help, "列出可用的命令")
+
+    def configure(self, api_url: str, bot_token: str, chat_id: str, proxies: Optional[Dict[str, str]]) -> None:
+        self.api_url = api_url
+        self.bot_token = bot_token
+        self.chat_id = chat_id
+        self.proxies = proxies
+
+    def register(self, name: str, handler: CommandHandler, description: str) -> None:
+        self._handlers[name] = (handler, description)
+
+    def _help(self, args: List[str]) -> str:
+        return '\n'.join(f"/{name} - {description}" for name, (_, description) in sorted(self._handlers.items()))
+
+    def _call(self, method: str, payload: Dict[str, Any], timeout: float) -> Any:
+        response = self.session.post(f"{self.api_url}/bot{self.bot_token}/{method}", json=payload,
+                                     proxies=self.proxies, verify=False, timeout=timeout)
+        response.raise_for_status()
+        data = response.json()
+        if not data.get('ok'):
+            raise requests.exceptions.RequestException(data.get('description', 'request failed'))
+        return data.get('result')
+
+    def reply(self, text: str) -> None:
+        if self.outbox is not None:
+            self.outbox.put(STATUS, lambda: self._send_reply(text), 'command reply')
+        else:
+            self._send_reply(text)
+
+    def _send_reply(self, text: str) -> bool:
+        try:
+            self._call('sendMessage', {'chat_id': self.chat_id, 'text': text}, 30)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self.logger.warning(f"Cannot reply to command: {e}")
+            return False
+        return True
+
+    def poll_once(self, timeout: float = POLL_TIMEOUT) -> int:
+        """取一次新消息并执行其中的命令，返回执行的命令数；网络错误向上抛出"""
+        payload: Dict[str, Any] = {'timeout': int(timeout), 'allowed_updates': ['message']}
+        if self.offset is not None:
+            payload['offset'] = self.offset
+        updates = self._call('getUpdates', payload, timeout + 10) or []
+        handled = 0
+        for update in updates:
+            # 确认到这一条为止，下一次请求时 Telegram 删除已确认的消息
+            self.offset = update['update_id'] + 1
+            if self._handle(update.get('message') or {}):
+                handled += 1
+        return handled
+
+    def _handle(self, message: Dict[str, Any]) -> bool:
+        command = parse_command(message.get('text') or '')
+        if command is None:
+            return False
+        if str(message.get('chat', {}).get('id')) != self.chat_id:
+            self.logger.warning(f"Ignoring command from unknown chat {message.get('chat', {}).get('id')}")
+            return False
+        if self.clock.time() - message.get('date', 0) > MAX_COMMAND_AGE:
+            self.logger.info(f"Ignoring stale command /{command[0]}")
+            return False
+        name, args = command
+        entry = self._handlers.get(name)
+        if entry is None:
+            self.reply(f"未知命令 /{name}，发送 /help 查看可用的命令")
+            return False
+        handler, description = entry
+        self.logger.info(f"Command /{name} {' '.join(args)}".rstrip())
+        try:
+            with REGISTRY.stage('commands', name):
+                text = handler(args)
+        except ValueError:
+            text = f"参数错误。/{name}: {description}"
+        except Exception as e:
+            self.logger.error(f"Command /{name} failed: {e}", exc_info=True)
+            text = f"/{name} 执行失败: {e}"
+        if text:
+            self.reply(text)
+        return True
+
+    def run(self) -> None:
+        self.running = True
+        self._stopped.clear()
+        self.logger.info("Telegram command polling started.")
+        retry = RETRY_SECONDS
+        try:
+            while self.running:
+                if pause_while_offline(self.connectivity, lambda: self.running):
+                    retry = RETRY_SECONDS
+                    continue
+                try:
+                    self.poll_once()
+                    network_up(self.connectivity)
+                    retry = RETRY_SECONDS
+                except (requests.exceptions.RequestException, ValueError) as e:
+                    if network_down(self.connectivity, e):
+                        continue  # 下一轮等待恢复联网，不按退避重试
+                    # 409 表示同一个机器人在别处也在轮询
+                    self.logger.warning(f"getUpdates failed, retrying in {retry}s: {e}")
+                    self.clock.wait(self._stopped, retry)
+                    retry = min(retry * 2, MAX_RETRY_SECONDS)
+        except Exception as e:
+            self.logger.critical(f"Telegram command polling encountered a critical error: {e}", exc_info=True)
+        finally:
+            self.running = False
+            self.logger.info("Telegram command polling stopped.")
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            # 刚调用过 stop()、线程还在等长轮询返回：让它继续运行
+            self.running = True
+            self._stopped.clear()
+            return
+        self._thread = threading.Thread(target=self.run, name="telegram-commands", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """进行中的长轮询最多在 POLL_TIMEOUT 秒后返回，线程随后退出"""
+        self.running = False
+        self._stopped.set()
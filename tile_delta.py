@@ -0,0 +1,195 @@
+"""
+按图块的增量帧编码：把截图切成 tile x tile 的图块并计算每块的哈希，
+与关键帧比较后只编码变化的图块。大部分画面不变时，增量帧只有关键帧的几分之一到几十分之一。
+
+每个增量帧只相对于关键帧（而不是上一帧），解码任意一帧只需要它自己和它的关键帧，
+中间的帧丢失或被淘汰都不影响。变化的图块累计超过 max_changed 或帧数达到 keyframe_interval 时
+重新输出关键帧。
+
+格式（大端序）:
+    头部:  b'KPTD' | 版本(1) | 类型(1) | 编码(1) | 保留(1) | 图块大小(2) | 宽(2) | 高(2) | 关键帧 ID(4)
+    增量帧: 头部 | 变化图块的位图(按行优先每块 1 位) | 变化图块按网格拼成的一张图
+    关键帧: 头部 | 整张图
+"""
+import hashlib
+import io
+import math
+import os
+import struct
+from typing import List, NamedTuple, Optional, Tuple
+
+from PIL import Image
+
+MAGIC = b'KPTD'
+VERSION = 1
+KIND_KEY = 0
+KIND_DELTA = 1
+CODECS = ('PNG', 'JPEG')
+
+_HEADER = struct.Struct('>4sBBBBHHHI')
+
+
+class DeltaError(ValueError):
+    pass
+
+
+class FrameHeader(NamedTuple):
+    kind: int
+    codec: str
+    tile: int
+    width: int
+    height: int
+    key_id: int
+
+    @property
+    def columns(self) -> int:
+        return -(-self.width // self.tile)
+
+    @property
+    def rows(self) -> int:
+        return -(-self.height // self.tile)
+
+
+class DeltaFrame(NamedTuple):
+    data: bytes
+    key: bool
+    key_id: int
+    changed_tiles: int
+    total_tiles: int
+
+
+def tile_hashes(image: Image.Image, tile: int) -> List[bytes]:
+    """
+    每个图块的哈希，按行优先排列。
+    每一行图块先裁成一条再转置，转置后每个图块在 tobytes() 里是连续的一段，
+    一次切片就能取出整块，不需要逐行拼接像素。
+    """
+    hashes = []
+    for top in range(0, image.height, tile):
+        band = image.crop((0, top, image.width, min(top + tile, image.height))).transpose(Image.TRANSPOSE)
+        data = band.tobytes()
+        step = tile * len(data) // image.width  # 一个图块的字节数 = tile 列 x 每列的字节数
+        for start in range(0, len(data), step):
+            hashes.append(hashlib.blake2b(data[start:start + step], digest_size=16).digest())
+    return hashes
+
+
+def _encode_image(image: Image.Image, codec: str, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    if codec == 'JPEG':
+        image.save(buffer, format='JPEG', quality=quality)
+    else:
+        image.save(buffer, format='PNG', compress_level=1)
+    return buffer.getvalue()
+
+
+def read_header(data: bytes) -> FrameHeader:
+    if len(data) < _HEADER.size:
+        raise DeltaError("truncated delta frame header")
+    magic, version, kind, codec, _, tile, width, height, key_id = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise DeltaError("bad magic")
+    if version != VERSION:
+        raise DeltaError(f"unsupported delta frame version {version}")
+    if kind not in (KIND_KEY, KIND_DELTA) or codec >= len(CODECS) or not tile:
+        raise DeltaError("bad delta frame header")
+    return FrameHeader(kind, CODECS[codec], tile, width, height, key_id)
+
+
+class TileDeltaEncoder:
+    """
+    把连续的截图编码成关键帧和增量帧。codec 为 'PNG'（无损，用于本地存档）或 'JPEG'（用于网络传输）。
+    每个发送方（存档来源、CollectorSink）各用一个编码器，编码器不是线程安全的。
+    """
+
+    def __init__(self, tile: int = 64, keyframe_interval: int = 120, max_changed: float = 0.5,
+                 codec: str = 'PNG', quality: int = 70) -> None:
+        if codec not in CODECS:
+            raise ValueError(f"unsupported codec {codec}")
+        self.tile = tile
+        self.keyframe_interval = keyframe_interval
+        self.max_changed = max_changed
+        self.codec = codec
+        self.quality = quality
+        self.reset()
+
+    def reset(self) -> None:
+        """下一帧强制输出关键帧（例如接收方丢失了关键帧）"""
+        self._key_hashes: Optional[List[bytes]] = None
+        self._key_size: Tuple[int, int] = (0, 0)
+        self._key_id = 0
+        self._since_key = 0
+
+    def _header(self, kind: int, width: int, height: int) -> bytes:
+        return _HEADER.pack(MAGIC, VERSION, kind, CODECS.index(self.codec), 0, self.tile, width, height,
+                            self._key_id)
+
+    def encode(self, image: Image.Image) -> DeltaFrame:
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        hashes = tile_hashes(image, self.tile)
+        changed = []
+        if self._key_hashes is not None and self._key_size == image.size:
+            changed = [i for i, (a, b) in enumerate(zip(hashes, self._key_hashes)) if a != b]
+        if (self._key_hashes is None or self._key_size != image.size or self._since_key >= self.keyframe_interval
+                or len(changed) > self.max_changed * len(hashes)):
+            self._key_hashes = hashes
+            self._key_size = image.size
+            # 随机 ID：接收方重启或丢帧后不会把增量帧套在另一次会话的同号关键帧上
+            self._key_id = int.from_bytes(os.urandom(4), 'big')
+            self._since_key = 0
+            data = self._header(KIND_KEY, image.width, image.height) + _encode_image(image, self.codec, self.quality)
+            return DeltaFrame(data, True, self._key_id, len(hashes), len(hashes))
+
+        self._since_key += 1
+        columns = -(-image.width // self.tile)
+        bitmap = bytearray(-(-len(hashes) // 8))
+        for i in changed:
+            bitmap[i >> 3] |= 0x80 >> (i & 7)
+        payload = b''
+        if changed:
+            # 变化的图块拼成接近正方形的网格，编码成一张图
+            grid_columns = math.ceil(math.sqrt(len(changed)))
+            grid = Image.new('RGB', (grid_columns * self.tile, -(-len(changed) // grid_columns) * self.tile))
+            for n, i in enumerate(changed):
+                left, top = (i % columns) * self.tile, (i // columns) * self.tile
+                tile = image.crop((left, top, min(left + self.tile, image.width), min(top + self.tile, image.height)))
+                grid.paste(tile, ((n % grid_columns) * self.tile, (n // grid_columns) * self.tile))
+            payload = _encode_image(grid, self.codec, self.quality)
+        data = self._header(KIND_DELTA, image.width, image.height) + bytes(bitmap) + payload
+        return DeltaFrame(data, False, self._key_id, len(changed), len(hashes))
+
+
+def decode(data: bytes, key: Optional[bytes] = None) -> Image.Image:
+    """还原一帧：关键帧直接解码；增量帧需要同一 key_id 的关键帧"""
+    header = read_header(data)
+    if header.kind == KIND_KEY:
+        image = Image.open(io.BytesIO(data[_HEADER.size:]))
+        image.load()
+        return image
+    if key is None:
+        raise DeltaError("delta frame needs its keyframe")
+    key_header = read_header(key)
+    if key_header.kind != KIND_KEY or key_header.key_id != header.key_id:
+        raise DeltaError("keyframe does not match delta frame")
+    image = decode(key).convert('RGB')
+    if image.size != (header.width, header.height):
+        raise DeltaError("keyframe size does not match delta frame")
+    total = header.columns * header.rows
+    bitmap_end = _HEADER.size + -(-total // 8)
+    if len(data) < bitmap_end:
+        raise DeltaError("truncated tile bitmap")
+    bitmap = data[_HEADER.size:bitmap_end]
+    changed = [i for i in range(total) if bitmap[i >> 3] & (0x80 >> (i & 7))]
+    if not changed:
+        return image
+    grid = Image.open(io.BytesIO(data[bitmap_end:]))
+    grid.load()
+    grid_columns = math.ceil(math.sqrt(len(changed)))
+    tile = header.tile
+    for n, i in enumerate(changed):
+        left, top = (i % header.columns) * tile, (i // header.columns) * tile
+        gx, gy = (n % grid_columns) * tile, (n // grid_columns) * tile
+        width, height = min(tile, header.width - left), min(tile, header.height - top)
+        image.paste(grid.crop((gx, gy, gx + width, gy + height)), (left, top))
+    return image
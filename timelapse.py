@@ -0,0 +1,239 @@
+"""
+每日延时视频：截图到达时缩小并编码为 JPEG，直接追加到当天的 MJPEG AVI 文件，
+不需要在午夜一次性处理整天的截图。日期变化和程序启动时把前几天的文件写入索引、
+补全文件头，并作为一条消息发送出去；发送失败的文件留到下一次日期变化或启动时重试，没有帧的文件直接删除。
+
+AVI 由纯 Python 写出，任何播放器都能打开；程序中途退出后重新启动会扫描已写入的数据块继续追加。
+"""
+import datetime
+import io
+import logging
+import os
+import struct
+import threading
+from typing import Callable, List, Optional, Set, Tuple
+
+from PIL import Image
+
+from clock import Clock, SYSTEM_CLOCK
+from config_manager import ConfigManager
+from metrics import REGISTRY
+
+AVIF_HASINDEX = 0x10
+AVIIF_KEYFRAME = 0x10
+_CHUNK = struct.Struct('<4sI')
+
+
+class MjpegAviWriter:
+    """追加式 MJPEG AVI 写入器。帧尺寸固定，由第一帧决定"""
+
+    def __init__(self, path: str, width: int, height: int, fps: int) -> None:
+        self.path = path
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.index: List[Tuple[int, int]] = []  # (相对 movi 的偏移, 大小)
+        self.max_frame = 0
+        if os.path.exists(path) and os.path.getsize(path) >= self._movi_data_start():
+            self._resume()
+        else:
+            self._file = open(path, 'w+b')
+            self._file.write(self._header())
+
+    @staticmethod
+    def _movi_data_start() -> int:
+        return 224
+
+    def _header(self) -> bytes:
+        """按当前的帧数生成文件头；写入时帧数为 0，close() 时重写"""
+        frames = len(self.index)
+        avih = struct.pack('<14I', 1000000 // max(1, self.fps), 0, 0, AVIF_HASINDEX, frames, 0, 1,
+                           self.max_frame, self.width, self.height, 0, 0, 0, 0)
+        strh = struct.pack('<4s4sIHHIIIIIIII4h', b'vids', b'MJPG', 0, 0, 0, 0, 1, self.fps, 0, frames,
+                           self.max_frame, 0xFFFFFFFF, 0, 0, 0, self.width, self.height)
+        strf = struct.pack('<IiiHH4sIiiII', 40, self.width, self.height, 1, 24, b'MJPG',
+                           self.width * self.height * 3, 0, 0, 0, 0)
+        strl = b'strl' + _CHUNK.pack(b'strh', len(strh)) + strh + _CHUNK.pack(b'strf', len(strf)) + strf
+        hdrl = b'hdrl' + _CHUNK.pack(b'avih', len(avih)) + avih + _CHUNK.pack(b'LIST', len(strl)) + strl
+        movi_size = 4 + sum(8 + size + (size & 1) for _, size in self.index)
+        head = _CHUNK.pack(b'LIST', len(hdrl)) + hdrl + _CHUNK.pack(b'LIST', movi_size) + b'movi'
+        riff_size = 4 + len(head) + movi_size - 4 + (8 + 16 * frames if frames else 0)
+        header = _CHUNK.pack(b'RIFF', riff_size) + b'AVI ' + head
+        assert len(header) == self._movi_data_start()
+        return header
+
+    def _resume(self) -> None:
+        """重新打开未完成的文件：读取尺寸，扫描已有的帧，截掉写了一半的最后一帧"""
+        self._file = open(self.path, 'r+b')
+        header = self._file.read(self._movi_data_start())
+        self.width, self.height = struct.unpack_from('<II', header, 64)
+        end = os.path.getsize(self.path)
+        offset = self._movi_data_start()
+        while offset + 8 <= end:
+            self._file.seek(offset)
+            chunk_id, size = _CHUNK.unpack(self._file.read(8))
+            if chunk_id != b'00dc' or offset + 8 + size > end:
+                break
+            self.index.append((offset - (self._movi_data_start() - 4), size))
+            self.max_frame = max(self.max_frame, size)
+            offset += 8 + size + (size & 1)
+        self._file.seek(offset)
+        self._file.truncate()
+
+    def add_frame(self, jpeg: bytes) -> None:
+        size = len(jpeg)
+        self.index.append((self._file.tell() - (self._movi_data_start() - 4), size))
+        self.max_frame = max(self.max_frame, size)
+        self._file.write(_CHUNK.pack(b'00dc', size) + jpeg + (b'\0' if size & 1 else b''))
+        self._file.flush()
+
+    @property
+    def frames(self) -> int:
+        return len(self.index)
+
+    def close(self) -> None:
+        """写入 idx1 索引并补全文件头中的大小和帧数"""
+        self._file.seek(0, os.SEEK_END)
+        if self.index:
+            idx = b''.join(struct.pack('<4sIII', b'00dc', AVIIF_KEYFRAME, offset, size) for offset, size in self.index)
+            self._file.write(_CHUNK.pack(b'idx1', len(idx)) + idx)
+        self._file.seek(0)
+        self._file.write(self._header())
+        self._file.close()
+
+
+class TimelapseRecorder:
+    """
+    延时视频流水线：add_image() 在截图线程中调用，每帧只做一次缩小和 JPEG 编码。
+    deliver(path, caption) 负责发送完成的视频，返回是否成功；成功后删除文件。
+    """
+    logger: logging.Logger
+    config_manager: ConfigManager
+    enabled: bool
+    folder: str
+    width: int
+    fps: int
+    quality: int
+
+    def __init__(self, config_manager: ConfigManager, deliver: Optional[Callable[[str, str], bool]] = None,
+                 clock: Clock = SYSTEM_CLOCK) -> None:
+        self.logger = logging.getLogger("Timelapse")
+        self.config_manager = config_manager
+        self.deliver = deliver
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._writer: Optional[MjpegAviWriter] = None
+        self._day: Optional[datetime.date] = None
+        # 补全和发送前几天的文件时持有，同一个文件不会同时被两个线程处理
+        self._deliver_lock = threading.Lock()
+
+        self.apply_config()
+        self.config_manager.add_listener(self._on_config_changed)
+
+    def apply_config(self) -> None:
+        self.enabled = bool(self.config_manager.get('enableTimelapse'))
+        self.folder = os.path.join(str(self.config_manager.get('dataFolder')), 'timelapse')
+        self.width = max(16, int(self.config_manager.get('timelapseWidth')))
+        self.fps = max(1, int(self.config_manager.get('timelapseFps')))
+        self.quality = int(self.config_manager.get('timelapseQuality'))
+
+    def _on_config_changed(self, changed: Set[str]) -> None:
+        if changed & {'enableTimelapse', 'dataFolder', 'timelapseWidth', 'timelapseFps', 'timelapseQuality'}:
+            # 尺寸和帧率只对新的一天生效，当天的文件保持一致
+            self.apply_config()
+
+    def _path(self, day: datetime.date) -> str:
+        return os.path.join(self.folder, f"timelapse_{day.strftime('%Y%m%d')}.avi")
+
+    def add_image(self, image: Image.Image) -> None:
+        if not self.enabled:
+            return
+        today = self.clock.today()
+        finished = None
+        try:
+            with REGISTRY.stage('timelapse', 'encode') as stage:
+                height = max(2, round(image.height * self.width / image.width)) & ~1
+                with self._lock:
+                    if self._day != today:
+                        finished = self._close_locked()
+                        self._open_locked(today, height)
+                    writer = self._writer
+                    # 缩小后再转换颜色，避免对全尺寸截图做转换
+                    frame = image.resize((writer.width, writer.height), Image.BILINEAR)
+                    buffer = io.BytesIO()
+                    frame.convert('RGB').save(buffer, format='JPEG', quality=self.quality)
+                    writer.add_frame(buffer.getvalue())
+                stage.bytes = buffer.tell()
+        except Exception as e:
+            self.logger.error(f"Error adding frame to timelapse: {e}")
+        if finished:
+            # 新的一天：发送昨天的视频，并重试之前发送失败的
+            self.finish_pending()
+
+    def _open_locked(self, day: datetime.date, height: int) -> None:
+        os.makedirs(self.folder, exist_ok=True)
+        self._writer = MjpegAviWriter(self._path(day), self.width, height, self.fps)
+        self._day = day
+        if self._writer.frames:
+            self.logger.info(f"Resumed timelapse for {day} with {self._writer.frames} frames")
+
+    def _close_locked(self) -> Optional[Tuple[str, int]]:
+        if self._writer is None:
+            return None
+        writer, self._writer, self._day = self._writer, None, None
+        writer.close()
+        return writer.path, writer.frames
+
+    def pending_files(self) -> List[str]:
+        """前几天未发送的视频（例如关机前没来得及发送）"""
+        if not os.path.isdir(self.folder):
+            return []
+        today = self._path(self.clock.today())
+        return [os.path.join(self.folder, name) for name in sorted(os.listdir(self.folder))
+                if name.startswith('timelapse_') and name.endswith('.avi')
+                and os.path.join(self.folder, name) != today]
+
+    def finish_pending(self) -> None:
+        """在后台补全并发送前几天的视频（启动时和日期变化时调用）"""
+        threading.Thread(target=self._finish_pending, name="timelapse-deliver", daemon=True).start()
+
+    def _finish_pending(self) -> None:
+        with self._deliver_lock:
+            for path in self.pending_files():
+                try:
+                    # 已经补全过的文件（上次发送失败）会截掉索引后重新写入
+                    writer = MjpegAviWriter(path, 0, 0, self.fps)
+                    frames = writer.frames
+                    writer.close()
+                except (OSError, struct.error) as e:
+                    self.logger.error(f"Error finishing timelapse {path}: {e}")
+                    continue
+                self._deliver(path, frames)
+
+    def _deliver(self, path: str, frames: int) -> None:
+        if frames == 0:
+            self.logger.info(f"Removing empty timelapse {path}")
+            os.remove(path)
+            return
+        if not self.deliver:
+            return
+        day = os.path.basename(path)[len('timelapse_'):-len('.avi')]
+        caption = f"延时视频 {day[:4]}-{day[4:6]}-{day[6:]}，共 {frames} 帧"
+        size = os.path.getsize(path)
+        with REGISTRY.stage('timelapse', 'deliver') as stage:
+            stage.bytes = size
+            ok = self.deliver(path, caption)
+            if not ok:
+                stage.fail()
+        if ok:
+            self.logger.info(f"Timelapse {path} delivered ({frames} frames, {size / 1048576:.1f} MB)")
+            os.remove(path)
+        else:
+            self.logger.warning(f"Timelapse {path} not delivered, retrying at the next day change or restart")
+
+    def close(self) -> None:
+        """程序退出时补全当前文件：当天再次启动会截掉索引继续追加，之后日期变化或启动时发送"""
+        with self._lock:
+            writer, self._writer, self._day = self._writer, None, None
+        if writer is not None:
+            writer.close()
@@ -0,0 +1,127 @@
+"""
+图床 URL 缓存：截图内容的哈希 → 已上传图片的 URL，相同的截图不再重复上传 ImgBB。
+
+- 条目按上传时 ImgBB 返回的保存期限过期（没有期限的图片一直有效），过期前留期限的 1/10（最多 EXPIRY_MARGIN 秒）余量；
+- 条目数超过上限时淘汰最久没用到的（LRU）；
+- 缓存保存在 dataFolder/imgbb_cache.json，重启后继续有效；
+- 命中、未命中、过期和淘汰都计入指标 url_cache_total。
+"""
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+
+from clock import Clock, SYSTEM_CLOCK
+from config_manager import ConfigManager
+from metrics import REGISTRY
+
+CACHE_FILENAME = 'imgbb_cache.json'
+# 过期前留出期限的 1/EXPIRY_MARGIN_DIVISOR、最多 EXPIRY_MARGIN 秒不再使用，避免发出的链接在家长打开前失效
+EXPIRY_MARGIN = 3600
+EXPIRY_MARGIN_DIVISOR = 10
+
+
+class UploadUrlCache:
+    logger: logging.Logger
+    config_manager: ConfigManager
+    path: str
+    max_entries: int
+
+    def __init__(self, config_manager: ConfigManager, clock: Clock = SYSTEM_CLOCK) -> None:
+        self.logger = logging.getLogger("UrlCache")
+        self.config_manager = config_manager
+        self.clock = clock
+        self._lock = threading.Lock()
+        # 哈希 → {'url': ..., 'expires': 停止使用的时间戳（已扣除余量）或 0}；顺序即最近使用顺序，最后的最新
+        self._entries: 'OrderedDict[str, Dict[str, object]]' = OrderedDict()
+        self.path = ''
+
+        self.apply_config()
+        self.config_manager.add_listener(self._on_config_changed)
+
+    def apply_config(self) -> None:
+        path = os.path.join(str(self.config_manager.get('dataFolder')), CACHE_FILENAME)
+        with self._lock:
+            self.max_entries = int(self.config_manager.get('imgbbCacheEntries'))
+            if path != self.path:
+                self.path = path
+                self._entries = self._load()
+            self._evict()
+
+    def _on_config_changed(self, changed: Set[str]) -> None:
+        if changed & {'dataFolder', 'imgbbCacheEntries'}:
+            self.apply_config()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _load(self) -> 'OrderedDict[str, Dict[str, object]]':
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return OrderedDict()
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Ignoring unreadable URL cache {self.path}: {e}")
+            return OrderedDict()
+        now = self.clock.time()
+        return OrderedDict((key, entry) for key, entry in data.items()
+                           if isinstance(entry, dict) and entry.get('url') and not self._expired(entry, now))
+
+    def _save(self) -> None:
+        """调用方持有锁"""
+        try:
+            temp = self.path + '.tmp'
+            with open(temp, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f)
+            os.replace(temp, self.path)
+        except OSError as e:
+            self.logger.warning(f"Cannot save URL cache {self.path}: {e}")
+
+    @staticmethod
+    def _expired(entry: Dict[str, object], now: float) -> bool:
+        expires = float(entry.get('expires') or 0)
+        return expires > 0 and now >= expires
+
+    def _evict(self) -> None:
+        """超出上限时淘汰最久没用的条目；调用方持有锁"""
+        evicted = 0
+        while len(self._entries) > max(0, self.max_entries):
+            self._entries.popitem(last=False)
+            evicted += 1
+        if evicted:
+            REGISTRY.inc('url_cache_total', evicted, result='evicted')
+
+    def get(self, key: str) -> Optional[str]:
+        """已上传过的 URL；没有或快过期时返回 None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                REGISTRY.inc('url_cache_total', result='miss')
+                return None
+            if self._expired(entry, self.clock.time()):
+                # 不单独写文件：下一次 put 时一起写入，载入时也会跳过过期的条目
+                del self._entries[key]
+                REGISTRY.inc('url_cache_total', result='expired')
+                return None
+            self._entries.move_to_end(key)
+            REGISTRY.inc('url_cache_total', result='hit')
+            return str(entry['url'])
+
+    def put(self, key: str, url: str, expiration: float = 0) -> None:
+        """记录一次上传；expiration 为图床的保存期限（秒），0 表示不过期"""
+        if not self.enabled:
+            return
+        usable = expiration - min(EXPIRY_MARGIN, expiration // EXPIRY_MARGIN_DIVISOR) if expiration > 0 else 0
+        if expiration > 0 and usable <= 0:
+            return  # 期限太短，存了也用不上
+        with self._lock:
+            self._entries[key] = {'url': url, 'expires': self.clock.time() + usable if usable > 0 else 0}
+            self._entries.move_to_end(key)
+            self._evict()
+            self._save()
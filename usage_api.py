@@ -0,0 +1,209 @@
+"""
+局域网只读接口：家长在同一网络中随时查看今天的使用情况，不用等下一张截图。
+
+- GET /v1/today          今天的使用时间、连续使用、剩余额度和允许时段（JSON）
+- GET /v1/history        最近各天的累计使用（JSON）
+- GET /v1/thumbnail.jpg  最近一张截图的缩略图
+
+响应都是预先生成的快照：使用时间的快照在 UsageTracker 的跟踪线程中每 SNAPSHOT_SECONDS 秒生成一次
+（跟踪线程是唯一的写入者，读取不需要加锁），缩略图在发送器截图时生成。请求处理只取出快照，
+不接触 UsageTracker.lock；带 If-None-Match 的轮询在内容未变时直接返回 304。
+"""
+import hashlib
+import hmac
+import io
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from PIL import Image
+
+from calendar_rules import ZONE_NAMES, ScheduleCalendar
+from clock import Clock, SYSTEM_CLOCK
+from config_manager import ConfigManager
+from metrics import REGISTRY
+from quota import QuotaEngine
+from usage_tracker import UsageTracker
+
+# 使用时间快照的刷新间隔（秒）
+SNAPSHOT_SECONDS = 5
+THUMBNAIL_SIZE = (480, 270)
+
+Snapshot = Tuple[bytes, str, str]  # (响应体, Content-Type, ETag)
+
+
+def make_snapshot(body: bytes, content_type: str) -> Snapshot:
+    return body, content_type, f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+
+
+def json_snapshot(data: Any) -> Snapshot:
+    return make_snapshot(json.dumps(data, ensure_ascii=False).encode('utf-8'), 'application/json; charset=utf-8')
+
+
+class _UsageApiHandler(BaseHTTPRequestHandler):
+    api: 'UsageApi'
+
+    def do_GET(self) -> None:
+        parts = urlsplit(self.path)
+        if self.api.token and not self._token_matches(self.headers.get('X-KidPC-Token', '')) and \
+                not self._token_matches(parse_qs(parts.query).get('token', [''])[0]):
+            self._finish(parts.path, 403)
+            return
+        snapshot = self.api.snapshots.get(parts.path)
+        if snapshot is None:
+            self._finish(parts.path, 404)
+            return
+        body, content_type, etag = snapshot
+        if etag in self.headers.get('If-None-Match', ''):
+            self._finish(parts.path, 304, etag=etag)
+            return
+        self._finish(parts.path, 200, body, content_type, etag)
+
+    def _token_matches(self, value: str) -> bool:
+        # 按字节比较，非 ASCII 的令牌不会让 compare_digest 抛出 TypeError
+        return hmac.compare_digest(value.encode('utf-8'), self.api.token.encode('utf-8'))
+
+    def _finish(self, path: str, status: int, body: bytes = b'', content_type: str = 'text/plain',
+                etag: Optional[str] = None) -> None:
+        self.send_response(status)
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')  # 浏览器每次带 If-None-Match 重新验证
+        if status != 304:
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+        REGISTRY.inc('usage_api_requests_total', path=path if path in self.api.snapshots else 'other',
+                     status=str(status))
+
+    def log_message(self, format: str, *args: object) -> None:
+        # 仪表盘频繁轮询，不把每次请求写进日志
+        pass
+
+
+class UsageApi:
+    logger: logging.Logger
+    config_manager: ConfigManager
+    usage_tracker: UsageTracker
+    host: str
+    port: int
+    token: str
+
+    def __init__(self, config_manager: ConfigManager, usage_tracker: UsageTracker,
+                 quota: Optional[QuotaEngine] = None, calendar: Optional[ScheduleCalendar] = None,
+                 clock: Clock = SYSTEM_CLOCK) -> None:
+        self.logger = logging.getLogger("UsageApi")
+        self.config_manager = config_manager
+        self.usage_tracker = usage_tracker
+        self.quota = quota
+        self.calendar = calendar
+        self.clock = clock
+        self.httpd: Optional[ThreadingHTTPServer] = None
+        self._server_lock = threading.Lock()
+        # 路径 → 快照；生成后整体替换字典中的条目，请求线程只读
+        self.snapshots: Dict[str, Snapshot] = {}
+        self._built_at = float('-inf')
+
+        self.apply_config()
+        self.config_manager.add_listener(self._on_config_changed)
+        self.usage_tracker.add_usage_listener(self._on_usage)
+        self.usage_tracker.add_profile_listener(self._on_profile_switched)
+
+    def apply_config(self) -> None:
+        self.host = str(self.config_manager.get('usageApiHost'))
+        self.port = int(self.config_manager.get('usageApiPort'))
+        self.token = str(self.config_manager.get('usageApiToken'))
+
+    def _on_config_changed(self, changed: Set[str]) -> None:
+        if changed & {'usageApiHost', 'usageApiPort', 'usageApiToken'}:
+            self.apply_config()
+            if changed & {'usageApiHost', 'usageApiPort'}:
+                self.stop()
+                self.start()
+
+    @property
+    def enabled(self) -> bool:
+        return self.port > 0
+
+    def _on_usage(self, delta: float) -> None:
+        """UsageTracker 的增量回调（在跟踪线程中）：到时间就重新生成使用时间的快照"""
+        if not self.enabled:
+            return
+        now = self.clock.time()
+        if now - self._built_at >= SNAPSHOT_SECONDS:
+            self._built_at = now
+            self.refresh()
+
+    def _on_profile_switched(self) -> None:
+        if self.enabled:
+            self._built_at = self.clock.time()
+            self.refresh()
+
+    def refresh(self) -> None:
+        """生成 /v1/today 和 /v1/history；在 UsageTracker 的跟踪线程中调用，直接读取它的字段"""
+        tracker = self.usage_tracker
+        now = self.clock.now()
+        today: Dict[str, Any] = {
+            'date': now.date().isoformat(),
+            'profile': self.config_manager.profile,
+            'time': now.isoformat(timespec='seconds'),
+            'usage_seconds': int(tracker.daily_usage_time),
+            'usage': tracker.format_time(tracker.daily_usage_time),
+            'continuous_seconds': int(tracker.continuous_usage_time),
+        }
+        if self.quota:
+            remaining = self.quota.remaining()
+            today['quota_remaining_seconds'] = None if remaining is None else int(remaining)
+        if self.calendar:
+            allowed_until = self.calendar.allowed_until(now)
+            today['zone'] = ZONE_NAMES[self.calendar.zone(now)]
+            today['allowed_until'] = allowed_until.isoformat(timespec='minutes') if allowed_until else None
+        history = dict(tracker.extra_stats.get('history', {}))
+        history[today['date']] = today['usage_seconds']
+        self.snapshots['/v1/today'] = json_snapshot(today)
+        self.snapshots['/v1/history'] = json_snapshot(
+            [{'date': day, 'usage_seconds': seconds} for day, seconds in sorted(history.items())])
+
+    def publish_frame(self, image: Image.Image) -> None:
+        """发送器截图后调用：生成缩略图快照。接口关闭时什么也不做"""
+        if not self.enabled:
+            return
+        try:
+            with REGISTRY.stage('usage_api', 'thumbnail') as stage:
+                thumbnail = image.convert('RGB')
+                thumbnail.thumbnail(THUMBNAIL_SIZE)
+                buffer = io.BytesIO()
+                thumbnail.save(buffer, format='JPEG', quality=70)
+                stage.bytes = buffer.tell()
+        except Exception as e:
+            self.logger.warning(f"Cannot create thumbnail: {e}")
+            return
+        self.snapshots['/v1/thumbnail.jpg'] = make_snapshot(buffer.getvalue(), 'image/jpeg')
+
+    def start(self) -> None:
+        with self._server_lock:
+            if not self.enabled or self.httpd is not None:
+                return
+            handler = type('UsageApiHandler', (_UsageApiHandler,), {'api': self})
+            try:
+                self.httpd = ThreadingHTTPServer((self.host, self.port), handler)
+            except OSError as e:
+                self.logger.error(f"Cannot start usage API on {self.host}:{self.port}: {e}")
+                return
+            self.httpd.daemon_threads = True
+            threading.Thread(target=self.httpd.serve_forever, name="usage-api-http", daemon=True).start()
+        # 快照只在跟踪线程中生成：标记为过期，跟踪线程下一秒重新生成
+        self._built_at = float('-inf')
+        self.logger.info(f"Usage API listening on http://{self.host}:{self.port}/v1/today")
+
+    def stop(self) -> None:
+        with self._server_lock:
+            if self.httpd:
+                self.httpd.shutdown()
+                self.httpd.server_close()
+                self.httpd = None
@@ -1,12 +1,25 @@
-from config_manager import ConfigManager
+from config_manager import PROFILE_KEY, ConfigManager
+from clock import Clock, SYSTEM_CLOCK
+from activity_probe import ActivityProbe, default_probe
 import os
-import time
 # import configparser # 移除，使用 ConfigManager
 import json
-import datetime
 import logging
+import re
 import threading
-from typing import Optional
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+# 使用统计中保留最近多少天的每日累计（history 字段）
+HISTORY_DAYS = 30
+
+
+def profile_stats_file(path: str, profile: str) -> str:
+    """用户各自的统计文件：usage_stats.json → usage_stats.alice.json；没有用户配置时不变"""
+    if not profile:
+        return path
+    root, ext = os.path.splitext(path)
+    name = re.sub(r'[^\w.-]', '_', profile)
+    return f"{root}.{name}{ext}"
 
 
 class UsageTracker:
@@ -20,47 +33,66 @@ class UsageTracker:
     last_check_time: float
     lock: threading.Lock
     continuous_usage_time: float
+    clock: Clock
+    probe: ActivityProbe
+    idle_threshold: int
+    previous_stats: Dict[str, Any]
+    extra_stats: Dict[str, Any]
 
-    def __init__(self, config_manager: ConfigManager) -> None:
+    def __init__(self, config_manager: ConfigManager, clock: Clock = SYSTEM_CLOCK,
+                 probe: Optional[ActivityProbe] = None) -> None:
         self.logger = logging.getLogger("UsageTracker")
         self.running = False
         self.config_manager = config_manager
+        self.clock = clock
+        self.probe = probe or default_probe()
 
-        # 从 ConfigManager 获取参数
-        # Note: get_setting can return None if fallback is None, ensure appropriate handling or default
-        data_folder_setting = self.config_manager.get_setting('Settings', 'dataFolder')
-        self.data_folder = str(data_folder_setting) if data_folder_setting is not None else ".\\default_data" # Ensure str
-
-        usage_stats_file_setting = self.config_manager.get_setting(
-            'Settings', 'usageStatsFile',
-            fallback=os.path.join(self.data_folder, 'usage_stats.json')
-        )
-        self.usage_stats_file = str(usage_stats_file_setting) if usage_stats_file_setting is not None else os.path.join(self.data_folder, 'usage_stats.json')
-
-
-        continuous_usage_threshold_setting = self.config_manager.get_setting(
-            'Settings', 'continuousUsageThreshold', type=int, fallback=600
-        )
-        self.continuous_usage_threshold = int(continuous_usage_threshold_setting) if continuous_usage_threshold_setting is not None else 600
-
+        self.apply_config()
+        self.config_manager.add_listener(self._on_config_changed)
 
         self.daily_usage_time = 0.0
-        self.last_check_time = time.time()
+        self.last_check_time = self.clock.time()
         self.lock = threading.Lock()
         self.continuous_usage_time = 0.0
+        # 启动时从文件读到的原始统计（可能是前一天的），以及其他组件随使用统计一起保存的字段
+        self.previous_stats = {}
+        self.extra_stats = {}
+        self._usage_listeners: List[Callable[[float], None]] = []
+        self._profile_listeners: List[Tuple[Optional[Callable[[], None]], Callable[[], None]]] = []
+        # 统计文件换了（切换用户）之后，原来的文件名；由跟踪线程完成切换
+        self._switch_from: Optional[str] = None
+
+        self.load_usage_stats()
+
+    def apply_config(self) -> None:
+        """从 ConfigManager 读取参数，初始化和配置热加载时都会调用"""
+        self.data_folder = str(self.config_manager.get('dataFolder'))
+        self.usage_stats_file = profile_stats_file(
+            str(self.config_manager.get('usageStatsFile')) or os.path.join(self.data_folder, 'usage_stats.json'),
+            self.config_manager.profile)
+        self.continuous_usage_threshold = int(self.config_manager.get('continuousUsageThreshold')) * 60
+        self.idle_threshold = int(self.config_manager.get('idleThresholdMinutes')) * 60
 
         os.makedirs(self.data_folder, exist_ok=True)
         self.logger.info(f"Data folder '{self.data_folder}' ensured to exist.")
 
-        self.load_usage_stats()
+    def _on_config_changed(self, changed: Set[str]) -> None:
+        if changed & {'dataFolder', 'usageStatsFile', 'continuousUsageThreshold', 'idleThresholdMinutes',
+                      PROFILE_KEY}:
+            previous_file = self.usage_stats_file
+            self.apply_config()
+            if self.usage_stats_file != previous_file and self._switch_from is None:
+                self._switch_from = previous_file
 
     def load_usage_stats(self) -> float:
         """从文件加载上次保存的使用统计，并根据日期判断是否重置"""
-        today_date = datetime.date.today().isoformat()
+        today_date = self.clock.today().isoformat()
         if os.path.exists(self.usage_stats_file):
             try:
                 with open(self.usage_stats_file, 'r') as f:
                     stats = json.load(f)
+                self.previous_stats = stats if isinstance(stats, dict) else {}
+                self.extra_stats['history'] = self._history(self.previous_stats, today_date)
 
                 if stats.get('today_date') == today_date:  # 使用 'today_date' 而不是 'date'
                     self.daily_usage_time = stats.get('daily_usage_time', 0)
@@ -71,7 +103,7 @@ class UsageTracker:
                     self.logger.info("New day detected. Daily usage time reset to 0.")
 
                 self.continuous_usage_time = 0
-                self.last_check_time = time.time()
+                self.last_check_time = self.clock.time()
 
             except json.JSONDecodeError as e:
                 self.logger.error(f"Error decoding JSON from usage stats file: {e}. Resetting stats.")
@@ -97,36 +129,86 @@ class UsageTracker:
         # These should always be reset at the end of loading stats,
         # as they pertain to the current session's tracking.
         self.continuous_usage_time = 0.0
-        self.last_check_time = time.time() # Ensures last_check_time is always set after loading/initializing.
+        self.last_check_time = self.clock.time() # Ensures last_check_time is always set after loading/initializing.
 
         return self.daily_usage_time
 
+    def _history(self, stats: Dict[str, Any], today_date: str) -> Dict[str, int]:
+        """之前各天的累计使用秒数；统计文件是前几天的，就把那一天的累计并入"""
+        history = stats.get('history')
+        history = dict(history) if isinstance(history, dict) else {}
+        day = stats.get('today_date')
+        if day and day != today_date and stats.get('daily_usage_time'):
+            history[day] = int(stats['daily_usage_time'])
+        return dict(sorted(history.items())[-HISTORY_DAYS:])
+
     def save_usage_stats(self) -> None:
         """保存当前的使用统计到文件"""
         with self.lock:
-            today_date = datetime.date.today().isoformat()
-            stats = {
-                'today_date': today_date,
-                'daily_usage_time': self.daily_usage_time
-            }
-            try:
-                with open(self.usage_stats_file, 'w') as f:
-                    json.dump(stats, f)
-                self.logger.info(
-                    f"Saved daily usage time to '{self.usage_stats_file}': {self.format_time(self.daily_usage_time)}")
-            except Exception as e:
-                self.logger.error(f"Error saving usage stats: {e}")
+            self._write_stats(self._switch_from or self.usage_stats_file)
+
+    def _write_stats(self, path: str) -> None:
+        """调用方持有锁"""
+        today_date = self.clock.today().isoformat()
+        stats = {
+            'today_date': today_date,
+            'daily_usage_time': self.daily_usage_time,
+            **self.extra_stats
+        }
+        try:
+            with open(path, 'w') as f:
+                json.dump(stats, f)
+            # 每次发送截图后都会保存，只在 DEBUG 级别记录
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("Saved daily usage time to '%s': %s", path, self.format_time(self.daily_usage_time))
+        except Exception as e:
+            self.logger.error(f"Error saving usage stats: {e}")
+
+    def add_profile_listener(self, on_switched: Callable[[], None],
+                             before_switch: Optional[Callable[[], None]] = None) -> None:
+        """
+        切换用户时在跟踪线程中调用：before_switch 在保存原来用户的统计之前（把自己的数据放进 extra_stats），
+        on_switched 在载入新用户的统计之后（从 previous_stats 重新开始）
+        """
+        self._profile_listeners.append((before_switch, on_switched))
+
+    def _switch_stats_file(self) -> None:
+        """把到现在为止的使用写入原来用户的文件，再载入新用户的统计；只在跟踪线程中调用"""
+        for before_switch, _ in self._profile_listeners:
+            if before_switch:
+                before_switch()
+        with self.lock:
+            self._write_stats(self._switch_from)
+            self._switch_from = None
+            self.daily_usage_time = 0.0
+            self.previous_stats = {}
+            self.extra_stats = {}
+            self.load_usage_stats()
+        self.logger.info(f"Switched usage stats to '{self.usage_stats_file}', "
+                         f"today {self.format_time(self.daily_usage_time)}")
+        for _, on_switched in self._profile_listeners:
+            on_switched()
+
+    def add_usage_listener(self, listener: Callable[[float], None]) -> None:
+        """每次累加使用时间后用本次的增量（秒）调用 listener，在跟踪线程中执行"""
+        self._usage_listeners.append(listener)
 
     def update_usage_time(self) -> None:
         """更新累计使用时间和连续使用时间"""
         with self.lock:
-            current_time = time.time()
+            current_time = self.clock.time()
             time_elapsed = current_time - self.last_check_time
             self.last_check_time = current_time
             self.daily_usage_time += time_elapsed
             self.continuous_usage_time += time_elapsed
-            self.logger.debug(
-                f"Added {time_elapsed:.2f} seconds of usage time. Total: {self.format_time(self.daily_usage_time)}, Continuous: {self.format_time(self.continuous_usage_time)}")
+            # 每秒调用一次：级别未开启时不格式化消息
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("Added %.2f seconds of usage time. Total: %s, Continuous: %s", time_elapsed,
+                                  self.format_time(self.daily_usage_time), self.format_time(self.continuous_usage_time))
+        for listener in self._usage_listeners:
+            listener(time_elapsed)
+        if self._switch_from is not None:
+            self._switch_stats_file()
 
     def get_usage_time(self) -> float:
         """获取当前累计使用时间"""
@@ -138,6 +220,23 @@ class UsageTracker:
         with self.lock:
             return self.continuous_usage_time
 
+    def heartbeat_state(self) -> Dict[str, Any]:
+        """心跳内容：今日累计、连续使用、是否空闲、前台程序"""
+        idle_seconds = self.probe.idle_seconds()
+        with self.lock:
+            daily, continuous = self.daily_usage_time, self.continuous_usage_time
+        return {
+            'daily': int(daily),
+            'continuous': int(continuous),
+            'idle': self.idle_threshold > 0 and idle_seconds >= self.idle_threshold,
+            'idle_seconds': int(idle_seconds),
+            'app': self.probe.active_app(),
+        }
+
+    def is_away(self) -> bool:
+        """用户不在电脑前：锁屏，或键鼠空闲超过 idleThresholdMinutes"""
+        return self.probe.locked() or (self.idle_threshold > 0 and self.probe.idle_seconds() >= self.idle_threshold)
+
     def reset_continuous_usage_time(self) -> None:
         """重置连续使用时间"""
         with self.lock:
@@ -151,7 +250,7 @@ class UsageTracker:
         try:
             while self.running:
                 self.update_usage_time()
-                time.sleep(1)
+                self.clock.sleep(1)
         except Exception as e:
             self.logger.critical(f"Error in tracking thread: {str(e)}")
         finally: